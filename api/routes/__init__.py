@@ -10,6 +10,7 @@ import psutil
 from pathlib import Path
 from ..middleware import skip_auth
 from ..config import config, API_VERSION
+from database import get_integrity_status
 
 # Initialize router and logger
 router = APIRouter()
@@ -151,6 +152,12 @@ async def health_check(request: Request):
     try:
         current_time = datetime.now(UTC)
         system_info = get_system_info()
+
+        try:
+            database_info = await get_integrity_status()
+        except Exception as e:
+            logger.error(f"Error reading integrity status: {e}")
+            database_info = {"status": "unavailable"}
         
         # Log health check
         logger.info(f"""
@@ -166,6 +173,7 @@ async def health_check(request: Request):
             "user": config._config["default_user"],
             "version": API_VERSION,
             "system": system_info,
+            "database": database_info,
             "endpoints": {
                 "base": "/api/v1",
                 "balance": "/api/v1/balance",
@@ -5,7 +5,7 @@ import jwt
 import logging
 import traceback
 from ..dependencies import get_bot
-from database import get_connection
+from database import db
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -79,9 +79,6 @@ async def verify_admin(token: str = None):
 async def get_admin_data(discord_id: str):
     """Get admin data from database"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
         query = """
             SELECT rp.role_id, rp.permissions, ug.discord_id
             FROM role_permissions rp
@@ -89,8 +86,7 @@ async def get_admin_data(discord_id: str):
             WHERE rp.role_id = 'admin'
         """
         
-        cursor.execute(query, (discord_id,))
-        result = cursor.fetchone()
+        result = await db.fetchone(query, (discord_id,))
         
         if result:
             return {
@@ -98,7 +94,7 @@ async def get_admin_data(discord_id: str):
                 "role": result[0],
                 "permissions": result[1]
             }
-            
+        
         return None
         
     except Exception as e:
@@ -110,7 +106,4 @@ async def get_admin_data(discord_id: str):
         Stack Trace:
         {traceback.format_exc()}
         """)
-        raise
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        raise
\ No newline at end of file
@@ -1,30 +1,27 @@
 from typing import Dict, List
 from discord.ext import commands
-from database import get_connection
+from database import db, cache
 from datetime import datetime, timedelta
 import bcrypt
 import logging
 
 logger = logging.getLogger(__name__)
 
+DASHBOARD_STATS_TTL = 60
+
 class AdminService:
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
     async def verify_admin(self, username: str, password: str) -> bool:
-        conn = None
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
             # Get admin credentials
-            cursor.execute("""
+            result = await db.fetchone("""
                 SELECT password_hash
                 FROM admins
                 WHERE username = ? AND is_active = 1
             """, (username,))
             
-            result = cursor.fetchone()
             if not result:
                 return False
                 
@@ -37,80 +34,76 @@ class AdminService:
         except Exception as e:
             logger.error(f"Error verifying admin: {e}")
             return False
-        finally:
-            if conn:
-                conn.close()
 
     async def get_dashboard_stats(self) -> Dict:
-        conn = None
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            # Get total users
-            cursor.execute("SELECT COUNT(*) as count FROM users")
-            total_users = cursor.fetchone()['count']
+            def _collect(conn):
+                cursor = conn.cursor()
             
-            # Get total stock
-            cursor.execute("SELECT COUNT(*) as count FROM stock WHERE status = 'available'")
-            total_stock = cursor.fetchone()['count']
+                # Get total users
+                cursor.execute("SELECT COUNT(*) as count FROM users")
+                total_users = cursor.fetchone()['count']
             
-            # Get today's sales
-            today = datetime.utcnow().date()
-            cursor.execute("""
-                SELECT COUNT(*) as count
-                FROM transactions
-                WHERE DATE(created_at) = ?
-                AND type = 'PURCHASE'
-            """, (today.isoformat(),))
-            today_sales = cursor.fetchone()['count']
+                # Get total stock
+                cursor.execute("SELECT COALESCE(SUM(count), 0) as count FROM product_stock_counts WHERE status = 'available'")
+                total_stock = cursor.fetchone()['count']
             
-            # Get total revenue
-            cursor.execute("""
-                SELECT SUM(total_price) as total
-                FROM transactions
-                WHERE type = 'PURCHASE'
-            """)
-            total_revenue = cursor.fetchone()['total'] or 0
-            
-            # Get recent transactions
-            cursor.execute("""
-                SELECT *
-                FROM transactions
-                ORDER BY created_at DESC
-                LIMIT 5
-            """)
-            recent_transactions = cursor.fetchall()
+                # Get total revenue; archived purchases still count
+                cursor.execute("""
+                    SELECT (SELECT COALESCE(SUM(total_price), 0) FROM transactions WHERE type = 'PURCHASE')
+                         + (SELECT COALESCE(SUM(total_price), 0) FROM transactions_archive WHERE type = 'PURCHASE')
+                      as total
+                """)
+                total_revenue = cursor.fetchone()['total']
             
-            # Get chart data (last 7 days)
-            labels = []
-            data = []
-            for i in range(6, -1, -1):
-                date = (today - timedelta(days=i))
-                labels.append(date.strftime("%Y-%m-%d"))
-                
+                # Get recent transactions
                 cursor.execute("""
-                    SELECT COUNT(*) as count
+                    SELECT *
                     FROM transactions
-                    WHERE DATE(created_at) = ?
-                    AND type = 'PURCHASE'
-                """, (date.isoformat(),))
-                count = cursor.fetchone()['count']
-                data.append(count)
+                    ORDER BY created_at DESC
+                    LIMIT 5
+                """)
+                recent_transactions = [dict(row) for row in cursor.fetchall()]
             
-            return {
-                "total_users": total_users,
-                "total_stock": total_stock,
-                "today_sales": today_sales,
-                "total_revenue": total_revenue,
-                "recent_transactions": recent_transactions,
-                "chart_labels": labels,
-                "chart_data": data
-            }
+                # Get chart data (last 7 days), today's sales included
+                today = datetime.utcnow().date()
+                first_day = today - timedelta(days=6)
+                cursor.execute("""
+                    SELECT DATE(created_at) as day, COUNT(*) as count FROM (
+                        SELECT created_at FROM transactions
+                        WHERE type = 'PURCHASE' AND created_at >= ?
+                        UNION ALL
+                        SELECT created_at FROM transactions_archive
+                        WHERE type = 'PURCHASE' AND created_at >= ?
+                    )
+                    GROUP BY day
+                """, (first_day.isoformat(), first_day.isoformat()))
+                daily = {row['day']: row['count'] for row in cursor.fetchall()}
+
+                labels = []
+                data = []
+                for i in range(6, -1, -1):
+                    date = (today - timedelta(days=i))
+                    labels.append(date.strftime("%Y-%m-%d"))
+                    data.append(daily.get(date.isoformat(), 0))
+                today_sales = daily.get(today.isoformat(), 0)
+            
+                return {
+                    "total_users": total_users,
+                    "total_stock": total_stock,
+                    "today_sales": today_sales,
+                    "total_revenue": total_revenue,
+                    "recent_transactions": recent_transactions,
+                    "chart_labels": labels,
+                    "chart_data": data
+                }
+
+            async def _compute():
+                return await db.run(_collect)
+
+            # Shared with the bot process and kept across restarts
+            return await cache.get_or_set("dashboard:stats", _compute, DASHBOARD_STATS_TTL)
             
         except Exception as e:
             logger.error(f"Error getting dashboard stats: {e}")
-            raise
-        finally:
-            if conn:
-                conn.close()
\ No newline at end of file
+            raise
\ No newline at end of file
@@ -1,40 +1,42 @@
 from typing import List, Optional, Dict
 from discord.ext import commands
-from database import get_connection
+from database import db, cache
 from ..models.stock import StockResponse, StockItem
 import logging
 
 logger = logging.getLogger(__name__)
 
+STOCK_LISTING_TTL = 30
+
 class StockService:
     def __init__(self, bot: commands.Bot):
         self.bot = bot
     
     async def get_all_stock(self) -> List[StockResponse]:
-        conn = None
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
             # Get all products with their stock count
-            cursor.execute("""
-                SELECT 
-                    p.code,
-                    p.name,
-                    p.price,
-                    COUNT(CASE WHEN s.status = 'available' THEN 1 END) as available,
-                    GROUP_CONCAT(
-                        CASE WHEN s.status = 'available' 
-                        THEN json_object('id', s.id, 'content', s.content, 'status', s.status)
-                        END
-                    ) as items
-                FROM products p
-                LEFT JOIN stock s ON p.code = s.product_code
-                GROUP BY p.code, p.name, p.price
-                ORDER BY p.code
-            """)
+            async def _fetch():
+                rows = await db.fetchall("""
+                    SELECT 
+                        p.code,
+                        p.name,
+                        p.price,
+                        COUNT(CASE WHEN s.status = 'available' THEN 1 END) as available,
+                        GROUP_CONCAT(
+                            CASE WHEN s.status = 'available' 
+                            THEN json_object('id', s.id, 'content', s.content, 'status', s.status)
+                            END
+                        ) as items
+                    FROM products p
+                    LEFT JOIN stock s ON p.code = s.product_code
+                    GROUP BY p.code, p.name, p.price
+                    ORDER BY p.code
+                """)
+                return [dict(row) for row in rows]
+
+            # Rendered listing is cached in the shared L2 cache
+            results = await cache.get_or_set("stock:all", _fetch, STOCK_LISTING_TTL)
             
-            results = cursor.fetchall()
             stock_list = []
             
             for row in results:
@@ -45,7 +47,7 @@ class StockService:
                         if item_data:
                             item_dict = eval(item_data)  # Convert string to dict
                             items.append(StockItem(**item_dict))
-                
+            
                 stock_list.append(StockResponse(
                     code=row['code'],
                     name=row['name'],
@@ -59,35 +61,31 @@ class StockService:
         except Exception as e:
             logger.error(f"Error getting all stock: {e}")
             raise
-        finally:
-            if conn:
-                conn.close()
     
     async def get_stock(self, product_code: str) -> Optional[StockResponse]:
-        conn = None
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
             # Get product details and available stock
-            cursor.execute("""
-                SELECT 
-                    p.code,
-                    p.name,
-                    p.price,
-                    COUNT(CASE WHEN s.status = 'available' THEN 1 END) as available,
-                    GROUP_CONCAT(
-                        CASE WHEN s.status = 'available' 
-                        THEN json_object('id', s.id, 'content', s.content, 'status', s.status)
-                        END
-                    ) as items
-                FROM products p
-                LEFT JOIN stock s ON p.code = s.product_code
-                WHERE p.code = ?
-                GROUP BY p.code, p.name, p.price
-            """, (product_code,))
+            async def _fetch():
+                row = await db.fetchone("""
+                    SELECT 
+                        p.code,
+                        p.name,
+                        p.price,
+                        COUNT(CASE WHEN s.status = 'available' THEN 1 END) as available,
+                        GROUP_CONCAT(
+                            CASE WHEN s.status = 'available' 
+                            THEN json_object('id', s.id, 'content', s.content, 'status', s.status)
+                            END
+                        ) as items
+                    FROM products p
+                    LEFT JOIN stock s ON p.code = s.product_code
+                    WHERE p.code = ?
+                    GROUP BY p.code, p.name, p.price
+                """, (product_code,))
+                return dict(row) if row else None
+
+            row = await cache.get_or_set(f"stock:{product_code}", _fetch, STOCK_LISTING_TTL)
             
-            row = cursor.fetchone()
             if not row:
                 return None
             
@@ -109,7 +107,4 @@ class StockService:
             
         except Exception as e:
             logger.error(f"Error getting stock for {product_code}: {e}")
-            raise
-        finally:
-            if conn:
-                conn.close()
\ No newline at end of file
+            raise
\ No newline at end of file
@@ -1,6 +1,6 @@
 from typing import List, Optional
 from discord.ext import commands
-from database import get_connection
+from database import db
 from ..models.transaction import TransactionResponse, TransactionCreate
 from datetime import datetime
 import logging
@@ -12,19 +12,14 @@ class TransactionService:
         self.bot = bot
     
     async def get_recent_transactions(self, limit: int = 10) -> List[TransactionResponse]:
-        conn = None
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
+            results = await db.fetchall("""
                 SELECT id, growid, type, details, old_balance, new_balance, created_at
                 FROM transactions
                 ORDER BY created_at DESC
                 LIMIT ?
             """, (limit,))
             
-            results = cursor.fetchall()
             transactions = []
             
             for row in results:
@@ -43,17 +38,10 @@ class TransactionService:
         except Exception as e:
             logger.error(f"Error getting recent transactions: {e}")
             raise
-        finally:
-            if conn:
-                conn.close()
     
     async def get_user_transactions(self, growid: str) -> List[TransactionResponse]:
-        conn = None
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
+            results = await db.fetchall("""
                 SELECT id, growid, type, details, old_balance, new_balance, created_at
                 FROM transactions
                 WHERE growid = ? COLLATE binary
@@ -61,7 +49,6 @@ class TransactionService:
                 LIMIT 50
             """, (growid,))
             
-            results = cursor.fetchall()
             transactions = []
             
             for row in results:
@@ -80,50 +67,40 @@ class TransactionService:
         except Exception as e:
             logger.error(f"Error getting transactions for {growid}: {e}")
             raise
-        finally:
-            if conn:
-                conn.close()
     
     async def create_transaction(self, transaction: TransactionCreate) -> TransactionResponse:
-        conn = None
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            # Begin transaction
-            conn.execute("BEGIN TRANSACTION")
-            
-            # Get current balance
-            cursor.execute("""
-                SELECT balance_wl, balance_dl, balance_bgl
-                FROM users
-                WHERE growid = ? COLLATE binary
-                FOR UPDATE
-            """, (transaction.growid,))
-            
-            result = cursor.fetchone()
-            if not result:
-                raise ValueError(f"GrowID {transaction.growid} not found")
-            
-            old_balance = f"{result['balance_wl']}|{result['balance_dl']}|{result['balance_bgl']}"
-            
-            # Insert transaction
-            cursor.execute("""
-                INSERT INTO transactions (
-                    growid, type, details, old_balance, new_balance, items_count
-                ) VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                transaction.growid,
-                transaction.type,
-                transaction.details,
-                old_balance,
-                old_balance,  # New balance will be updated by other services
-                1
-            ))
-            
-            transaction_id = cursor.lastrowid
+            def _create(cursor):
+                # Get current balance
+                cursor.execute("""
+                    SELECT balance_wl, balance_dl, balance_bgl
+                    FROM users
+                    WHERE growid = ? COLLATE binary
+                """, (transaction.growid,))
+            
+                result = cursor.fetchone()
+                if not result:
+                    raise ValueError(f"GrowID {transaction.growid} not found")
+            
+                old_balance = f"{result['balance_wl']}|{result['balance_dl']}|{result['balance_bgl']}"
+            
+                # Insert transaction
+                cursor.execute("""
+                    INSERT INTO transactions (
+                        growid, type, details, old_balance, new_balance, items_count
+                    ) VALUES (?, ?, ?, ?, ?, ?)
+                """, (
+                    transaction.growid,
+                    transaction.type,
+                    transaction.details,
+                    old_balance,
+                    old_balance,  # New balance will be updated by other services
+                    1
+                ))
             
-            conn.commit()
+                return cursor.lastrowid, old_balance
+
+            transaction_id, old_balance = await db.transaction(_create)
             logger.info(f"Created transaction for {transaction.growid}: {transaction.type}")
             
             # Return created transaction
@@ -138,10 +115,5 @@ class TransactionService:
             )
             
         except Exception as e:
-            if conn:
-                conn.rollback()
             logger.error(f"Error creating transaction for {transaction.growid}: {e}")
-            raise
-        finally:
-            if conn:
-                conn.close()
\ No newline at end of file
+            raise
\ No newline at end of file
@@ -0,0 +1,294 @@
+"""Concurrent-buyer purchase benchmark and oversell stress test.
+
+Builds a scratch shop.db with synthetic products, stock and users, points
+the shared database layer at it and fires concurrent purchases through
+the real ``TransactionManager`` using a fake bot. Reports throughput,
+latency percentiles, writer queue wait (the single writer is where buyers
+wait for the lock) and busy/timeout errors, then checks the invariants:
+no stock row sold twice, no oversell, and every balance matches its
+PURCHASE ledger.
+
+Runs offline from the repository root:
+
+    python -m benchmarks.purchase_stress --buyers 50 --stock 40
+    python -m benchmarks.purchase_stress --buyers 200 --products 3 --rounds 5 --json
+
+Exits with status 1 when an invariant is violated.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from database import configure, migrate, db, pool, writer, DatabaseTimeout, stock_content_hash
+
+from ext.constants import TransactionError
+from ext.trx import TransactionManager
+
+logger = logging.getLogger("purchase_stress")
+
+class FakeUser:
+    """Just enough of discord.User for the outbox payloads"""
+
+    def __init__(self, user_id: int, name: str):
+        self.id = user_id
+        self.name = name
+
+class FakeBot:
+    """Stands in for MyBot; records dispatched events instead of running cogs"""
+
+    def __init__(self):
+        self.log_purchase_channel_id = 0
+        self.events = {}
+
+    def dispatch(self, event: str, *args):
+        self.events[event] = self.events.get(event, 0) + 1
+
+    def get_channel(self, channel_id):
+        return None
+
+    def get_user(self, user_id):
+        return None
+
+def build_fixture(path: str, products: int, stock: int, buyers: int, balance: int, price: int) -> Dict:
+    """Create and fill a scratch database; returns what was seeded"""
+    migrate(path)
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            codes = [f"P{index}" for index in range(products)]
+            conn.executemany(
+                "INSERT INTO products (code, name, price) VALUES (?, ?, ?)",
+                [(code, f"Product {code}", price) for code in codes]
+            )
+            conn.executemany(
+                "INSERT INTO stock (product_code, content, content_hash, added_by) VALUES (?, ?, ?, 'bench')",
+                [(code, content, stock_content_hash(content))
+                 for code in codes for content in (f"{code}-item-{index}" for index in range(stock))]
+            )
+            growids = [f"buyer{index}" for index in range(buyers)]
+            conn.executemany(
+                "INSERT INTO users (growid, balance_wl) VALUES (?, ?)",
+                [(growid, balance) for growid in growids]
+            )
+    finally:
+        conn.close()
+    return {'codes': codes, 'growids': growids, 'balance': balance}
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+async def run_round(trx_manager: TransactionManager, fixture: Dict, quantity: int,
+                    with_buyer: bool, results: Dict):
+    async def _buy(index: int, growid: str):
+        code = random.choice(fixture['codes'])
+        buyer = FakeUser(10_000 + index, growid) if with_buyer else None
+        start = time.perf_counter()
+        try:
+            result = await trx_manager.process_purchase(growid, code, quantity, buyer=buyer)
+            results['latencies'].append(time.perf_counter() - start)
+            results['succeeded'] += 1
+            results['items'].extend(item['id'] for item in result['items'])
+        except TransactionError as e:
+            results['latencies'].append(time.perf_counter() - start)
+            reason = str(e)
+            key = 'sold_out' if 'Insufficient stock' in reason else 'insufficient_balance' if 'balance' in reason else 'rejected'
+            results[key] += 1
+        except DatabaseTimeout:
+            results['timeouts'] += 1
+        except sqlite3.OperationalError as e:
+            if 'locked' in str(e) or 'busy' in str(e):
+                results['busy_errors'] += 1
+            else:
+                results['errors'].append(repr(e))
+        except Exception as e:
+            results['errors'].append(repr(e))
+
+    await asyncio.gather(*(_buy(index, growid) for index, growid in enumerate(fixture['growids'])))
+
+def check_invariants(path: str, fixture: Dict, stock: int, sold_ids: List[int]) -> List[str]:
+    """Return a description of every violated invariant"""
+    problems = []
+    if len(sold_ids) != len(set(sold_ids)):
+        problems.append(f"{len(sold_ids) - len(set(sold_ids))} stock rows were handed to more than one buyer")
+
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        duplicated = conn.execute("""
+            SELECT COUNT(*) FROM (
+                SELECT stock_id FROM order_items GROUP BY stock_id HAVING COUNT(*) > 1
+            )
+        """).fetchone()[0]
+        if duplicated:
+            problems.append(f"{duplicated} stock rows appear in more than one order")
+
+        for row in conn.execute("""
+            SELECT product_code, COUNT(*) as sold FROM stock
+            WHERE status = 'sold' GROUP BY product_code
+        """):
+            if row['sold'] > stock:
+                problems.append(f"{row['product_code']} oversold: {row['sold']} of {stock}")
+
+        sold = conn.execute("SELECT COUNT(*) FROM stock WHERE status = 'sold'").fetchone()[0]
+        if sold != len(sold_ids):
+            problems.append(f"{sold} rows marked sold but buyers received {len(sold_ids)}")
+
+        linked = conn.execute("SELECT COUNT(*) FROM order_items").fetchone()[0]
+        if linked != sold:
+            problems.append(f"{linked} order_items rows for {sold} sold rows")
+
+        for row in conn.execute("""
+            SELECT u.growid, u.balance_wl,
+                   COALESCE(SUM(t.total_price), 0) as spent
+            FROM users u
+            LEFT JOIN transactions t ON t.growid = u.growid AND t.type = 'PURCHASE'
+            WHERE u.growid LIKE 'buyer%'
+            GROUP BY u.growid
+        """):
+            if row['balance_wl'] != fixture['balance'] - row['spent']:
+                problems.append(
+                    f"{row['growid']} balance {row['balance_wl']} does not match ledger "
+                    f"({fixture['balance']} - {row['spent']})"
+                )
+            if row['balance_wl'] < 0:
+                problems.append(f"{row['growid']} balance went negative")
+
+        counted = conn.execute(
+            "SELECT COALESCE(SUM(count), 0) FROM product_stock_counts WHERE status = 'sold'"
+        ).fetchone()[0]
+        if counted != sold:
+            problems.append(f"product_stock_counts says {counted} sold, stock table says {sold}")
+    finally:
+        conn.close()
+    return problems
+
+async def run(args) -> Dict:
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="purchase_stress_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    path = str(workdir / "shop.db")
+    fixture = build_fixture(path, args.products, args.stock, args.buyers, args.balance, args.price)
+    configure(path)
+
+    trx_manager = TransactionManager(FakeBot())
+    results = {
+        'succeeded': 0, 'sold_out': 0, 'insufficient_balance': 0, 'rejected': 0,
+        'timeouts': 0, 'busy_errors': 0, 'errors': [], 'latencies': [], 'items': []
+    }
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        await run_round(trx_manager, fixture, args.quantity, args.with_buyer, results)
+    elapsed = time.perf_counter() - start
+
+    writer_stats = writer.get_stats()
+    pool_stats = pool.get_stats()
+    problems = check_invariants(path, fixture, args.stock, results['items'])
+    latencies = results['latencies']
+    attempts = args.buyers * args.rounds
+
+    return {
+        'database': path,
+        'buyers': args.buyers,
+        'rounds': args.rounds,
+        'products': args.products,
+        'stock_per_product': args.stock,
+        'quantity': args.quantity,
+        'attempts': attempts,
+        'succeeded': results['succeeded'],
+        'sold_out': results['sold_out'],
+        'insufficient_balance': results['insufficient_balance'],
+        'rejected': results['rejected'],
+        'timeouts': results['timeouts'],
+        'busy_errors': results['busy_errors'],
+        'errors': results['errors'][:10],
+        'elapsed_s': round(elapsed, 4),
+        'throughput_per_s': round(attempts / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 2),
+            'p99': round(percentile(latencies, 99) * 1000, 2),
+            'max': round(max(latencies, default=0) * 1000, 2)
+        },
+        'lock_wait_ms': {
+            'writer_avg': round(writer_stats['avg_queue_wait'] * 1000, 2),
+            'writer_max': round(writer_stats['max_queue_wait'] * 1000, 2),
+            'pool_avg': round(pool_stats['avg_wait'] * 1000, 2),
+            'pool_max': round(pool_stats['max_wait'] * 1000, 2)
+        },
+        'writer': {
+            'batches': writer_stats['batches'],
+            'avg_batch': round(writer_stats['avg_batch'], 2),
+            'max_batch': writer_stats['max_batch'],
+            'failed_batches': writer_stats['failed_batches']
+        },
+        'invariant_violations': problems
+    }
+
+def print_report(report: Dict):
+    print(f"Purchase stress: {report['buyers']} buyers x {report['rounds']} rounds, "
+          f"{report['products']} products x {report['stock_per_product']} stock, qty {report['quantity']}")
+    print(f"  database        {report['database']}")
+    print(f"  attempts        {report['attempts']} in {report['elapsed_s']}s "
+          f"({report['throughput_per_s']}/s)")
+    print(f"  succeeded       {report['succeeded']}  sold out {report['sold_out']}  "
+          f"no balance {report['insufficient_balance']}  rejected {report['rejected']}")
+    print(f"  latency ms      p50 {report['latency_ms']['p50']}  p99 {report['latency_ms']['p99']}  "
+          f"max {report['latency_ms']['max']}")
+    print(f"  lock wait ms    writer avg {report['lock_wait_ms']['writer_avg']} max {report['lock_wait_ms']['writer_max']}  "
+          f"pool avg {report['lock_wait_ms']['pool_avg']} max {report['lock_wait_ms']['pool_max']}")
+    print(f"  writer          {report['writer']['batches']} batches, avg {report['writer']['avg_batch']} "
+          f"max {report['writer']['max_batch']} jobs/batch, {report['writer']['failed_batches']} failed")
+    print(f"  busy / timeout  {report['busy_errors']} / {report['timeouts']}")
+    for error in report['errors']:
+        print(f"  error           {error}")
+    if report['invariant_violations']:
+        for problem in report['invariant_violations']:
+            print(f"  VIOLATION       {problem}")
+    else:
+        print("  invariants      ok")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--buyers', type=int, default=50, help="concurrent buyers per round")
+    parser.add_argument('--rounds', type=int, default=1)
+    parser.add_argument('--products', type=int, default=1)
+    parser.add_argument('--stock', type=int, default=40, help="stock rows per product")
+    parser.add_argument('--quantity', type=int, default=1, help="items per purchase")
+    parser.add_argument('--price', type=int, default=10)
+    parser.add_argument('--balance', type=int, default=1000, help="starting balance per buyer")
+    parser.add_argument('--with-buyer', action='store_true', help="queue outbox DMs/logs like a real purchase")
+    parser.add_argument('--workdir', help="keep the scratch database here instead of a temp dir")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # Sold-out rejections are expected here and logged as errors by the service
+    logging.getLogger("TransactionManager").setLevel(logging.CRITICAL)
+    random.seed(args.seed)
+
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        db.close()
+        pool.close()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    sys.exit(1 if report['invariant_violations'] else 0)
+
+if __name__ == '__main__':
+    main()
@@ -4,12 +4,15 @@ import logging
 from datetime import datetime, timedelta
 import json
 import asyncio
-from typing import Optional, List
+import os
+import tempfile
+import time
+from typing import Iterator, Optional, List
 import io
 import psutil
 import platform
 import aiohttp
-from database import get_connection
+from database import db, rebuild_stock_counts
 import jwt
 from datetime import datetime, timedelta
 from api.config import API_SECRET_KEY
@@ -20,7 +23,16 @@ from ext.constants import (
     TRANSACTION_ADMIN_REMOVE,
     TRANSACTION_ADMIN_RESET,
     MAX_STOCK_FILE_SIZE,
-    VALID_STOCK_FORMATS
+    MESSAGES,
+    STOCK_DOWNLOAD_CHUNK,
+    VALID_STOCK_FORMATS,
+    PROGRESS_UPDATE_INTERVAL,
+    IMPORT_ADDED,
+    IMPORT_EXISTS,
+    IMPORT_DUPLICATE,
+    IMPORT_INVALID,
+    IMPORT_EMPTY,
+    MAX_REJECT_REPORT_LINES
 )
 from ext.balance_manager import BalanceManagerService
 from ext.product_manager import ProductManagerService
@@ -42,10 +54,14 @@ class AdminCog(commands.Cog, name="Admin"):
         self.trx_manager = TransactionManager(bot)
         
         # Load admin configuration
+        self.max_stock_file_size = MAX_STOCK_FILE_SIZE
         try:
             with open('config.json') as f:
                 config = json.load(f)
                 self.admin_id = int(config['admin_id'])
+                stock_import = config.get('stock_import', {})
+                if 'max_file_size_mb' in stock_import:
+                    self.max_stock_file_size = int(stock_import['max_file_size_mb'] * 1024 * 1024)
                 self.logger.info(f"Admin ID loaded: {self.admin_id}")
         except Exception as e:
             self.logger.error(f"Failed to load admin_id: {e}")
@@ -59,23 +75,49 @@ class AdminCog(commands.Cog, name="Admin"):
             self.logger.warning(f"Unauthorized access attempt by {ctx.author} (ID: {ctx.author.id})")
         return is_admin
 
-    async def _process_stock_file(self, attachment) -> List[str]:
-        """Process uploaded stock file"""
-        if attachment.size > MAX_STOCK_FILE_SIZE:
-            raise ValueError(f"File too large! Maximum size is {MAX_STOCK_FILE_SIZE/1024:.0f}KB")
+    async def _process_stock_file(self, attachment) -> str:
+        """Stream an uploaded stock file to a temp file; returns its path.
+
+        The attachment is downloaded in STOCK_DOWNLOAD_CHUNK pieces so a
+        file of several hundred MB never sits in memory. The caller removes
+        the temp file.
+        """
+        if attachment.size > self.max_stock_file_size:
+            raise ValueError(self._file_too_large_message())
             
         file_ext = attachment.filename.split('.')[-1].lower()
         if file_ext not in VALID_STOCK_FORMATS:
-            raise ValueError(f"Invalid file format! Supported formats: {', '.join(VALID_STOCK_FORMATS)}")
-            
-        content = await attachment.read()
-        text = content.decode('utf-8').strip()
-        
-        items = [line.strip() for line in text.split('\n') if line.strip()]
-        if not items:
-            raise ValueError("No valid items found in file!")
-            
-        return items
+            raise ValueError(f"❌ Invalid file format! Supported formats: {', '.join(VALID_STOCK_FORMATS)}")
+
+        fd, path = tempfile.mkstemp(prefix="stock_", suffix=f".{file_ext}")
+        try:
+            received = 0
+            with os.fdopen(fd, 'wb') as f:
+                async with self.bot.session.get(attachment.url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.content.iter_chunked(STOCK_DOWNLOAD_CHUNK):
+                        received += len(chunk)
+                        if received > self.max_stock_file_size:
+                            raise ValueError(self._file_too_large_message())
+                        f.write(chunk)
+            return path
+        except BaseException:
+            os.remove(path)
+            raise
+
+    def _file_too_large_message(self) -> str:
+        return MESSAGES['FILE_TOO_LARGE'].format(max_mb=f"{self.max_stock_file_size / (1024 * 1024):.0f}")
+
+    @staticmethod
+    def _iter_stock_lines(path: str) -> Iterator[str]:
+        """Decode a stock file one line at a time.
+
+        Bytes that are not UTF-8 become U+FFFD instead of aborting the import
+        halfway; LineValidator rejects those lines into the report.
+        """
+        with open(path, encoding='utf-8-sig', errors='replace', newline=None) as f:
+            for line in f:
+                yield line.rstrip('\n')
 
     async def _confirm_action(self, ctx, message: str, timeout: int = 30) -> bool:
         """Get confirmation for dangerous actions"""
@@ -133,7 +175,8 @@ class AdminCog(commands.Cog, name="Admin"):
                     "`announcement <message>`\nSend announcement to all users",
                     "`maintenance <on/off>`\nToggle maintenance mode",
                     "`blacklist <add/remove> <growid>`\nManage blacklisted users",
-                    "`backup`\nCreate database backup"
+                    "`backup`\nCreate database backup",
+                    "`rebuildcounts`\nRebuild stock counters from stock table"
                 ]
             }
 
@@ -214,51 +257,60 @@ class AdminCog(commands.Cog, name="Admin"):
                 await ctx.send(f"❌ Produk dengan kode `{code}` tidak ditemukan!")
                 return
             
-            # Proses file stock
-            attachment = ctx.message.attachments[0]
-            
-            # Cek ukuran file
-            if attachment.size > 1024 * 1024:  # Max 1MB
-                await ctx.send("❌ File terlalu besar! Maksimal 1MB")
-                return
-    
-            # Cek ekstensi file
-            if not attachment.filename.endswith('.txt'):
-                await ctx.send("❌ File harus berformat .txt!")
+            # Download file stock ke temp file secara streaming
+            try:
+                path = await self._process_stock_file(ctx.message.attachments[0])
+            except ValueError as e:
+                await ctx.send(str(e))
                 return
-    
-            # Baca konten file
-            content = await attachment.read()
-            text = content.decode('utf-8').strip()
-            
-            # Split per baris dan bersihkan
-            items = [line.strip() for line in text.split('\n') if line.strip()]
-            
-            if not items:
+
+            lines = self._iter_stock_lines(path)
+            progress_msg = None
+            try:
+                # Progress message, diedit paling sering tiap PROGRESS_UPDATE_INTERVAL detik
+                progress_msg = await ctx.send("⏳ Menambahkan stock...")
+                last_update = time.monotonic()
+
+                async def _progress(done: int, total: Optional[int]):
+                    nonlocal last_update
+                    now = time.monotonic()
+                    if now - last_update < PROGRESS_UPDATE_INTERVAL:
+                        return
+                    last_update = now
+                    try:
+                        await progress_msg.edit(content=f"⏳ Progress: {done} baris diproses...")
+                    except discord.HTTPException as e:
+                        self.logger.warning(f"Failed to update stock progress: {e}")
+
+                # Laporan baris yang ditolak, dibatasi MAX_REJECT_REPORT_LINES baris
+                report = io.StringIO()
+                reported = 0
+
+                def _on_rejected(rejected: List[dict]):
+                    nonlocal reported
+                    for item in rejected:
+                        if item['status'] == IMPORT_EMPTY or reported >= MAX_REJECT_REPORT_LINES:
+                            continue
+                        report.write(f"{item['line']}\t{item['status']}\t{item.get('reason', '')}\t{item['content']}\n")
+                        reported += 1
+
+                result = await self.product_service.add_stock_bulk(
+                    code, lines, str(ctx.author.id),
+                    progress=_progress, keep_results=False, on_rejected=_on_rejected
+                )
+            finally:
+                lines.close()
+                os.remove(path)
+                # Hapus pesan progress, juga kalau import gagal
+                if progress_msg is not None:
+                    try:
+                        await progress_msg.delete()
+                    except discord.HTTPException as e:
+                        self.logger.warning(f"Failed to delete stock progress message: {e}")
+
+            if result['total'] == result[IMPORT_EMPTY]:
                 await ctx.send("❌ File kosong atau tidak ada stock valid!")
                 return
-    
-            # Progress message
-            progress_msg = await ctx.send(f"⏳ Menambahkan {len(items)} stock...")
-            
-            # Tambah stock dengan progress
-            added = 0
-            failed = 0
-            
-            for i, item in enumerate(items, 1):
-                try:
-                    await self.product_service.add_stock_item(code, item, str(ctx.author.id))
-                    added += 1
-                    
-                    # Update progress setiap 10 item
-                    if i % 10 == 0:
-                        await progress_msg.edit(content=f"⏳ Progress: {i}/{len(items)} stock...")
-                except Exception as e:
-                    self.logger.error(f"Failed to add stock item {item}: {e}")
-                    failed += 1
-    
-            # Hapus pesan progress
-            await progress_msg.delete()
             
             # Kirim hasil
             embed = discord.Embed(
@@ -267,12 +319,26 @@ class AdminCog(commands.Cog, name="Admin"):
                 timestamp=datetime.utcnow()
             )
             embed.add_field(name="Produk", value=f"{product['name']} ({code})", inline=False)
-            embed.add_field(name="Total Stock", value=len(items), inline=True)
-            embed.add_field(name="Berhasil", value=added, inline=True)
-            embed.add_field(name="Gagal", value=failed, inline=True)
-            
-            await ctx.send(embed=embed)
-            self.logger.info(f"Stock added for {code} by {ctx.author}: {added} success, {failed} failed")
+            embed.add_field(name="Total Baris", value=result['total'], inline=True)
+            embed.add_field(name="Berhasil", value=result[IMPORT_ADDED], inline=True)
+            embed.add_field(name="Sudah Ada", value=result[IMPORT_EXISTS], inline=True)
+            embed.add_field(name="Duplikat di File", value=result[IMPORT_DUPLICATE], inline=True)
+            embed.add_field(name="Format Salah", value=result[IMPORT_INVALID], inline=True)
+            embed.add_field(name="Baris Kosong", value=result[IMPORT_EMPTY], inline=True)
+            
+            rejected = result['total'] - result[IMPORT_ADDED] - result[IMPORT_EMPTY]
+            if reported:
+                if reported < rejected:
+                    report.write(f"... {rejected - reported} baris lainnya tidak ditampilkan\n")
+                report.seek(0)
+                embed.set_footer(text="Baris yang ditolak ada di file terlampir")
+                await ctx.send(embed=embed, file=discord.File(report, filename=f"rejected_{code}.txt"))
+            else:
+                await ctx.send(embed=embed)
+            self.logger.info(
+                f"Stock added for {code} by {ctx.author}: {result[IMPORT_ADDED]} success, "
+                f"{result['total'] - result[IMPORT_ADDED]} skipped"
+            )
                 
         except Exception as e:
             await ctx.send(f"❌ Error: {str(e)}")
@@ -329,7 +395,7 @@ class AdminCog(commands.Cog, name="Admin"):
     
         try:
             # Gunakan get_transaction_history dari trx_manager
-            transactions = await self.trx_manager.get_transaction_history(growid, limit)
+            transactions = await self.trx_manager.get_transaction_history(growid, limit, include_archive=True)
             if not transactions:
                 await ctx.send(f"❌ No transactions found for {growid}")
                 return
@@ -752,15 +818,7 @@ class AdminCog(commands.Cog, name="Admin"):
                 return
 
             # Get all users from database
-            conn = None
-            try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                cursor.execute("SELECT DISTINCT discord_id FROM user_growid")
-                users = cursor.fetchall()
-            finally:
-                if conn:
-                    conn.close()
+            users = await db.fetchall("SELECT DISTINCT discord_id FROM user_growid")
 
             embed = discord.Embed(
                 title="📢 Announcement",
@@ -817,18 +875,10 @@ class AdminCog(commands.Cog, name="Admin"):
                 return
 
             # Update maintenance status in database
-            conn = None
-            try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT OR REPLACE INTO bot_settings (key, value) VALUES (?, ?)",
-                    ("maintenance_mode", "1" if mode == "on" else "0")
-                )
-                conn.commit()
-            finally:
-                if conn:
-                    conn.close()
+            await db.execute(
+                "INSERT OR REPLACE INTO bot_settings (key, value) VALUES (?, ?)",
+                ("maintenance_mode", "1" if mode == "on" else "0")
+            )
 
             embed = discord.Embed(
                 title="🔧 Maintenance Mode",
@@ -871,17 +921,12 @@ class AdminCog(commands.Cog, name="Admin"):
                 await ctx.send("❌ Please specify 'add' or 'remove'")
                 return
 
-            conn = None
-            try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
+            def _update_blacklist(cursor):
                 if action == "add":
                     # Check if user exists
                     cursor.execute("SELECT growid FROM users WHERE growid = ?", (growid,))  # Removed ()
                     if not cursor.fetchone():
-                        await ctx.send(f"❌ User {growid} not found!")
-                        return
+                        return False
 
                     # Add to blacklist
                     cursor.execute(
@@ -894,23 +939,24 @@ class AdminCog(commands.Cog, name="Admin"):
                         "DELETE FROM blacklist WHERE growid = ?",
                         (growid,)  # Removed ()
                     )
+                return True
 
-                conn.commit()
+            user_exists = await db.transaction(_update_blacklist)
 
-                embed = discord.Embed(
-                    title="⛔ Blacklist Updated",
-                    description=f"User {growid} has been {'added to' if action == 'add' else 'removed from'} the blacklist.",  # Removed ()
-                    color=discord.Color.red() if action == 'add' else discord.Color.green(),
-                    timestamp=datetime.utcnow()
-                )
-                embed.set_footer(text=f"Updated by {ctx.author}")
-                
-                await ctx.send(embed=embed)
-                self.logger.info(f"User {growid} {action}ed to blacklist by {ctx.author}")
-                
-            finally:
-                if conn:
-                    conn.close()
+            if not user_exists:
+                await ctx.send(f"❌ User {growid} not found!")
+                return
+
+            embed = discord.Embed(
+                title="⛔ Blacklist Updated",
+                description=f"User {growid} has been {'added to' if action == 'add' else 'removed from'} the blacklist.",  # Removed ()
+                color=discord.Color.red() if action == 'add' else discord.Color.green(),
+                timestamp=datetime.utcnow()
+            )
+            embed.set_footer(text=f"Updated by {ctx.author}")
+            
+            await ctx.send(embed=embed)
+            self.logger.info(f"User {growid} {action}ed to blacklist by {ctx.author}")
             
         except Exception as e:
             await ctx.send(f"❌ Error: {str(e)}")
@@ -927,31 +973,43 @@ class AdminCog(commands.Cog, name="Admin"):
             timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
             backup_filename = f"backup_{timestamp}.db"
             
-            # Create backup
-            conn = None
-            try:
-                conn = get_connection()
-                # Create backup in memory
-                backup_data = io.BytesIO()
+            # Create backup in memory
+            def _dump(conn):
+                data = io.BytesIO()
                 for line in conn.iterdump():
-                    backup_data.write(f'{line}\n'.encode('utf-8'))
-                backup_data.seek(0)
-                
-                # Send backup file
-                await ctx.send(
-                    "✅ Database backup created!",
-                    file=discord.File(backup_data, filename=backup_filename)
-                )
-                self.logger.info(f"Database backup created by {ctx.author}")
-                
-            finally:
-                if conn:
-                    conn.close()
+                    data.write(f'{line}\n'.encode('utf-8'))
+                return data
+
+            backup_data = await db.run(_dump, timeout=120)
+            backup_data.seek(0)
+            
+            # Send backup file
+            await ctx.send(
+                "✅ Database backup created!",
+                file=discord.File(backup_data, filename=backup_filename)
+            )
+            self.logger.info(f"Database backup created by {ctx.author}")
             
         except Exception as e:
             await ctx.send(f"❌ Error: {str(e)}")
             self.logger.error(f"Error creating backup: {e}")
 
+    @commands.command(name="rebuildcounts")
+    async def rebuild_counts(self, ctx):
+        """Rebuild product stock counters"""
+        if not await self._check_admin(ctx):
+            return
+
+        try:
+            rows = await rebuild_stock_counts()
+            self.product_service.invalidate_cache()
+            await ctx.send(f"✅ Stock counters rebuilt ({rows} rows)")
+            self.logger.info(f"Stock counters rebuilt by {ctx.author}")
+
+        except Exception as e:
+            await ctx.send(f"❌ Error: {str(e)}")
+            self.logger.error(f"Error rebuilding stock counters: {e}")
+
 async def setup(bot):
     """Setup the Admin cog"""
     try:
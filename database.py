@@ -1,25 +1,78 @@
 import sqlite3
 import logging
+import hashlib
+import re
+import json
 import time
-from datetime import datetime
-from typing import Optional
+import asyncio
+import threading
+import queue
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
-def get_connection(max_retries: int = 3, timeout: int = 5) -> sqlite3.Connection:
-    """Get SQLite database connection with retry mechanism"""
+DB_FILE = 'shop.db'
+POOL_MAX_SIZE = 8
+POOL_ACQUIRE_TIMEOUT = 5
+DB_EXECUTOR_WORKERS = POOL_MAX_SIZE
+DB_QUERY_TIMEOUT = 10
+WRITE_MAX_BATCH = 64
+MIGRATIONS_DIR = Path(__file__).resolve().parent / 'migrations'
+ONLINE_INDEX_MIN_ROWS = 50000
+ONLINE_INDEX_TIMEOUT = 600
+INTEGRITY_QUICK_INTERVAL = 6 * 3600
+INTEGRITY_FULL_CHECK_HOUR = 4
+INTEGRITY_MAX_ERRORS = 20
+CACHE_DEFAULT_TTL = 300
+CACHE_SWEEP_INTERVAL = 300
+CACHE_SWEEP_CHUNK = 500
+ARCHIVE_STOCK_DAYS = 30
+ARCHIVE_TRANSACTION_DAYS = 90
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_INTERVAL = 3600
+OUTBOX_RETENTION_DAYS = 7
+IDEMPOTENCY_RETENTION_DAYS = 7
+STOCK_HASH_SIZE = 16  # bytes of BLAKE2b in stock.content_hash
+
+_MIGRATION_FILE_RE = re.compile(r'^(\d+)_(\w+)\.sql$')
+_CREATE_INDEX_RE = re.compile(
+    r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s+ON\s+(\w+)',
+    re.IGNORECASE
+)
+_ONLINE_MARKER = '-- @online'
+
+def stock_content_hash(content: str) -> bytes:
+    """Fixed-width key for ``stock.content``; pass content already stripped"""
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=STOCK_HASH_SIZE).digest()
+
+def _configure_connection(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Apply row factory, per-connection pragmas and SQL functions"""
+    conn.row_factory = sqlite3.Row
+    conn.create_function('stock_content_hash', 1, stock_content_hash, deterministic=True)
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA foreign_keys = ON")
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute("PRAGMA busy_timeout = 5000")
+    cursor.close()
+    return conn
+
+def get_connection(max_retries: int = 3, timeout: int = 5,
+                   database: Optional[str] = None) -> sqlite3.Connection:
+    """Get a standalone SQLite database connection with retry mechanism.
+
+    Services should use the shared ``pool`` instead; this is kept for
+    one-off scripts, backups and schema setup.
+    """
     for attempt in range(max_retries):
         try:
-            conn = sqlite3.connect('shop.db', timeout=timeout)
-            conn.row_factory = sqlite3.Row
-            
-            # Enable foreign keys and set pragmas
-            cursor = conn.cursor()
-            cursor.execute("PRAGMA foreign_keys = ON")
-            cursor.execute("PRAGMA journal_mode = WAL")
-            cursor.execute("PRAGMA busy_timeout = 5000")
-            
-            return conn
+            conn = sqlite3.connect(database or DB_FILE, timeout=timeout)
+            return _configure_connection(conn)
         except sqlite3.Error as e:
             if attempt == max_retries - 1:
                 logger.error(f"Failed to connect to database after {max_retries} attempts: {e}")
@@ -27,260 +80,1302 @@ def get_connection(max_retries: int = 3, timeout: int = 5) -> sqlite3.Connection
             logger.warning(f"Database connection attempt {attempt + 1} failed, retrying... Error: {e}")
             time.sleep(0.1 * (attempt + 1))
 
-def setup_database():
-    """Initialize database tables"""
-    conn = None
+class PoolTimeout(sqlite3.OperationalError):
+    """Raised when no pooled connection becomes available in time"""
+    pass
+
+class ConnectionPool:
+    """Bounded pool of long-lived, pragma-initialised SQLite connections.
+
+    Connections are created lazily up to ``max_size`` and handed out one
+    holder at a time, so they are opened with ``check_same_thread=False``
+    and may be used from the bot loop, the API thread or worker threads.
+    """
+
+    def __init__(self, database: str = DB_FILE, max_size: int = POOL_MAX_SIZE,
+                 timeout: float = POOL_ACQUIRE_TIMEOUT):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {
+            'created': 0,
+            'acquired': 0,
+            'waited': 0,
+            'timeouts': 0,
+            'discarded': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0
+        }
+
+    def _create_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.timeout,
+            check_same_thread=False
+        )
+        return _configure_connection(conn)
+
+    def _checkout(self, timeout: Optional[float] = None,
+                  blocking: bool = True) -> Optional[sqlite3.Connection]:
+        """Take a connection from the pool, blocking up to ``timeout`` seconds.
+
+        With ``blocking=False`` returns None instead of waiting.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        create = False
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("Connection pool is closed")
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    create = True
+                    conn = None
+                    break
+                if not blocking:
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(
+                        f"Timed out after {timeout:.1f}s waiting for a database connection"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+
+            wait = time.monotonic() - start
+            self._stats['acquired'] += 1
+            self._stats['total_wait'] += wait
+            self._stats['max_wait'] = max(self._stats['max_wait'], wait)
+            if waited:
+                self._stats['waited'] += 1
+
+        if create:
+            try:
+                conn = self._create_connection()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._stats['created'] += 1
+        return conn
+
+    def _checkin(self, conn: sqlite3.Connection):
+        """Return a connection to the pool, discarding it if it is unusable"""
+        healthy = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning(f"Discarding pooled connection after failed rollback: {e}")
+            healthy = False
+
+        with self._cond:
+            if healthy and not self._closed:
+                self._idle.append(conn)
+            else:
+                self._size -= 1
+                self._stats['discarded'] += 1
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """Borrow a connection from synchronous code"""
+        conn = self._checkout(timeout)
+        try:
+            yield conn
+        finally:
+            self._checkin(conn)
+
+    @asynccontextmanager
+    async def acquire(self, timeout: Optional[float] = None):
+        """Borrow a connection from async code.
+
+        The fast path takes an idle connection without leaving the event
+        loop; only when the pool is exhausted is the blocking wait moved to
+        the default executor.
+        """
+        conn = self._checkout(blocking=False)
+        if conn is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(None, self._checkout, timeout)
+            try:
+                conn = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                future.add_done_callback(
+                    lambda f: f.cancelled() or f.exception() or self._checkin(f.result())
+                )
+                raise
+        try:
+            yield conn
+        finally:
+            self._checkin(conn)
+
+    def get_stats(self) -> Dict:
+        """Snapshot of pool size and acquire wait counters"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'max_size': self.max_size,
+                'avg_wait': stats['total_wait'] / stats['acquired'] if stats['acquired'] else 0.0
+            })
+        return stats
+
+    def close(self):
+        """Close all idle connections; busy ones are closed on return"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                try:
+                    self._idle.pop().close()
+                except sqlite3.Error:
+                    pass
+                self._size -= 1
+            self._cond.notify_all()
+        logger.info("Database connection pool closed")
+
+class WriteQueue:
+    """Single writer thread that owns every mutation of the database.
+
+    Jobs are ``fn(cursor, *args)`` callables. The writer drains whatever
+    is queued (up to ``max_batch``) and runs it inside one
+    ``BEGIN IMMEDIATE ... COMMIT`` so a burst of small writes costs a
+    single lock acquisition and a single WAL sync (group commit). Each
+    job runs in its own savepoint: a job that raises is rolled back on
+    its own and only its caller sees the exception. Results are handed
+    back only after the batch has been committed.
+    """
+
+    _STOP = object()
+
+    def __init__(self, database: str = DB_FILE, max_batch: int = WRITE_MAX_BATCH):
+        self.database = database
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'jobs': 0,
+            'batches': 0,
+            'failed_jobs': 0,
+            'failed_batches': 0,
+            'cancelled': 0,
+            'max_batch': 0,
+            'total_queue_wait': 0.0,
+            'max_queue_wait': 0.0
+        }
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run,
+                        name="db-writer",
+                        daemon=True
+                    )
+                    self._thread.start()
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Queue ``fn(cursor, *args)`` for the writer and return its future"""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((fn, args, future, time.monotonic()))
+        return future
+
+    def _next_batch(self) -> Optional[List[tuple]]:
+        job = self._queue.get()
+        if job is self._STOP:
+            return None
+        batch = [job]
+        while len(batch) < self.max_batch:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is self._STOP:
+                # Finish this batch first, then stop
+                self._queue.put(job)
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self):
+        conn = _configure_connection(sqlite3.connect(
+            self.database,
+            timeout=POOL_ACQUIRE_TIMEOUT,
+            check_same_thread=False
+        ))
+        logger.info("Database writer started")
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    break
+                self._execute_batch(conn, batch)
+        finally:
+            conn.close()
+            logger.info("Database writer stopped")
+
+    def _execute_batch(self, conn: sqlite3.Connection, batch: List[tuple]):
+        started = time.monotonic()
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.cursor()
+            for fn, args, future, queued_at in batch:
+                if not future.set_running_or_notify_cancel():
+                    self._record('cancelled')
+                    continue
+                self._record_wait(started - queued_at)
+                cursor.execute("SAVEPOINT write_job")
+                try:
+                    result = fn(cursor, *args)
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO write_job")
+                    cursor.execute("RELEASE write_job")
+                    outcomes.append((future, None, e))
+                else:
+                    cursor.execute("RELEASE write_job")
+                    outcomes.append((future, result, None))
+            conn.commit()
+        except Exception as e:
+            # The batch as a whole could not be committed; nobody's write landed
+            if conn.in_transaction:
+                conn.rollback()
+            self._record('failed_batches')
+            logger.error(f"Write batch of {len(batch)} failed: {e}")
+            for fn, args, future, queued_at in batch:
+                if future.running():
+                    future.set_exception(e)
+                elif not future.done():
+                    future.set_running_or_notify_cancel()
+                    future.set_exception(e)
+            return
+
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['jobs'] += len(outcomes)
+            self._stats['max_batch'] = max(self._stats['max_batch'], len(outcomes))
+
+        for future, result, error in outcomes:
+            if error is not None:
+                self._record('failed_jobs')
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _record(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _record_wait(self, wait: float):
+        with self._stats_lock:
+            self._stats['total_queue_wait'] += wait
+            self._stats['max_queue_wait'] = max(self._stats['max_queue_wait'], wait)
+
+    def get_stats(self) -> Dict:
+        """Snapshot of writer counters"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        stats['avg_batch'] = stats['jobs'] / stats['batches'] if stats['batches'] else 0.0
+        stats['avg_queue_wait'] = stats['total_queue_wait'] / stats['jobs'] if stats['jobs'] else 0.0
+        return stats
+
+    def close(self, timeout: Optional[float] = None):
+        """Drain the queue and stop the writer thread"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join(timeout)
+        self._thread = None
+
+class DatabaseTimeout(sqlite3.OperationalError):
+    """Raised when a database call exceeds its timeout"""
+    pass
+
+class QueryCounter:
+    """Number of database calls made inside a ``count_queries`` block"""
+
+    def __init__(self):
+        self.count = 0
+
+_query_counter: ContextVar[Optional[QueryCounter]] = ContextVar('query_counter', default=None)
+
+@contextmanager
+def count_queries():
+    """Count ``db`` reads and writes issued by the current task.
+
+    Tasks started inside the block share the counter, since they inherit
+    the context. Used to hold hot paths to a query budget::
+
+        with count_queries() as queries:
+            await render()
+        assert queries.count <= 1
+    """
+    counter = QueryCounter()
+    token = _query_counter.set(counter)
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        yield counter
+    finally:
+        _query_counter.reset(token)
 
-        # Create users table first (parent table)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                growid TEXT PRIMARY KEY,
-                balance_wl INTEGER DEFAULT 0,
-                balance_dl INTEGER DEFAULT 0,
-                balance_bgl INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Create user_discord mapping table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_growid (
-                discord_id TEXT PRIMARY KEY,
-                growid TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (growid) REFERENCES users(growid) ON DELETE CASCADE
-            )
-        """)
-
-        # Create products table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS products (
-                code TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                price INTEGER NOT NULL,
-                description TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Create stock table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS stock (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_code TEXT NOT NULL,
-                content TEXT NOT NULL UNIQUE,
-                status TEXT DEFAULT 'available' CHECK (status IN ('available', 'sold', 'deleted')),
-                added_by TEXT NOT NULL,
-                buyer_id TEXT,
-                seller_id TEXT,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (product_code) REFERENCES products(code) ON DELETE CASCADE
-            )
-        """)
-
-        # Create transactions table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                growid TEXT NOT NULL,
-                type TEXT NOT NULL,
-                details TEXT NOT NULL,
-                old_balance TEXT,
-                new_balance TEXT,
-                items_count INTEGER DEFAULT 0,
-                total_price INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (growid) REFERENCES users(growid) ON DELETE CASCADE
-            )
-        """)
-
-        # Create world_info table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS world_info (
-                id INTEGER PRIMARY KEY CHECK (id = 1),
-                world TEXT NOT NULL,
-                owner TEXT NOT NULL,
-                bot TEXT NOT NULL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Create bot_settings table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS bot_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Create blacklist table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS blacklist (
-                growid TEXT PRIMARY KEY,
-                added_by TEXT NOT NULL,
-                reason TEXT,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (growid) REFERENCES users(growid) ON DELETE CASCADE
-            )
-        """)
-
-        # Create admin_logs table (NEW)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS admin_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                admin_id TEXT NOT NULL,
-                action TEXT NOT NULL,
-                target TEXT,
-                details TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Create role_permissions table (NEW)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS role_permissions (
-                role_id TEXT PRIMARY KEY,
-                permissions TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Create user_activity table (NEW)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_activity (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                discord_id TEXT NOT NULL,
-                activity_type TEXT NOT NULL,
-                details TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (discord_id) REFERENCES user_growid(discord_id)
+def _count_query():
+    counter = _query_counter.get()
+    if counter is not None:
+        counter.count += 1
+
+class AsyncDatabase:
+    """Async facade that runs SQLite work off the event loop.
+
+    Every call is executed on a dedicated thread pool with a pooled
+    connection, so a locked database or a slow query only ever blocks a
+    worker thread. Concurrency is bounded by the number of workers and
+    each call has a timeout; a statement that is still running when the
+    timeout fires is interrupted. Writes are not run here but handed to
+    the ``WriteQueue`` so there is only ever one writer.
+    """
+
+    def __init__(self, pool: ConnectionPool, writer: WriteQueue,
+                 max_workers: int = DB_EXECUTOR_WORKERS, timeout: float = DB_QUERY_TIMEOUT):
+        self.pool = pool
+        self.writer = writer
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'errors': 0,
+            'timeouts': 0,
+            'total_time': 0.0,
+            'max_time': 0.0
+        }
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="db"
+                    )
+        return self._executor
+
+    def _record(self, key: str, elapsed: float = None):
+        with self._stats_lock:
+            self._stats[key] += 1
+            if elapsed is not None:
+                self._stats['total_time'] += elapsed
+                self._stats['max_time'] = max(self._stats['max_time'], elapsed)
+
+    def _call(self, fn: Callable, args: tuple, state: Dict) -> Any:
+        """Worker-thread side: borrow a connection and run ``fn`` on it"""
+        start = time.monotonic()
+        with self.pool.connection() as conn:
+            state['conn'] = conn
+            try:
+                return fn(conn, *args)
+            except Exception:
+                self._record('errors')
+                raise
+            finally:
+                state.pop('conn', None)
+                self._record('calls', time.monotonic() - start)
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None) -> Any:
+        """Run ``fn(conn, *args)`` on a worker thread and await its result"""
+        timeout = self.timeout if timeout is None else timeout
+        _count_query()
+        state = {}
+        future = self._get_executor().submit(self._call, fn, args, state)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self._record('timeouts')
+            conn = state.get('conn')
+            if conn is not None:
+                conn.interrupt()
+            raise DatabaseTimeout(f"Database call timed out after {timeout:.1f}s")
+
+    async def fetchone(self, query: str, params=(), timeout: Optional[float] = None) -> Optional[sqlite3.Row]:
+        """Run a read query and return the first row"""
+        def _fetch(conn):
+            return conn.execute(query, params).fetchone()
+        return await self.run(_fetch, timeout=timeout)
+
+    async def fetchall(self, query: str, params=(), timeout: Optional[float] = None) -> List[sqlite3.Row]:
+        """Run a read query and return all rows"""
+        def _fetch(conn):
+            return conn.execute(query, params).fetchall()
+        return await self.run(_fetch, timeout=timeout)
+
+    async def fetchval(self, query: str, params=(), default: Any = None,
+                       timeout: Optional[float] = None) -> Any:
+        """Run a read query and return the first column of the first row"""
+        row = await self.fetchone(query, params, timeout=timeout)
+        return row[0] if row is not None and row[0] is not None else default
+
+    async def transaction(self, fn: Callable, *args, timeout: Optional[float] = None,
+                          idempotency_key: Optional[str] = None) -> Any:
+        """Run ``fn(cursor, *args)`` as one job on the single writer.
+
+        The job shares a ``BEGIN IMMEDIATE ... COMMIT`` with whatever other
+        writes are queued at the same time and is rolled back on its own if
+        it raises; ``fn`` must not commit itself. On timeout a job that has
+        not started yet is dropped from the queue and DatabaseTimeout is
+        raised; one the writer has already picked up is waited for, so a
+        timeout never hides a write that commits.
+
+        With ``idempotency_key`` the job runs at most once per key: its
+        result is stored with the write and returned again on replay.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        _count_query()
+        if idempotency_key is not None:
+            future = self.writer.submit(_run_idempotent, idempotency_key, fn, *args)
+        else:
+            future = self.writer.submit(fn, *args)
+        result = asyncio.wrap_future(future)
+        try:
+            # Shielded so the timeout alone decides whether the job is dropped
+            return await asyncio.wait_for(asyncio.shield(result), timeout)
+        except asyncio.TimeoutError:
+            if future.cancel():
+                self._record('timeouts')
+                raise DatabaseTimeout(f"Database write timed out after {timeout:.1f}s")
+            logger.warning(f"Write job still running after {timeout:.1f}s, waiting for its commit")
+            return await result
+
+    async def execute(self, query: str, params=(), timeout: Optional[float] = None) -> int:
+        """Run a single write statement in its own transaction, returning rowcount"""
+        def _execute(cursor):
+            return cursor.execute(query, params).rowcount
+        return await self.transaction(_execute, timeout=timeout)
+
+    def get_stats(self) -> Dict:
+        """Snapshot of executor call counters"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['avg_time'] = stats['total_time'] / stats['calls'] if stats['calls'] else 0.0
+        stats['max_workers'] = self.max_workers
+        stats['writer'] = self.writer.get_stats()
+        return stats
+
+    def close(self):
+        """Stop the executor and the writer; queued work is allowed to finish"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.writer.close()
+        logger.info("Async database executor stopped")
+
+pool = ConnectionPool()
+writer = WriteQueue()
+db = AsyncDatabase(pool, writer)
+
+def configure(database: str):
+    """Repoint the module-level pool and writer at another database file.
+
+    Services import ``db`` directly, so tools and benchmarks that drive
+    them against a scratch file switch it here, in place. Call it before
+    any work is in flight: idle pooled connections are closed and the
+    writer thread is restarted lazily on the next submit.
+    """
+    writer.close()
+    writer.database = database
+    pool.close()
+    with pool._cond:
+        pool.database = database
+        pool._closed = False
+    logger.info(f"Database configured: {database}")
+
+def _cache_default(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, sqlite3.Row):
+        return dict(value)
+    if hasattr(value, 'dict'):
+        # pydantic models
+        return value.dict()
+    raise TypeError(f"Cannot cache value of type {type(value).__name__}")
+
+def _cache_object_hook(obj: Dict):
+    if len(obj) == 1 and '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+def encode_cache_value(value: Any) -> str:
+    """Default cache codec: compact JSON that also round-trips datetimes"""
+    return json.dumps(value, default=_cache_default, separators=(',', ':'))
+
+def decode_cache_value(data: str) -> Any:
+    return json.loads(data, object_hook=_cache_object_hook)
+
+def _cache_expiry(ttl: float) -> str:
+    # Same format as CURRENT_TIMESTAMP so expires_at compares as text
+    return (datetime.utcnow() + timedelta(seconds=ttl)).strftime('%Y-%m-%d %H:%M:%S')
+
+class PersistentCache:
+    """L2 cache stored in ``cache_table``.
+
+    Values go through a codec (JSON by default) and carry an absolute
+    ``expires_at``; expired rows are invisible to reads and removed by a
+    background sweeper in small chunks. Because it lives in the database
+    it survives restarts and is shared by the bot and the API thread.
+    Reads use the pool, writes go through the single writer.
+    """
+
+    def __init__(self, database: AsyncDatabase, default_ttl: float = CACHE_DEFAULT_TTL,
+                 encode: Callable[[Any], str] = encode_cache_value,
+                 decode: Callable[[str], Any] = decode_cache_value):
+        self.db = database
+        self.default_ttl = default_ttl
+        self.encode = encode
+        self.decode = decode
+        self.logger = logging.getLogger("PersistentCache")
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'sets': 0, 'deletes': 0, 'swept': 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _record(self, key: str, count: int = 1):
+        with self._stats_lock:
+            self._stats[key] += count
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        row = await self.db.fetchone(
+            "SELECT value FROM cache_table WHERE key = ? AND expires_at > CURRENT_TIMESTAMP",
+            (key,)
+        )
+        if row is None:
+            self._record('misses')
+            return default
+        self._record('hits')
+        return self.decode(row['value'])
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Fetch several keys at once; missing or expired keys are left out"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for start in range(0, len(keys), CACHE_SWEEP_CHUNK):
+            chunk = keys[start:start + CACHE_SWEEP_CHUNK]
+            rows = await self.db.fetchall(f"""
+                SELECT key, value FROM cache_table
+                WHERE key IN ({','.join('?' * len(chunk))})
+                AND expires_at > CURRENT_TIMESTAMP
+            """, chunk)
+            for row in rows:
+                found[row['key']] = self.decode(row['value'])
+        self._record('hits', len(found))
+        self._record('misses', len(keys) - len(found))
+        return found
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        await self.set_many({key: value}, ttl)
+
+    async def set_many(self, items: Dict[str, Any], ttl: Optional[float] = None):
+        """Store several values with the same TTL in one write job"""
+        if not items:
+            return
+        expires_at = _cache_expiry(self.default_ttl if ttl is None else ttl)
+        rows = [(key, self.encode(value), expires_at) for key, value in items.items()]
+
+        def _set(cursor):
+            cursor.executemany("""
+                INSERT INTO cache_table (key, value, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    value = excluded.value,
+                    expires_at = excluded.expires_at,
+                    created_at = CURRENT_TIMESTAMP
+            """, rows)
+
+        await self.db.transaction(_set)
+        self._record('sets', len(rows))
+
+    async def delete(self, *keys: str) -> int:
+        if not keys:
+            return 0
+        deleted = await self.db.execute(
+            f"DELETE FROM cache_table WHERE key IN ({','.join('?' * len(keys))})",
+            keys
+        )
+        self._record('deletes', deleted)
+        return deleted
+
+    async def delete_prefix(self, prefix: str) -> int:
+        """Delete every key starting with ``prefix`` (a primary-key range scan)"""
+        deleted = await self.db.execute(
+            "DELETE FROM cache_table WHERE key >= ? AND key < ?",
+            (prefix, prefix + '\uffff')
+        )
+        self._record('deletes', deleted)
+        return deleted
+
+    async def get_or_set(self, key: str, factory: Callable, ttl: Optional[float] = None) -> Any:
+        """Return the cached value or await ``factory()`` and cache its result"""
+        missing = object()
+        value = await self.get(key, missing)
+        if value is not missing:
+            return value
+        value = await factory()
+        await self.set(key, value, ttl)
+        return value
+
+    def sweep(self, chunk: int = CACHE_SWEEP_CHUNK) -> int:
+        """Delete expired rows in chunks, one short write job per chunk.
+
+        Blocking; called from the sweeper thread or scripts.
+        """
+        def _sweep(cursor):
+            cursor.execute("""
+                DELETE FROM cache_table WHERE key IN (
+                    SELECT key FROM cache_table
+                    WHERE expires_at <= CURRENT_TIMESTAMP
+                    LIMIT ?
+                )
+            """, (chunk,))
+            return cursor.rowcount
+
+        total = 0
+        while True:
+            deleted = self.db.writer.submit(_sweep).result(DB_QUERY_TIMEOUT)
+            total += deleted
+            if deleted < chunk:
+                break
+        if total:
+            self._record('swept', total)
+            self.logger.debug(f"Swept {total} expired cache entries")
+        return total
+
+    def start_sweeper(self, interval: float = CACHE_SWEEP_INTERVAL):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._sweep_loop,
+                args=(interval,),
+                name="cache-sweeper",
+                daemon=True
             )
-        """)
-
-        # Create cache_table (NEW)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS cache_table (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL,
-                expires_at TIMESTAMP NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            self._thread.start()
+
+    def stop_sweeper(self, timeout: Optional[float] = 5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _sweep_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                self.logger.error(f"Error sweeping cache: {e}")
+
+    async def get_stats(self) -> Dict:
+        """Hit/miss counters for this process plus table size"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        stats['entries'] = await self.db.fetchval("SELECT COUNT(*) FROM cache_table", default=0)
+        return stats
+
+cache = PersistentCache(db)
+
+_STOCK_ARCHIVE_COLUMNS = (
+    "id, product_code, content, status, added_by, buyer_id, seller_id, added_at, updated_at"
+)
+_TRANSACTION_ARCHIVE_COLUMNS = (
+    "id, growid, type, details, old_balance, new_balance, items_count, total_price, created_at, refunded_at"
+)
+# The hash moves with the row so archived content still blocks re-imports;
+# it stays NULL when an archived copy already holds it (unique index)
+_STOCK_ARCHIVE_SELECT = _STOCK_ARCHIVE_COLUMNS + """,
+    CASE WHEN EXISTS (SELECT 1 FROM stock_archive a WHERE a.content_hash = stock.content_hash)
+         THEN NULL ELSE content_hash END"""
+
+def _move_rows(cursor: sqlite3.Cursor, table: str, columns: str, ids: List[int],
+               select: Optional[str] = None) -> int:
+    marks = ','.join('?' * len(ids))
+    # INSERT OR IGNORE keeps a re-run after a crash idempotent
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO {table}_archive ({columns})
+        SELECT {select or columns} FROM {table} WHERE id IN ({marks})
+    """, ids)
+    cursor.execute(f"DELETE FROM {table} WHERE id IN ({marks})", ids)
+    return len(ids)
+
+def _archive_stock_batch(cursor: sqlite3.Cursor, cutoff: str, batch_size: int) -> int:
+    # Status predicate must match idx_stock_archivable exactly
+    cursor.execute("""
+        SELECT id FROM stock
+        WHERE status IN ('sold', 'deleted') AND updated_at < ?
+        ORDER BY updated_at, id
+        LIMIT ?
+    """, (cutoff, batch_size))
+    ids = [row[0] for row in cursor.fetchall()]
+    return _move_rows(cursor, 'stock', _STOCK_ARCHIVE_COLUMNS + ", content_hash", ids,
+                      select=_STOCK_ARCHIVE_SELECT) if ids else 0
+
+def _purge_outbox_batch(cursor: sqlite3.Cursor, cutoff: str, batch_size: int) -> int:
+    # Status predicate must match idx_outbox_finished exactly
+    cursor.execute("""
+        DELETE FROM outbox WHERE id IN (
+            SELECT id FROM outbox
+            WHERE status IN ('delivered', 'failed') AND updated_at < ?
+            ORDER BY updated_at, id
+            LIMIT ?
+        )
+    """, (cutoff, batch_size))
+    return cursor.rowcount
+
+def enqueue_outbox(cursor: sqlite3.Cursor, kind: str, dedup_key: str, payload: Dict) -> bool:
+    """Queue a side effect inside the caller's write transaction.
+
+    Returns False when ``dedup_key`` was already queued, so replaying the
+    same write never delivers twice.
+    """
+    cursor.execute(
+        "INSERT OR IGNORE INTO outbox (kind, dedup_key, payload) VALUES (?, ?, ?)",
+        (kind, dedup_key, json.dumps(payload, default=str))
+    )
+    return cursor.rowcount == 1
+
+def _purge_idempotency_batch(cursor: sqlite3.Cursor, cutoff: str, batch_size: int) -> int:
+    cursor.execute("""
+        DELETE FROM idempotency_keys WHERE key IN (
+            SELECT key FROM idempotency_keys
+            WHERE created_at < ?
+            ORDER BY created_at
+            LIMIT ?
+        )
+    """, (cutoff, batch_size))
+    return cursor.rowcount
+
+def _run_idempotent(cursor: sqlite3.Cursor, key: str, fn: Callable, *args) -> Any:
+    """Writer job wrapper behind ``AsyncDatabase.transaction(idempotency_key=...)``.
+
+    The lookup and the insert run inside the same write transaction as
+    ``fn``, and the writer serialises jobs, so two submissions with one
+    key can never both run. A job that raises stores nothing and may be
+    retried. Replayed dict results carry ``replayed=True``.
+    """
+    cursor.execute("SELECT result FROM idempotency_keys WHERE key = ?", (key,))
+    row = cursor.fetchone()
+    if row is not None:
+        result = decode_cache_value(row[0])
+        if isinstance(result, dict):
+            result['replayed'] = True
+        return result
+
+    result = fn(cursor, *args)
+    cursor.execute(
+        "INSERT INTO idempotency_keys (key, result) VALUES (?, ?)",
+        (key, encode_cache_value(result))
+    )
+    return result
+
+def _archive_transaction_batch(cursor: sqlite3.Cursor, cutoff: str, batch_size: int) -> int:
+    cursor.execute("""
+        SELECT id FROM transactions
+        WHERE created_at < ?
+        ORDER BY created_at, id
+        LIMIT ?
+    """, (cutoff, batch_size))
+    ids = [row[0] for row in cursor.fetchall()]
+    return _move_rows(cursor, 'transactions', _TRANSACTION_ARCHIVE_COLUMNS, ids) if ids else 0
+
+class Archiver:
+    """Moves cold rows out of the hot ``stock`` and ``transactions`` tables.
+
+    Sold/deleted stock older than ``stock_days`` and transactions older
+    than ``transaction_days`` are copied to ``stock_archive`` /
+    ``transactions_archive`` and deleted from the hot table, ``batch_size``
+    rows per writer job. Every batch commits on its own, so a run can be
+    stopped at any point and the next run simply carries on. The archived
+    stock rows also leave ``product_stock_counts``, which always describes
+    the hot table. Delivered or failed outbox rows older than
+    ``outbox_days`` and idempotency keys older than ``idempotency_days``
+    are deleted outright.
+    """
+
+    STATUS_KEY = 'archive_last_run'
+
+    def __init__(self, writer: WriteQueue, stock_days: float = ARCHIVE_STOCK_DAYS,
+                 transaction_days: float = ARCHIVE_TRANSACTION_DAYS,
+                 batch_size: int = ARCHIVE_BATCH_SIZE, interval: float = ARCHIVE_INTERVAL,
+                 outbox_days: float = OUTBOX_RETENTION_DAYS,
+                 idempotency_days: float = IDEMPOTENCY_RETENTION_DAYS):
+        self.writer = writer
+        self.stock_days = stock_days
+        self.transaction_days = transaction_days
+        self.outbox_days = outbox_days
+        self.idempotency_days = idempotency_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _cutoff(days: float) -> str:
+        return (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+    def _drain(self, job: Callable, cutoff: str) -> int:
+        moved = 0
+        while not self._stop.is_set():
+            count = self.writer.submit(job, cutoff, self.batch_size).result(ONLINE_INDEX_TIMEOUT)
+            moved += count
+            if count < self.batch_size:
+                break
+        return moved
+
+    def run_once(self) -> Dict:
+        """Archive everything currently past its cutoff; blocking"""
+        start = time.monotonic()
+        result = {
+            'stock': self._drain(_archive_stock_batch, self._cutoff(self.stock_days)),
+            'transactions': self._drain(_archive_transaction_batch, self._cutoff(self.transaction_days)),
+            'outbox': self._drain(_purge_outbox_batch, self._cutoff(self.outbox_days)),
+            'idempotency_keys': self._drain(_purge_idempotency_batch, self._cutoff(self.idempotency_days)),
+            'completed': not self._stop.is_set(),
+            'finished_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            'duration': round(time.monotonic() - start, 3)
+        }
+        self.writer.submit(_set_setting, self.STATUS_KEY, json.dumps(result)).result(DB_QUERY_TIMEOUT)
+        if result['stock'] or result['transactions'] or result['outbox'] or result['idempotency_keys']:
+            logger.info(
+                f"Archived {result['stock']} stock rows and {result['transactions']} "
+                f"transactions, purged {result['outbox']} outbox rows and "
+                f"{result['idempotency_keys']} idempotency keys in {result['duration']:.2f}s"
             )
-        """)
-
-        # Create triggers
-        triggers = [
-            ("""
-            CREATE TRIGGER IF NOT EXISTS update_users_timestamp 
-            AFTER UPDATE ON users
-            BEGIN
-                UPDATE users SET updated_at = CURRENT_TIMESTAMP
-                WHERE growid = NEW.growid;
-            END;
-            """),
-            ("""
-            CREATE TRIGGER IF NOT EXISTS update_products_timestamp 
-            AFTER UPDATE ON products
-            BEGIN
-                UPDATE products SET updated_at = CURRENT_TIMESTAMP
-                WHERE code = NEW.code;
-            END;
-            """),
-            ("""
-            CREATE TRIGGER IF NOT EXISTS update_stock_timestamp 
-            AFTER UPDATE ON stock
-            BEGIN
-                UPDATE stock SET updated_at = CURRENT_TIMESTAMP
-                WHERE id = NEW.id;
-            END;
-            """),
-            ("""
-            CREATE TRIGGER IF NOT EXISTS update_bot_settings_timestamp 
-            AFTER UPDATE ON bot_settings
-            BEGIN
-                UPDATE bot_settings SET updated_at = CURRENT_TIMESTAMP
-                WHERE key = NEW.key;
-            END;
-            """),
-            # New trigger for role_permissions
-            ("""
-            CREATE TRIGGER IF NOT EXISTS update_role_permissions_timestamp 
-            AFTER UPDATE ON role_permissions
-            BEGIN
-                UPDATE role_permissions SET updated_at = CURRENT_TIMESTAMP
-                WHERE role_id = NEW.role_id;
-            END;
-            """)
-        ]
+        return result
 
-        for trigger in triggers:
-            cursor.execute(trigger)
-
-        # Create indexes
-        indexes = [
-            ("idx_user_growid_discord", "user_growid(discord_id)"),
-            ("idx_user_growid_growid", "user_growid(growid)"),
-            ("idx_stock_product_code", "stock(product_code)"),
-            ("idx_stock_status", "stock(status)"),
-            ("idx_stock_content", "stock(content)"),
-            ("idx_transactions_growid", "transactions(growid)"),
-            ("idx_transactions_created", "transactions(created_at)"),
-            ("idx_blacklist_growid", "blacklist(growid)"),
-            # New indexes
-            ("idx_admin_logs_admin", "admin_logs(admin_id)"),
-            ("idx_admin_logs_created", "admin_logs(created_at)"),
-            ("idx_user_activity_discord", "user_activity(discord_id)"),
-            ("idx_user_activity_type", "user_activity(activity_type)"),
-            ("idx_role_permissions_role", "role_permissions(role_id)"),
-            ("idx_cache_expires", "cache_table(expires_at)")
-        ]
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="db-archiver", daemon=True)
+            self._thread.start()
 
-        for idx_name, idx_cols in indexes:
-            cursor.execute(f"CREATE INDEX IF NOT EXISTS {idx_name} ON {idx_cols}")
+    def stop(self, timeout: Optional[float] = 5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
 
-        # Insert default world info if not exists
-        cursor.execute("""
-            INSERT OR IGNORE INTO world_info (id, world, owner, bot)
-            VALUES (1, 'YOURWORLD', 'OWNER', 'BOT')
-        """)
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Error archiving old rows: {e}")
 
-        # Insert default role permissions if not exists
-        cursor.execute("""
-            INSERT OR IGNORE INTO role_permissions (role_id, permissions)
-            VALUES ('admin', 'all')
-        """)
+def _migration_files(directory: Path = MIGRATIONS_DIR) -> List[tuple]:
+    """Sorted ``(version, name, path)`` for every ``NNNN_name.sql`` file"""
+    files = []
+    for path in directory.glob('*.sql'):
+        match = _MIGRATION_FILE_RE.match(path.name)
+        if not match:
+            logger.warning(f"Ignoring migration file with unexpected name: {path.name}")
+            continue
+        files.append((int(match.group(1)), match.group(2), path))
+    files.sort()
 
-        conn.commit()
-        logger.info("Database setup completed successfully")
+    versions = [version for version, _, _ in files]
+    if versions != list(range(1, len(versions) + 1)):
+        raise ValueError(f"Migration versions must be contiguous from 1, found {versions}")
+    return files
 
-    except sqlite3.Error as e:
-        logger.error(f"Database setup error: {e}")
-        if conn:
-            conn.rollback()
+def _split_statements(script: str) -> List[tuple]:
+    """Split a migration script into ``(sql, online)`` statements.
+
+    A ``-- @online`` line marks the next statement (a CREATE INDEX) as one
+    that may be deferred when its table is large.
+    """
+    statements = []
+    buffer = []
+    online = False
+    for line in script.splitlines():
+        stripped = line.strip()
+        if not buffer:
+            if stripped == _ONLINE_MARKER:
+                online = True
+                continue
+            if not stripped or stripped.startswith('--'):
+                continue
+        buffer.append(line)
+        sql = '\n'.join(buffer)
+        if sqlite3.complete_statement(sql):
+            statements.append((sql.strip(), online))
+            buffer = []
+            online = False
+
+    if buffer:
+        raise ValueError("Migration script ends with an incomplete statement")
+    return statements
+
+def load_migrations(directory: Path = MIGRATIONS_DIR, after: int = 0) -> List[Dict]:
+    """Parse every migration newer than ``after``"""
+    return [
+        {
+            'version': version,
+            'name': name,
+            'statements': _split_statements(path.read_text(encoding='utf-8'))
+        }
+        for version, name, path in _migration_files(directory)
+        if version > after
+    ]
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def _defer_index(cursor: sqlite3.Cursor, sql: str) -> Optional[str]:
+    """Return the index name if building it now would stall startup"""
+    match = _CREATE_INDEX_RE.match(sql)
+    if not match:
+        raise ValueError(f"{_ONLINE_MARKER} only applies to CREATE INDEX: {sql[:60]}")
+    name, table = match.groups()
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,))
+    if cursor.fetchone():
+        return None
+
+    # MAX(rowid) is a single b-tree seek, unlike COUNT(*)
+    cursor.execute(f'SELECT MAX(rowid) FROM "{table}"')
+    rows = cursor.fetchone()[0] or 0
+    return name if rows >= ONLINE_INDEX_MIN_ROWS else None
+
+def _apply_migration(conn: sqlite3.Connection, migration: Dict):
+    start = time.monotonic()
+    deferred = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = conn.cursor()
+        for sql, online in migration['statements']:
+            if online:
+                name = _defer_index(cursor, sql)
+                if name:
+                    cursor.execute(
+                        "INSERT OR REPLACE INTO pending_indexes (name, sql, version) VALUES (?, ?, ?)",
+                        (name, sql, migration['version'])
+                    )
+                    deferred.append(name)
+                    continue
+            cursor.execute(sql)
+
+        # user_version is part of the same transaction as the DDL
+        cursor.execute(f"PRAGMA user_version = {int(migration['version'])}")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Migration {migration['version']:04d}_{migration['name']} failed: {e}")
         raise
+
+    logger.info(
+        f"Applied migration {migration['version']:04d}_{migration['name']} "
+        f"in {time.monotonic() - start:.2f}s"
+        + (f" (deferred indexes: {', '.join(deferred)})" if deferred else "")
+    )
+
+def migrate(database: str = DB_FILE, directory: Path = MIGRATIONS_DIR) -> int:
+    """Bring the schema up to the newest migration and return its version.
+
+    When the database is already current this is a single
+    ``PRAGMA user_version`` read; migration files are only parsed when
+    something is pending. Each migration runs in its own transaction.
+    """
+    files = _migration_files(directory)
+    target = files[-1][0] if files else 0
+
+    conn = _configure_connection(sqlite3.connect(database, timeout=POOL_ACQUIRE_TIMEOUT))
+    try:
+        current = get_schema_version(conn)
+        if current >= target:
+            if current > target:
+                logger.warning(f"Database schema version {current} is newer than the code ({target})")
+            logger.debug(f"Database schema is current (version {current})")
+            return current
+
+        for migration in load_migrations(directory, after=current):
+            _apply_migration(conn, migration)
+            current = migration['version']
+
+        logger.info(f"Database schema migrated to version {current}")
+        return current
     finally:
-        if conn:
-            conn.close()
+        conn.close()
+
+def setup_database():
+    """Initialize database tables (kept for older callers; see ``migrate``)"""
+    return migrate()
+
+def _build_index(cursor: sqlite3.Cursor, name: str, sql: str):
+    cursor.execute(sql)
+    cursor.execute("DELETE FROM pending_indexes WHERE name = ?", (name,))
+
+async def build_pending_indexes() -> int:
+    """Build indexes that a migration deferred, one writer job at a time.
+
+    Meant to run in the background once the bot is up: reads keep being
+    served from WAL snapshots while an index builds, and writes queue
+    behind it on the writer instead of blocking startup.
+    """
+    rows = await db.fetchall("SELECT name, sql FROM pending_indexes ORDER BY version, created_at")
+    for row in rows:
+        start = time.monotonic()
+        await db.transaction(_build_index, row['name'], row['sql'], timeout=ONLINE_INDEX_TIMEOUT)
+        logger.info(f"Built deferred index {row['name']} in {time.monotonic() - start:.2f}s")
+    return len(rows)
+
+def _rebuild_stock_counts(cursor: sqlite3.Cursor) -> int:
+    cursor.execute("DELETE FROM product_stock_counts")
+    cursor.execute("""
+        INSERT INTO product_stock_counts (product_code, status, count)
+        SELECT product_code, status, COUNT(*)
+        FROM stock
+        GROUP BY product_code, status
+    """)
+    return cursor.rowcount
+
+_PURCHASE_LINE_RE = re.compile(r'(\d+) ([^,\s]+)')
+
+def _insert_order_items(cursor: sqlite3.Cursor, pairs: List[tuple]) -> int:
+    # OR IGNORE keeps re-running the backfill harmless
+    cursor.executemany("INSERT OR IGNORE INTO order_items (transaction_id, stock_id) VALUES (?, ?)", pairs)
+    return cursor.rowcount
 
-def verify_database():
-    """Verify database integrity and tables existence"""
+def backfill_order_items(writer: WriteQueue, batch_size: int = ARCHIVE_BATCH_SIZE) -> Dict:
+    """Link purchases made before ``order_items`` existed to their stock rows.
+
+    Old sales only recorded ``buyer_id`` on the stock row and
+    "Purchased <qty> <code>[, ...]" in the transaction, so the match is
+    best-effort: each buyer's unlinked sold rows are handed out per
+    product in ``updated_at`` order to their unlinked purchases in
+    ``created_at`` order, which is the order the FIFO sales happened in.
+    Reads use a separate connection; links are written in batches through
+    ``writer``. Blocking.
+    """
+    conn = get_connection(database=writer.database)
+    try:
+        unlinked = {}
+        for row in conn.execute("""
+            SELECT id, buyer_id, product_code FROM stock s
+            WHERE status = 'sold' AND buyer_id IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM order_items oi WHERE oi.stock_id = s.id)
+            ORDER BY updated_at, id
+        """):
+            unlinked.setdefault((row['buyer_id'], row['product_code']), deque()).append(row['id'])
+
+        transactions = conn.execute("""
+            SELECT id, growid, details FROM transactions t
+            WHERE type = 'PURCHASE'
+            AND NOT EXISTS (SELECT 1 FROM order_items oi WHERE oi.transaction_id = t.id)
+            ORDER BY created_at, id
+        """).fetchall()
+    finally:
+        conn.close()
+
+    pairs = []
+    linked = unmatched = 0
+    for trx in transactions:
+        found = 0
+        for quantity, code in _PURCHASE_LINE_RE.findall(trx['details'].partition('Purchased')[2]):
+            rows = unlinked.get((trx['growid'], code), ())
+            for _ in range(min(int(quantity), len(rows))):
+                pairs.append((trx['id'], rows.popleft()))
+                found += 1
+        if found:
+            linked += 1
+        else:
+            unmatched += 1
+
+    items = 0
+    for start in range(0, len(pairs), batch_size):
+        items += writer.submit(_insert_order_items, pairs[start:start + batch_size]).result(ONLINE_INDEX_TIMEOUT)
+
+    result = {'transactions': linked, 'items': items, 'unmatched': unmatched}
+    logger.info(f"Backfilled order_items: {linked} transactions, {items} items, {unmatched} unmatched")
+    return result
+
+async def rebuild_stock_counts() -> int:
+    """Recompute product_stock_counts from the stock table.
+
+    The triggers keep the counters exact; this is the repair path for a
+    database that was edited with triggers disabled or restored from an
+    older dump. Returns the number of counter rows written.
+    """
+    rows = await db.transaction(_rebuild_stock_counts, timeout=ONLINE_INDEX_TIMEOUT)
+    logger.info(f"Rebuilt stock counters ({rows} rows)")
+    return rows
+
+# Hot queries and the tables they are allowed to scan. check_query_plans()
+# fails when any other table is scanned or a temp b-tree is needed for
+# ORDER BY / GROUP BY, which is what happens when an index goes missing.
+HOT_QUERIES = {
+    'stock_fifo_pick': ("""
+        SELECT id, content FROM stock
+        WHERE product_code = ? AND status = 'available'
+        ORDER BY added_at ASC, id ASC
+        LIMIT ?
+    """, ('CODE', 1), ()),
+    'stock_fifo_claim': ("""
+        UPDATE stock
+        SET status = 'sold', buyer_id = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM stock
+            WHERE product_code = ? AND status = 'available'
+            ORDER BY added_at ASC, id ASC
+            LIMIT ?
+        ) AND status = 'available'
+        RETURNING id, content
+    """, ('GROWID', 'CODE', 1), ()),
+    'stock_claim_by_id': ("""
+        UPDATE stock
+        SET status = 'sold', buyer_id = COALESCE(?, buyer_id),
+            seller_id = COALESCE(?, seller_id), updated_at = CURRENT_TIMESTAMP
+        WHERE id IN (?, ?) AND product_code = ? AND status = 'available'
+        RETURNING id, content
+    """, ('GROWID', None, 1, 2, 'CODE'), ()),
+    'stock_content_lookup': ("""
+        SELECT content_hash FROM stock WHERE content_hash IN (?, ?)
+        UNION ALL
+        SELECT content_hash FROM stock_archive WHERE content_hash IN (?, ?)
+    """, (b'0' * STOCK_HASH_SIZE, b'1' * STOCK_HASH_SIZE) * 2, ()),
+    'stock_available_count': ("""
+        SELECT count FROM product_stock_counts
+        WHERE product_code = ? AND status = 'available'
+    """, ('CODE',), ()),
+    'products_with_stock': ("""
+        SELECT p.*, COALESCE(a.count, 0) as stock_count, COALESCE(r.count, 0) as reserved_count
+        FROM products p
+        LEFT JOIN product_stock_counts a
+               ON a.product_code = p.code AND a.status = 'available'
+        LEFT JOIN product_stock_counts r
+               ON r.product_code = p.code AND r.status = 'pending'
+        ORDER BY p.code
+    """, (), ('p',)),
+    'user_transaction_history': ("""
+        SELECT * FROM transactions
+        WHERE growid = ? COLLATE binary
+        ORDER BY created_at DESC
+        LIMIT ?
+    """, ('GROWID', 10), ()),
+    'archived_transaction_history': ("""
+        SELECT * FROM transactions_archive
+        WHERE growid = ? COLLATE binary
+        ORDER BY created_at DESC
+        LIMIT ?
+    """, ('GROWID', 10), ()),
+    'archivable_stock': ("""
+        SELECT id FROM stock
+        WHERE status IN ('sold', 'deleted') AND updated_at < ?
+        ORDER BY updated_at, id
+        LIMIT ?
+    """, ('2000-01-01 00:00:00', 500), ()),
+    'expired_reservations': ("""
+        SELECT id FROM stock_reservations
+        WHERE status = 'active' AND expires_at <= CURRENT_TIMESTAMP
+        LIMIT ?
+    """, (500,), ()),
+    'reservation_stock': ("""
+        UPDATE stock SET status = 'available', reservation_id = NULL
+        WHERE reservation_id = ? AND status = 'pending'
+    """, (1,), ()),
+    'outbox_due': ("""
+        SELECT * FROM outbox
+        WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+        ORDER BY next_attempt_at, id
+        LIMIT ?
+    """, (50,), ()),
+    'order_items_by_order': ("""
+        SELECT stock_id FROM order_items WHERE transaction_id = ?
+    """, (1,), ()),
+    'user_purchase_items': ("""
+        SELECT t.*, oi.stock_id, COALESCE(s.content, sa.content) as content,
+               COALESCE(s.product_code, sa.product_code) as product_code
+        FROM transactions t
+        JOIN order_items oi ON oi.transaction_id = t.id
+        LEFT JOIN stock s ON s.id = oi.stock_id
+        LEFT JOIN stock_archive sa ON sa.id = oi.stock_id AND s.id IS NULL
+        WHERE t.growid = ? COLLATE binary AND t.type = 'PURCHASE'
+        ORDER BY t.created_at DESC
+        LIMIT ?
+    """, ('GROWID', 10), ()),
+    'user_purchase_items_archived': ("""
+        SELECT t.*, oi.stock_id, COALESCE(s.content, sa.content) as content,
+               COALESCE(s.product_code, sa.product_code) as product_code
+        FROM transactions_archive t
+        JOIN order_items oi ON oi.transaction_id = t.id
+        LEFT JOIN stock s ON s.id = oi.stock_id
+        LEFT JOIN stock_archive sa ON sa.id = oi.stock_id AND s.id IS NULL
+        WHERE t.growid = ? COLLATE binary AND t.type = 'PURCHASE'
+        ORDER BY t.created_at DESC
+        LIMIT ?
+    """, ('GROWID', 10), ()),
+    'user_balance': ("""
+        SELECT balance_wl, balance_dl, balance_bgl FROM users
+        WHERE growid = ? COLLATE binary
+    """, ('GROWID',), ()),
+    'growid_by_discord': ("""
+        SELECT growid FROM user_growid WHERE discord_id = ?
+    """, ('0',), ()),
+}
+
+def check_query_plans(conn: sqlite3.Connection) -> Dict[str, List[str]]:
+    """EXPLAIN QUERY PLAN every hot query; returns offending plan lines by name"""
+    problems = {}
+    for name, (query, params, allowed_scans) in HOT_QUERIES.items():
+        details = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+        bad = []
+        for detail in details:
+            if 'TEMP B-TREE' in detail:
+                bad.append(detail)
+            elif detail.startswith('SCAN') and detail.split()[1] not in allowed_scans:
+                bad.append(detail)
+        if bad:
+            problems[name] = bad
+    return problems
+
+def verify_database(database: Optional[str] = None, full: bool = False):
+    """Verify database integrity and tables existence.
+
+    Uses ``PRAGMA quick_check`` unless ``full`` is set; routine full checks
+    are done off-peak by ``IntegrityVerifier``.
+    """
     conn = None
     try:
-        conn = get_connection()
+        conn = get_connection(database=database)
         cursor = conn.cursor()
 
         # Check all tables exist
         tables = [
             'users', 'user_growid', 'products', 'stock', 
             'transactions', 'world_info', 'bot_settings', 'blacklist',
-            'admin_logs', 'role_permissions', 'user_activity', 'cache_table'
+            'admin_logs', 'role_permissions', 'user_activity', 'cache_table',
+            'pending_indexes', 'product_stock_counts', 'stock_reservations',
+            'outbox', 'order_lines', 'idempotency_keys', 'order_items'
         ]
 
         missing_tables = []
@@ -293,15 +1388,12 @@ def verify_database():
             logger.error(f"Missing tables: {', '.join(missing_tables)}")
             raise sqlite3.Error(f"Database verification failed: missing tables")
 
-        # Check database integrity
-        cursor.execute("PRAGMA integrity_check")
-        if cursor.fetchone()['integrity_check'] != 'ok':
+        # Check database integrity (the full check reads every page)
+        errors = run_integrity_check(conn, full=full)
+        if errors:
+            logger.error(f"Integrity problems: {'; '.join(errors)}")
             raise sqlite3.Error("Database integrity check failed")
 
-        # Clean expired cache entries
-        cursor.execute("DELETE FROM cache_table WHERE expires_at < CURRENT_TIMESTAMP")
-        conn.commit()
-
         logger.info("Database verification completed successfully")
         return True
 
@@ -312,7 +1404,168 @@ def verify_database():
         if conn:
             conn.close()
 
+def run_integrity_check(conn: sqlite3.Connection, full: bool = False,
+                        max_errors: int = INTEGRITY_MAX_ERRORS) -> List[str]:
+    """Run quick_check (or integrity_check) and return the problems found"""
+    pragma = "integrity_check" if full else "quick_check"
+    rows = conn.execute(f"PRAGMA {pragma}({int(max_errors)})").fetchall()
+    return [row[0] for row in rows if row[0] != 'ok']
+
+def _set_setting(cursor: sqlite3.Cursor, key: str, value: str):
+    cursor.execute("""
+        INSERT INTO bot_settings (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    """, (key, value))
+
+class IntegrityVerifier:
+    """Background database integrity verification.
+
+    A daemon thread runs ``PRAGMA quick_check`` every ``quick_interval``
+    seconds and a full ``PRAGMA integrity_check`` once a day during
+    ``full_check_hour`` (UTC). Checks use their own read connection, so
+    under WAL they only see a snapshot and never block the writer. Each
+    result is stored as JSON in ``bot_settings`` (``integrity_quick_check``
+    and ``integrity_full_check``) for the health endpoint.
+    """
+
+    QUICK_KEY = 'integrity_quick_check'
+    FULL_KEY = 'integrity_full_check'
+
+    def __init__(self, database: str = DB_FILE, writer: Optional[WriteQueue] = None,
+                 quick_interval: float = INTEGRITY_QUICK_INTERVAL,
+                 full_check_hour: Optional[int] = INTEGRITY_FULL_CHECK_HOUR):
+        self.database = database
+        self.writer = writer
+        self.quick_interval = quick_interval
+        self.full_check_hour = full_check_hour
+        self.last_results = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="db-integrity", daemon=True)
+            self._thread.start()
+            logger.info(
+                f"Integrity verifier started (quick every {self.quick_interval / 3600:.1f}h, "
+                f"full at {self.full_check_hour}:00 UTC)"
+            )
+
+    def stop(self, timeout: Optional[float] = 5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _load_previous(self, conn: sqlite3.Connection):
+        rows = conn.execute(
+            "SELECT key, value FROM bot_settings WHERE key IN (?, ?)",
+            (self.QUICK_KEY, self.FULL_KEY)
+        ).fetchall()
+        for row in rows:
+            try:
+                self.last_results[row['key']] = json.loads(row['value'])
+            except ValueError:
+                pass
+
+    def _last_checked(self, key: str) -> Optional[datetime]:
+        result = self.last_results.get(key)
+        if not result:
+            return None
+        return datetime.strptime(result['checked_at'], '%Y-%m-%d %H:%M:%S')
+
+    def _quick_due(self, now: datetime) -> bool:
+        last = self._last_checked(self.QUICK_KEY)
+        return last is None or (now - last).total_seconds() >= self.quick_interval
+
+    def _full_due(self, now: datetime) -> bool:
+        if self.full_check_hour is None or now.hour != self.full_check_hour:
+            return False
+        last = self._last_checked(self.FULL_KEY)
+        return last is None or last.date() < now.date()
+
+    def check(self, conn: sqlite3.Connection, full: bool = False) -> Dict:
+        """Run one check on ``conn`` and record the result"""
+        key = self.FULL_KEY if full else self.QUICK_KEY
+        start = time.monotonic()
+        try:
+            errors = run_integrity_check(conn, full=full)
+            status = 'ok' if not errors else 'corrupt'
+        except sqlite3.Error as e:
+            errors = [str(e)]
+            status = 'error'
+
+        result = {
+            'status': status,
+            'checked_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            'duration': round(time.monotonic() - start, 3),
+            'errors': errors
+        }
+        self.last_results[key] = result
+
+        if status == 'ok':
+            logger.info(f"{'Full' if full else 'Quick'} integrity check ok in {result['duration']:.2f}s")
+        else:
+            logger.error(f"{'Full' if full else 'Quick'} integrity check {status}: {'; '.join(errors)}")
+
+        if self.writer is not None:
+            try:
+                self.writer.submit(_set_setting, key, json.dumps(result)).result(DB_QUERY_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Could not record integrity result: {e}")
+        return result
+
+    def _run(self):
+        conn = None
+        try:
+            conn = _configure_connection(sqlite3.connect(self.database, check_same_thread=False))
+            self._load_previous(conn)
+            while not self._stop.is_set():
+                now = datetime.utcnow()
+                if self._full_due(now):
+                    self.check(conn, full=True)
+                elif self._quick_due(now):
+                    self.check(conn)
+                # Re-evaluate at least every few minutes so the off-peak hour is not missed
+                self._stop.wait(min(self.quick_interval, 300))
+        except Exception as e:
+            logger.error(f"Integrity verifier stopped: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+async def get_integrity_status() -> Dict:
+    """Last recorded quick and full integrity results"""
+    rows = await db.fetchall(
+        "SELECT key, value FROM bot_settings WHERE key IN (?, ?)",
+        (IntegrityVerifier.QUICK_KEY, IntegrityVerifier.FULL_KEY)
+    )
+    results = {row['key']: json.loads(row['value']) for row in rows}
+    quick = results.get(IntegrityVerifier.QUICK_KEY)
+    full = results.get(IntegrityVerifier.FULL_KEY)
+    statuses = [r['status'] for r in (quick, full) if r]
+    return {
+        'status': 'unknown' if not statuses else ('ok' if all(s == 'ok' for s in statuses) else 'failed'),
+        'quick_check': quick,
+        'full_check': full
+    }
+
+def backup_database(destination: str, database: str = DB_FILE):
+    """Consistent online copy using SQLite's backup API"""
+    source = sqlite3.connect(database)
+    target = sqlite3.connect(destination)
+    try:
+        source.backup(target)
+        logger.info(f"Created database backup: {destination}")
+    finally:
+        target.close()
+        source.close()
+
 if __name__ == "__main__":
+    import argparse
+    import sys
+
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -321,27 +1574,115 @@ if __name__ == "__main__":
             logging.FileHandler('database.log')
         ]
     )
-    
+
+    parser = argparse.ArgumentParser(description="Shop database maintenance")
+    parser.add_argument('--db', default=DB_FILE, help="database file (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command')
+
+    migrate_cmd = commands.add_parser('migrate', help="apply pending migrations")
+    migrate_cmd.add_argument('--build-indexes', action='store_true',
+                             help="also build deferred indexes now")
+    commands.add_parser('status', help="show schema version and pending work")
+    verify_cmd = commands.add_parser('verify', help="check tables and integrity")
+    verify_cmd.add_argument('--full', action='store_true',
+                            help="run the full integrity_check instead of quick_check")
+    commands.add_parser('check-plans', help="fail if a hot query scans or sorts")
+    commands.add_parser('rebuild-counts', help="recompute product_stock_counts from stock")
+    commands.add_parser('backfill-order-items', help="link purchases made before order_items existed")
+    archive_cmd = commands.add_parser('archive', help="move old sold stock and transactions to archive tables")
+    archive_cmd.add_argument('--stock-days', type=float, default=ARCHIVE_STOCK_DAYS)
+    archive_cmd.add_argument('--transaction-days', type=float, default=ARCHIVE_TRANSACTION_DAYS)
+    backup_cmd = commands.add_parser('backup', help="write an online backup")
+    backup_cmd.add_argument('destination', nargs='?')
+
+    args = parser.parse_args()
+    command = args.command or 'migrate'
+
     try:
-        setup_database()
-        if not verify_database():
-            logger.error("Database verification failed. Attempting to recreate database...")
-            # Backup existing database if it exists
-            import shutil
-            from pathlib import Path
-            if Path('shop.db').exists():
-                backup_path = f"shop.db.backup_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
-                shutil.copy2('shop.db', backup_path)
-                logger.info(f"Created database backup: {backup_path}")
-            
-            # Recreate database
-            Path('shop.db').unlink(missing_ok=True)
-            setup_database()
-            if verify_database():
-                logger.info("Database successfully recreated")
-            else:
-                logger.error("Failed to recreate database")
-        else:
-            logger.info("Database initialization complete")
+        if command == 'migrate':
+            migrate(args.db)
+            if getattr(args, 'build_indexes', False):
+                conn = _configure_connection(sqlite3.connect(args.db))
+                try:
+                    for name, sql in conn.execute("SELECT name, sql FROM pending_indexes").fetchall():
+                        with conn:
+                            _build_index(conn.cursor(), name, sql)
+                        logger.info(f"Built deferred index {name}")
+                finally:
+                    conn.close()
+
+        elif command == 'status':
+            files = _migration_files()
+            conn = _configure_connection(sqlite3.connect(args.db))
+            try:
+                current = get_schema_version(conn)
+                pending = [f"{v:04d}_{n}" for v, n, _ in files if v > current]
+                indexes = []
+                if current:
+                    indexes = [row[0] for row in conn.execute("SELECT name FROM pending_indexes")]
+            finally:
+                conn.close()
+            print(f"Schema version: {current} (latest: {files[-1][0] if files else 0})")
+            print(f"Pending migrations: {', '.join(pending) or 'none'}")
+            print(f"Deferred indexes: {', '.join(indexes) or 'none'}")
+
+        elif command == 'verify':
+            if not verify_database(args.db, full=args.full):
+                # Never delete a damaged database; keep a copy and let an admin
+                # restore from the latest good backup
+                backup_database(
+                    f"{args.db}.backup_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}",
+                    args.db
+                )
+                logger.error("Database verification failed; restore from a known-good backup")
+                sys.exit(1)
+
+        elif command == 'check-plans':
+            conn = _configure_connection(sqlite3.connect(args.db))
+            try:
+                problems = check_query_plans(conn)
+            finally:
+                conn.close()
+            for name in HOT_QUERIES:
+                print(f"{'FAIL' if name in problems else 'ok'}  {name}")
+                for detail in problems.get(name, []):
+                    print(f"      {detail}")
+            if problems:
+                sys.exit(1)
+
+        elif command == 'rebuild-counts':
+            conn = _configure_connection(sqlite3.connect(args.db))
+            try:
+                with conn:
+                    rows = _rebuild_stock_counts(conn.cursor())
+            finally:
+                conn.close()
+            logger.info(f"Rebuilt stock counters ({rows} rows)")
+
+        elif command == 'backfill-order-items':
+            backfill_writer = WriteQueue(args.db)
+            try:
+                result = backfill_order_items(backfill_writer)
+            finally:
+                backfill_writer.close()
+            print(json.dumps(result, indent=2))
+
+        elif command == 'archive':
+            archive_writer = WriteQueue(args.db)
+            try:
+                result = Archiver(
+                    archive_writer,
+                    stock_days=args.stock_days,
+                    transaction_days=args.transaction_days
+                ).run_once()
+            finally:
+                archive_writer.close()
+            print(json.dumps(result, indent=2))
+
+        elif command == 'backup':
+            destination = args.destination or f"{args.db}.backup_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
+            backup_database(destination, args.db)
+
     except Exception as e:
-        logger.error(f"Failed to initialize database: {e}", exc_info=True)
\ No newline at end of file
+        logger.error(f"Database command '{command}' failed: {e}", exc_info=True)
+        sys.exit(1)
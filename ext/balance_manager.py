@@ -8,7 +8,7 @@ import discord
 from discord.ext import commands
 
 from .constants import Balance, TransactionError
-from database import get_connection
+from database import db
 
 class BalanceManagerService:
     _instance = None
@@ -45,13 +45,10 @@ class BalanceManagerService:
 
         async with await self._get_lock(cache_key):
             try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                cursor.execute(
+                result = await db.fetchone(
                     "SELECT growid FROM user_growid WHERE discord_id = ? COLLATE binary",
                     (str(discord_id),)
                 )
-                result = cursor.fetchone()
                 
                 if result:
                     growid = result['growid']
@@ -66,43 +63,34 @@ class BalanceManagerService:
             except Exception as e:
                 self.logger.error(f"Error getting GrowID: {e}")
                 return None
-            finally:
-                if conn:
-                    conn.close()
 
     async def register_user(self, discord_id: str, growid: str) -> bool:
         async with await self._get_lock(f"register_{discord_id}"):
-            conn = None
             try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
-                # Check if GrowID already exists (case-sensitive)
-                cursor.execute("""
-                    SELECT growid FROM users 
-                    WHERE growid = ? COLLATE binary
-                """, (growid,))
-                
-                existing = cursor.fetchone()
-                if existing and existing['growid'] != growid:
-                    raise ValueError(f"GrowID already exists with different case: {existing['growid']}")
+                def _register(cursor):
+                    # Check if GrowID already exists (case-sensitive)
+                    cursor.execute("""
+                        SELECT growid FROM users 
+                        WHERE growid = ? COLLATE binary
+                    """, (growid,))
                 
-                # Begin transaction
-                conn.execute("BEGIN TRANSACTION")
+                    existing = cursor.fetchone()
+                    if existing and existing['growid'] != growid:
+                        raise ValueError(f"GrowID already exists with different case: {existing['growid']}")
                 
-                # Create user if not exists
-                cursor.execute(
-                    "INSERT OR IGNORE INTO users (growid) VALUES (?)",
-                    (growid,)
-                )
-                
-                # Link Discord ID to GrowID
-                cursor.execute(
-                    "INSERT OR REPLACE INTO user_growid (discord_id, growid) VALUES (?, ?)",
-                    (str(discord_id), growid)
-                )
+                    # Create user if not exists
+                    cursor.execute(
+                        "INSERT OR IGNORE INTO users (growid) VALUES (?)",
+                        (growid,)
+                    )
                 
-                conn.commit()
+                    # Link Discord ID to GrowID
+                    cursor.execute(
+                        "INSERT OR REPLACE INTO user_growid (discord_id, growid) VALUES (?, ?)",
+                        (str(discord_id), growid)
+                    )
+
+                await db.transaction(_register)
                 self.logger.info(f"Registered Discord user {discord_id} with GrowID {growid}")
                 
                 # Update cache
@@ -116,31 +104,21 @@ class BalanceManagerService:
 
             except Exception as e:
                 self.logger.error(f"Error registering user: {e}")
-                if conn:
-                    conn.rollback()
                 return False
-            finally:
-                if conn:
-                    conn.close()
 
     async def update_user_growid(self, discord_id: str, new_growid: str) -> bool:
         async with await self._get_lock(f"update_growid_{discord_id}"):
-            conn = None
             try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
-                # Get old GrowID
-                cursor.execute(
-                    "SELECT growid FROM user_growid WHERE discord_id = ? COLLATE binary",
-                    (str(discord_id),)
-                )
-                result = cursor.fetchone()
-                old_growid = result['growid'] if result else None
-                
-                if old_growid:
-                    # Begin transaction
-                    conn.execute("BEGIN TRANSACTION")
+                def _update(cursor):
+                    # Get old GrowID
+                    cursor.execute(
+                        "SELECT growid FROM user_growid WHERE discord_id = ? COLLATE binary",
+                        (str(discord_id),)
+                    )
+                    result = cursor.fetchone()
+                    old_growid = result['growid'] if result else None
+                    if not old_growid:
+                        return None
                     
                     # Get old balance
                     cursor.execute(
@@ -196,28 +174,24 @@ class BalanceManagerService:
                             "DELETE FROM users WHERE growid = ?",
                             (old_growid,)
                         )
-                        
-                    conn.commit()
-                    
-                    # Update cache
-                    self._cache.pop(f"balance_{old_growid}", None)
-                    self._cache.pop(f"balance_{new_growid}", None)
-                    self._cache.pop(f"growid_{discord_id}", None)
-                    
-                    self.logger.info(f"Updated GrowID for {discord_id}: {old_growid} -> {new_growid}")
-                    return True
-                else:
+                    return old_growid
+
+                old_growid = await db.transaction(_update)
+                if not old_growid:
                     # If no existing GrowID, just register as new
                     return await self.register_user(discord_id, new_growid)
+                    
+                # Update cache
+                self._cache.pop(f"balance_{old_growid}", None)
+                self._cache.pop(f"balance_{new_growid}", None)
+                self._cache.pop(f"growid_{discord_id}", None)
+                
+                self.logger.info(f"Updated GrowID for {discord_id}: {old_growid} -> {new_growid}")
+                return True
 
             except Exception as e:
                 self.logger.error(f"Error updating GrowID: {e}")
-                if conn:
-                    conn.rollback()
                 return False
-            finally:
-                if conn:
-                    conn.close()
 
     async def get_balance(self, growid: str) -> Optional[Balance]:
         cache_key = f"balance_{growid}"
@@ -231,9 +205,7 @@ class BalanceManagerService:
 
         async with await self._get_lock(cache_key):
             try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                cursor.execute(
+                result = await db.fetchone(
                     """
                     SELECT balance_wl, balance_dl, balance_bgl 
                     FROM users 
@@ -241,7 +213,6 @@ class BalanceManagerService:
                     """,
                     (growid,)
                 )
-                result = cursor.fetchone()
                 
                 if result:
                     balance = Balance(
@@ -259,18 +230,14 @@ class BalanceManagerService:
             except Exception as e:
                 self.logger.error(f"Error getting balance: {e}")
                 return None
-            finally:
-                if conn:
-                    conn.close()
 
     async def update_balance(self, growid: str, wl: int = 0, dl: int = 0, bgl: int = 0,
-                           details: str = "", transaction_type: str = "") -> Optional[Balance]:
-        async with await self._get_lock(f"balance_{growid}"):
-            conn = None
-            try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
+                           details: str = "", transaction_type: str = "",
+                           idempotency_key: Optional[str] = None) -> Optional[Balance]:
+        # No per-user lock: the single writer runs the read and the update
+        # in one transaction, and idempotency_key absorbs replays
+        try:
+            def _update(cursor):
                 # Get current balance
                 cursor.execute(
                     """
@@ -281,21 +248,21 @@ class BalanceManagerService:
                     (growid,)
                 )
                 current = cursor.fetchone()
-                
+            
                 if not current:
                     raise TransactionError(f"User {growid} not found")
-                
+            
                 old_balance = Balance(
                     current['balance_wl'],
                     current['balance_dl'],
                     current['balance_bgl']
                 )
-                
+            
                 # Calculate new balance
                 new_wl = max(0, current['balance_wl'] + wl)
                 new_dl = max(0, current['balance_dl'] + dl)
                 new_bgl = max(0, current['balance_bgl'] + bgl)
-                
+            
                 # Update balance
                 cursor.execute(
                     """
@@ -305,7 +272,7 @@ class BalanceManagerService:
                     """,
                     (new_wl, new_dl, new_bgl, growid)
                 )
-                
+            
                 # Record transaction
                 new_balance = Balance(new_wl, new_dl, new_bgl)
                 cursor.execute(
@@ -322,98 +289,102 @@ class BalanceManagerService:
                         new_balance.format()
                     )
                 )
-                
-                conn.commit()
-                
-                # Update cache
-                cache_key = f"balance_{growid}"
-                self._cache[cache_key] = {
-                    'value': new_balance,
-                    'timestamp': time.time()
+                # Plain values so the result can be stored for replays
+                return {
+                    'old': [old_balance.wl, old_balance.dl, old_balance.bgl],
+                    'new': [new_wl, new_dl, new_bgl]
                 }
-                
-                self.logger.info(f"Updated balance for {growid}: {old_balance.format()} -> {new_balance.format()}")
+
+            result = await db.transaction(_update, idempotency_key=idempotency_key)
+            old_balance = Balance(*result['old'])
+            new_balance = Balance(*result['new'])
+            cache_key = f"balance_{growid}"
+            if result.get('replayed'):
+                # The stored result is from the first run, not current
+                self._cache.pop(cache_key, None)
+                self.logger.info(f"Balance update {idempotency_key} for {growid} already applied")
                 return new_balance
+            
+            # Update cache
+            self._cache[cache_key] = {
+                'value': new_balance,
+                'timestamp': time.time()
+            }
+            
+            self.logger.info(f"Updated balance for {growid}: {old_balance.format()} -> {new_balance.format()}")
+            return new_balance
 
-            except Exception as e:
-                self.logger.error(f"Error updating balance: {e}")
-                if conn:
-                    conn.rollback()
-                return None
-            finally:
-                if conn:
-                    conn.close()
+        except Exception as e:
+            self.logger.error(f"Error updating balance: {e}")
+            return None
 
     async def transfer_balance(self, from_growid: str, to_growid: str, amount: int) -> bool:
         async with await self._get_lock(f"transfer_{from_growid}_{to_growid}"):
-            conn = None
             try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
-                # Check sender balance
-                cursor.execute(
-                    "SELECT balance_wl FROM users WHERE growid = ?",
-                    (from_growid,)
-                )
-                sender = cursor.fetchone()
-                if not sender or sender['balance_wl'] < amount:
-                    raise ValueError("Insufficient balance")
-                
-                # Check receiver exists
-                cursor.execute(
-                    "SELECT balance_wl FROM users WHERE growid = ?",
-                    (to_growid,)
-                )
-                receiver = cursor.fetchone()
-                if not receiver:
-                    raise ValueError(f"Receiver {to_growid} not found")
+                def _transfer(cursor):
+                    # Check sender balance
+                    cursor.execute(
+                        "SELECT balance_wl FROM users WHERE growid = ?",
+                        (from_growid,)
+                    )
+                    sender = cursor.fetchone()
+                    if not sender or sender['balance_wl'] < amount:
+                        raise ValueError("Insufficient balance")
                 
-                # Update balances
-                cursor.execute(
-                    "UPDATE users SET balance_wl = balance_wl - ? WHERE growid = ?",
-                    (amount, from_growid)
-                )
+                    # Check receiver exists
+                    cursor.execute(
+                        "SELECT balance_wl FROM users WHERE growid = ?",
+                        (to_growid,)
+                    )
+                    receiver = cursor.fetchone()
+                    if not receiver:
+                        raise ValueError(f"Receiver {to_growid} not found")
                 
-                cursor.execute(
-                    "UPDATE users SET balance_wl = balance_wl + ? WHERE growid = ?",
-                    (amount, to_growid)
-                )
+                    # Update balances
+                    cursor.execute(
+                        "UPDATE users SET balance_wl = balance_wl - ? WHERE growid = ?",
+                        (amount, from_growid)
+                    )
                 
-                # Record transactions
-                cursor.execute(
-                    """
-                    INSERT INTO transactions 
-                    (growid, type, details, old_balance, new_balance, related_growid)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        from_growid,
-                        'TRANSFER_OUT',
-                        f"Transfer to {to_growid}",
-                        f"{sender['balance_wl']} WL",
-                        f"{sender['balance_wl'] - amount} WL",
-                        to_growid
+                    cursor.execute(
+                        "UPDATE users SET balance_wl = balance_wl + ? WHERE growid = ?",
+                        (amount, to_growid)
                     )
-                )
                 
-                cursor.execute(
-                    """
-                    INSERT INTO transactions 
-                    (growid, type, details, old_balance, new_balance, related_growid)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        to_growid,
-                        'TRANSFER_IN',
-                        f"Transfer from {from_growid}",
-                        f"{receiver['balance_wl']} WL",
-                        f"{receiver['balance_wl'] + amount} WL",
-                        from_growid
+                    # Record transactions
+                    cursor.execute(
+                        """
+                        INSERT INTO transactions 
+                        (growid, type, details, old_balance, new_balance, related_growid)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        """,
+                        (
+                            from_growid,
+                            'TRANSFER_OUT',
+                            f"Transfer to {to_growid}",
+                            f"{sender['balance_wl']} WL",
+                            f"{sender['balance_wl'] - amount} WL",
+                            to_growid
+                        )
                     )
-                )
                 
-                conn.commit()
+                    cursor.execute(
+                        """
+                        INSERT INTO transactions 
+                        (growid, type, details, old_balance, new_balance, related_growid)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        """,
+                        (
+                            to_growid,
+                            'TRANSFER_IN',
+                            f"Transfer from {from_growid}",
+                            f"{receiver['balance_wl']} WL",
+                            f"{receiver['balance_wl'] + amount} WL",
+                            from_growid
+                        )
+                    )
+
+                await db.transaction(_transfer)
                 
                 # Invalidate cache
                 self._cache.pop(f"balance_{from_growid}", None)
@@ -424,12 +395,7 @@ class BalanceManagerService:
 
             except Exception as e:
                 self.logger.error(f"Error transferring balance: {e}")
-                if conn:
-                    conn.rollback()
                 raise
-            finally:
-                if conn:
-                    conn.close()
 
     async def cleanup(self):
         """Cleanup resources"""
@@ -3,10 +3,39 @@ from collections import namedtuple
 
 # Timeouts and Intervals
 COOLDOWN_SECONDS = 3
-UPDATE_INTERVAL = 55  # seconds
+UPDATE_INTERVAL = 300  # seconds; live board safety net, changes arrive via stock_changed
+LIVE_STOCK_DEBOUNCE = 2  # seconds to collect a burst of stock changes into one edit
+LIVE_STOCK_QUERY_BUDGET = 1  # database calls allowed per board refresh
+LIVE_STOCK_PAGE_SIZE = 10  # products per board message (Discord allows 25 fields)
+LIVE_STOCK_DESCRIPTION_LIMIT = 200  # characters of a product description on the board
+LIVE_STOCK_NAME_LIMIT = 100
+LIVE_STOCK_HISTORY_SCAN = 50  # messages searched when no saved board ids work
+LIVE_STOCK_SETTING_KEY = 'live_stock_messages'  # bot_settings key of the board message ids
 CACHE_TIMEOUT = 60
 PAGE_TIMEOUT = 60  # seconds
 ADMIN_CONFIRM_TIMEOUT = 30  # seconds
+RESERVATION_TTL = 120  # seconds a buyer has to confirm reserved stock
+RESERVATION_REAP_INTERVAL = 30  # seconds
+RESERVATION_REAP_BATCH = 500
+ALLOCATION_QUEUE_SIZE = 50  # prefetched stock ids per product
+ALLOCATION_LOW_WATER = 10  # refill in the background below this
+OUTBOX_POLL_INTERVAL = 5  # seconds
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_CONCURRENCY = 5
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF_BASE = 5  # seconds, doubled per attempt
+OUTBOX_BACKOFF_MAX = 900  # seconds
+STOCK_IMPORT_CHUNK = 500  # stock rows per import transaction
+PROGRESS_UPDATE_INTERVAL = 2  # seconds between progress message edits
+STOCK_IMPORT_WINDOW = 20000  # lines read, validated and deduplicated together
+STOCK_VALIDATE_CHUNK = 5000  # lines per validation job in the process pool
+STOCK_VALIDATE_PARALLEL_MIN = 5000  # smaller windows are validated inline
+STOCK_VALIDATE_WORKERS = None  # process pool size, None = CPU count
+MAX_STOCK_LINE_LENGTH = 1000
+MAX_REJECT_REPORT_LINES = 10000
+STOCK_BLOOM_ERROR_RATE = 0.01  # false positives cost one indexed lookup
+STOCK_BLOOM_MIN_CAPACITY = 100_000
+STOCK_BLOOM_BUILD_BATCH = 5000  # hashes read per query while building
 
 # Database Status
 STATUS_AVAILABLE = 'available'
@@ -14,6 +43,13 @@ STATUS_SOLD = 'sold'
 STATUS_DELETED = 'deleted'
 STATUS_PENDING = 'pending'
 
+# Stock import line results
+IMPORT_ADDED = 'added'
+IMPORT_EMPTY = 'empty'
+IMPORT_DUPLICATE = 'duplicate'  # repeated earlier in the same file
+IMPORT_EXISTS = 'exists'  # already in the stock table
+IMPORT_INVALID = 'invalid'  # rejected by the product's validator
+
 # Transaction Types
 TRANSACTION_PURCHASE = 'PURCHASE'
 TRANSACTION_REFUND = 'REFUND'
@@ -24,6 +60,10 @@ TRANSACTION_ADMIN_ADD = 'ADMIN_ADD'
 TRANSACTION_ADMIN_REMOVE = 'ADMIN_REMOVE'
 TRANSACTION_ADMIN_RESET = 'ADMIN_RESET'
 
+# Outbox Kinds
+OUTBOX_PURCHASE_DM = 'purchase_dm'
+OUTBOX_PURCHASE_LOG = 'purchase_log'
+
 # Currency Rates
 CURRENCY_RATES = {
     'WL': 1,
@@ -32,10 +72,11 @@ CURRENCY_RATES = {
 }
 
 # File Limits and Settings
-MAX_STOCK_FILE_SIZE = 1024 * 1024  # 1MB
+MAX_STOCK_FILE_SIZE = 512 * 1024 * 1024  # 512MB, override with stock_import.max_file_size_mb
+STOCK_DOWNLOAD_CHUNK = 64 * 1024  # bytes per streamed read
 VALID_STOCK_FORMATS = ['txt']
 MAX_FILE_SIZES = {
-    'stock': 1024 * 1024,  # 1MB
+    'stock': MAX_STOCK_FILE_SIZE,
     'backup': 10 * 1024 * 1024  # 10MB
 }
 ALLOWED_FILE_TYPES = {
@@ -60,6 +101,7 @@ MIN_TRANSACTION_AMOUNT = 1
 MAX_TRANSACTION_AMOUNT = 1000000  # 1M WLs
 MIN_PURCHASE_QUANTITY = 1
 MAX_PURCHASE_QUANTITY = 100
+MAX_CART_LINES = 10
 MAX_TRANSACTION_HISTORY = 50
 ADMIN_BULK_UPDATE_CHUNK = 10
 
@@ -88,7 +130,7 @@ MESSAGES = {
     'SUCCESS_REMOVE': "✅ Successfully removed!",
     'SUCCESS_UPDATE': "✅ Successfully updated!",
     'INVALID_CURRENCY': "❌ Invalid currency. Use: WL, DL, or BGL",
-    'FILE_TOO_LARGE': "❌ File is too large! Maximum size is 1MB.",
+    'FILE_TOO_LARGE': "❌ File is too large! Maximum size is {max_mb}MB.",
     'INVALID_FILE_FORMAT': "❌ Invalid file format! Please use .txt files only.",
     'NO_ITEMS_FOUND': "❌ No items found in file!",
     'STOCK_ADDED': "✅ Stock items successfully added!",
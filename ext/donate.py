@@ -1,9 +1,11 @@
 import discord
 from discord.ext import commands
 from .balance_manager import BalanceManagerService
-from database import get_connection
+from .constants import TRANSACTION_DEPOSIT
+from database import db
 import logging
 from datetime import datetime
+from typing import Optional
 
 class Donate(commands.Cog):
     """
@@ -45,8 +47,23 @@ class Donate(commands.Cog):
                         await log_channel.send(f"⚠️ [DONASI GAGAL] GrowID '{growid}' tidak terdaftar dalam database.")
                 return
 
+            # Webhook message id sebagai idempotency key, supaya replay
+            # dari gateway tidak menambah balance dua kali
+            idempotency_key = f"donation:{message.id}"
+            if await db.fetchval("SELECT 1 FROM idempotency_keys WHERE key = ?", (idempotency_key,)):
+                self.logger.info(f"Donation message {message.id} already processed")
+                return
+
             # Proses penambahan balance
-            await self.balance_service.add_balance(discord_id, total_wl)
+            new_balance = await self.balance_service.update_balance(
+                growid,
+                wl=total_wl,
+                details=f"Donation: {deposit}",
+                transaction_type=TRANSACTION_DEPOSIT,
+                idempotency_key=idempotency_key
+            )
+            if new_balance is None:
+                raise RuntimeError(f"Failed to add balance for {growid}")
 
             # Kirim log donasi
             await self._send_donation_log(growid, total_wl, deposit)
@@ -88,18 +105,9 @@ class Donate(commands.Cog):
                 
         return wl, dl, bgl
 
-    async def _get_discord_id(self, growid: str) -> int:
+    async def _get_discord_id(self, growid: str) -> Optional[str]:
         """Dapatkan Discord ID dari GrowID"""
-        conn = None
-        try:
-            conn = get_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT user_id FROM users WHERE growid = ?", (growid,))
-            row = cur.fetchone()
-            return row[0] if row else None
-        finally:
-            if conn:
-                conn.close()
+        return await db.fetchval("SELECT discord_id FROM user_growid WHERE growid = ?", (growid,))
 
     async def _send_donation_log(self, growid: str, total_wl: int, deposit_text: str):
         """Kirim log donasi ke channel yang ditentukan"""
@@ -5,11 +5,13 @@ import discord
 from discord import ui
 from discord.ext import commands
 
-from .constants import Balance
+from .constants import Balance, RESERVATION_TTL, MAX_CART_LINES, MAX_PURCHASE_QUANTITY
 from .balance_manager import BalanceManagerService
 from .product_manager import ProductManagerService
 from .trx import TransactionManager
-from database import get_connection
+
+# Items are echoed in the ephemeral reply when they fit in one message
+MAX_EPHEMERAL_ITEMS_LENGTH = 1900
 
 class SetGrowIDModal(ui.Modal, title="Set GrowID"):
     def __init__(self, bot):
@@ -64,6 +66,87 @@ class SetGrowIDModal(ui.Modal, title="Set GrowID"):
             self.logger.error(f"Error in SetGrowIDModal: {e}")
             await interaction.followup.send("❌ An error occurred", ephemeral=True)
 
+class ConfirmPurchaseView(ui.View):
+    def __init__(self, bot, growid: str, reservation: dict):
+        super().__init__(timeout=RESERVATION_TTL)
+        self.bot = bot
+        self.growid = growid
+        self.reservation = reservation
+        self.logger = logging.getLogger("ConfirmPurchaseView")
+        self.trx_manager = TransactionManager(bot)
+        self.finished = False
+
+    async def on_timeout(self):
+        # The reaper would release it too; do it now so stock comes back sooner
+        if not self.finished:
+            self.finished = True
+            await self.trx_manager.release_reservation(self.reservation['reservation_id'], self.growid)
+
+    @discord.ui.button(label="Confirm", emoji="✅", style=discord.ButtonStyle.success)
+    async def button_confirm_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.finished:
+            await interaction.response.send_message("❌ This order is no longer active", ephemeral=True)
+            return
+        self.finished = True
+        self.stop()
+
+        try:
+            await interaction.response.defer(ephemeral=True)
+
+            try:
+                result = await self.trx_manager.confirm_reservation(
+                    self.reservation['reservation_id'],
+                    self.growid,
+                    buyer=interaction.user
+                )
+            except Exception as e:
+                await self.trx_manager.release_reservation(self.reservation['reservation_id'], self.growid)
+                await interaction.followup.send(f"❌ {str(e)}", ephemeral=True)
+                return
+
+            # The receipt DM and buy-log post were queued with the purchase
+            # and are delivered by the outbox dispatcher
+            embed = discord.Embed(
+                title="✅ Purchase Successful",
+                color=discord.Color.green(),
+                timestamp=datetime.utcnow()
+            )
+            embed.add_field(name="Order ID", value=f"#{result['order_id']}", inline=True)
+            embed.add_field(name="Product", value=f"`{result['product_name']}`", inline=True)
+            embed.add_field(name="Quantity", value=str(self.reservation['quantity']), inline=True)
+            embed.add_field(name="Total Price", value=f"{result['total_price']:,} WL", inline=True)
+            embed.add_field(name="New Balance", value=f"{result['new_balance']:,} WL", inline=False)
+            embed.add_field(
+                name="Purchase Details",
+                value="✉️ The detailed purchase result is on its way to your DM. Please enable DMs from server members.",
+                inline=False
+            )
+
+            content_msg = "**Your Items:**\n"
+            for item in result['items']:
+                content_msg += f"```{item['content']}```\n"
+
+            await interaction.followup.send(
+                embed=embed,
+                content=content_msg if len(content_msg) <= MAX_EPHEMERAL_ITEMS_LENGTH else None,
+                ephemeral=True
+            )
+
+        except Exception as e:
+            self.logger.error(f"Error confirming purchase: {e}")
+            await interaction.followup.send("❌ An error occurred", ephemeral=True)
+
+    @discord.ui.button(label="Cancel", emoji="✖️", style=discord.ButtonStyle.secondary)
+    async def button_cancel_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.finished:
+            await interaction.response.send_message("❌ This order is no longer active", ephemeral=True)
+            return
+        self.finished = True
+        self.stop()
+
+        await self.trx_manager.release_reservation(self.reservation['reservation_id'], self.growid)
+        await interaction.response.send_message("🛑 Purchase cancelled, items released.", ephemeral=True)
+
 class BuyModal(ui.Modal, title="Buy Product"):
     def __init__(self, bot):
         super().__init__()
@@ -114,55 +197,125 @@ class BuyModal(ui.Modal, title="Buy Product"):
                 await interaction.followup.send("❌ Invalid quantity!", ephemeral=True)
                 return
 
-            # Process purchase
+            # Hold the items while the buyer confirms
             try:
-                result = await self.trx_manager.process_purchase(
+                reservation = await self.trx_manager.reserve_stock(
                     growid=growid,
                     product_code=self.code.value,
-                    quantity=quantity
+                    quantity=quantity,
+                    idempotency_key=f"reserve:{interaction.id}"
                 )
             except Exception as e:
                 await interaction.followup.send(f"❌ {str(e)}", ephemeral=True)
                 return
 
-            # Log purchase to buy-logs channel
-            await self.trx_manager.log_purchase_to_channel(
-                order_id=result['order_id'],
-                user=interaction.user,
-                product_code=self.code.value,
-                total=quantity,
-                price=result['total_price']
-            )
-
             embed = discord.Embed(
-                title="✅ Purchase Successful",
-                color=discord.Color.green(),
+                title="🛒 Confirm Purchase",
+                description=f"Items are reserved for you for {RESERVATION_TTL} seconds.",
+                color=discord.Color.gold(),
                 timestamp=datetime.utcnow()
             )
-            embed.add_field(name="Product", value=f"`{result['product_name']}`", inline=True)
+            embed.add_field(name="Product", value=f"`{reservation['product_name']}`", inline=True)
             embed.add_field(name="Quantity", value=str(quantity), inline=True)
-            embed.add_field(name="Total Price", value=f"{result['total_price']:,} WL", inline=True)
-            embed.add_field(name="New Balance", value=f"{result['new_balance']:,} WL", inline=False)
+            embed.add_field(name="Total Price", value=f"{reservation['total_price']:,} WL", inline=True)
 
-            # Send purchase result via DM
-            dm_sent = await self.trx_manager.send_purchase_result(
-                user=interaction.user,
-                items=result['items'],
-                product_name=result['product_name']
-            )
+            view = ConfirmPurchaseView(self.bot, growid, reservation)
+            await interaction.followup.send(embed=embed, view=view, ephemeral=True)
 
-            if dm_sent:
-                embed.add_field(
-                    name="Purchase Details",
-                    value="✉️ Check your DM for the detailed purchase result!",
-                    inline=False
+        except Exception as e:
+            self.logger.error(f"Error in BuyModal: {e}")
+            await interaction.followup.send("❌ An error occurred", ephemeral=True)
+
+
+class CartModal(ui.Modal, title="Buy Multiple Products"):
+    def __init__(self, bot):
+        super().__init__()
+        self.bot = bot
+        self.logger = logging.getLogger("CartModal")
+        self.balance_manager = BalanceManagerService(bot)
+        self.trx_manager = TransactionManager(bot)
+
+    cart = ui.TextInput(
+        label="Products",
+        style=discord.TextStyle.paragraph,
+        placeholder="One product per line: CODE QUANTITY\nDL 2\nBGL 1",
+        min_length=1,
+        max_length=500,
+        required=True
+    )
+
+    @staticmethod
+    def parse_cart(text: str) -> dict:
+        """Parse ``CODE QUANTITY`` lines into {code: quantity}; raises ValueError"""
+        cart = {}
+        for line in text.splitlines():
+            parts = line.split()
+            if not parts:
+                continue
+            if len(parts) > 2:
+                raise ValueError(f"Invalid line: {line.strip()}")
+            code = parts[0]
+            try:
+                quantity = int(parts[1]) if len(parts) == 2 else 1
+            except ValueError:
+                raise ValueError(f"Invalid quantity for {code}") from None
+            if quantity <= 0:
+                raise ValueError(f"Invalid quantity for {code}")
+            cart[code] = cart.get(code, 0) + quantity
+
+        if not cart:
+            raise ValueError("Cart is empty")
+        if len(cart) > MAX_CART_LINES:
+            raise ValueError(f"Maximum {MAX_CART_LINES} products per order")
+        if sum(cart.values()) > MAX_PURCHASE_QUANTITY:
+            raise ValueError(f"Maximum {MAX_PURCHASE_QUANTITY} items per order")
+        return cart
+
+    async def on_submit(self, interaction: discord.Interaction):
+        try:
+            await interaction.response.defer(ephemeral=True)
+
+            growid = await self.balance_manager.get_growid(interaction.user.id)
+            if not growid:
+                await interaction.followup.send("❌ Please set your GrowID first!", ephemeral=True)
+                return
+
+            try:
+                cart = self.parse_cart(self.cart.value)
+            except ValueError as e:
+                await interaction.followup.send(f"❌ {str(e)}", ephemeral=True)
+                return
+
+            try:
+                result = await self.trx_manager.process_order(
+                    growid, cart,
+                    buyer=interaction.user,
+                    idempotency_key=f"order:{interaction.id}"
                 )
-            else:
+            except Exception as e:
+                await interaction.followup.send(f"❌ {str(e)}", ephemeral=True)
+                return
+
+            # Receipt DM and buy-log post go out through the outbox
+            embed = discord.Embed(
+                title="✅ Order Successful",
+                color=discord.Color.green(),
+                timestamp=datetime.utcnow()
+            )
+            embed.add_field(name="Order ID", value=f"#{result['order_id']}", inline=False)
+            for line in result['lines']:
                 embed.add_field(
-                    name="Purchase Details",
-                    value="⚠️ Could not send DM. Please enable DMs from server members to receive purchase details.",
+                    name=line['product_name'],
+                    value=f"{line['quantity']} x {line['unit_price']:,} WL = {line['total_price']:,} WL",
                     inline=False
                 )
+            embed.add_field(name="Total Price", value=f"{result['total_price']:,} WL", inline=True)
+            embed.add_field(name="New Balance", value=f"{result['new_balance']:,} WL", inline=True)
+            embed.add_field(
+                name="Purchase Details",
+                value="✉️ One combined receipt is on its way to your DM. Please enable DMs from server members.",
+                inline=False
+            )
 
             content_msg = "**Your Items:**\n"
             for item in result['items']:
@@ -170,10 +323,10 @@ class BuyModal(ui.Modal, title="Buy Product"):
 
             await interaction.followup.send(
                 embed=embed,
-                content=content_msg if not dm_sent else None,
+                content=content_msg if len(content_msg) <= MAX_EPHEMERAL_ITEMS_LENGTH else None,
                 ephemeral=True
             )
 
         except Exception as e:
-            self.logger.error(f"Error in BuyModal: {e}")
-            await interaction.followup.send("❌ An error occurred", ephemeral=True)
\ No newline at end of file
+            self.logger.error(f"Error in CartModal: {e}")
+            await interaction.followup.send("❌ An error occurred", ephemeral=True)
@@ -1,11 +1,23 @@
 import discord
+import hashlib
+import json
 import logging
 import time
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 
 from .product_manager import ProductManagerService
-from .constants import CACHE_TIMEOUT
+from .constants import (
+    CACHE_TIMEOUT,
+    LIVE_STOCK_QUERY_BUDGET,
+    LIVE_STOCK_PAGE_SIZE,
+    LIVE_STOCK_DESCRIPTION_LIMIT,
+    LIVE_STOCK_NAME_LIMIT,
+    LIVE_STOCK_SETTING_KEY
+)
+from database import db, count_queries
+
+BOARD_TITLE = "🏪 Store Stock Status"
 
 class LiveStockService:
     _instance = None
@@ -23,6 +35,7 @@ class LiveStockService:
             self.product_manager = ProductManagerService(bot)
             self._cache = {}
             self._cache_timeout = CACHE_TIMEOUT
+            self.last_query_count = 0
             self.initialized = True
 
     def _get_cached(self, key: str):
@@ -39,33 +52,62 @@ class LiveStockService:
             'timestamp': time.time()
         }
 
-    async def create_stock_embed(self, products: list) -> discord.Embed:
-        # Nonaktifkan caching untuk memastikan data selalu fresh
+    async def build_board(self) -> List[discord.Embed]:
+        """Render the board pages from the cached catalog: at most one query.
+
+        Products are sorted by code and cut into fixed slices of
+        LIVE_STOCK_PAGE_SIZE, one embed per board message, so a page only
+        changes when one of its own products does. The query count of the
+        last refresh is kept in ``last_query_count`` and a refresh over
+        LIVE_STOCK_QUERY_BUDGET is logged.
+        """
+        with count_queries() as queries:
+            products = sorted(await self.product_manager.get_all_products(), key=lambda x: x['code'])
+            slices = [
+                products[start:start + LIVE_STOCK_PAGE_SIZE]
+                for start in range(0, len(products), LIVE_STOCK_PAGE_SIZE)
+            ] or [[]]
+            pages = [
+                await self.create_stock_embed(page_products, page, len(slices))
+                for page, page_products in enumerate(slices, 1)
+            ]
+        self.last_query_count = queries.count
+        if queries.count > LIVE_STOCK_QUERY_BUDGET:
+            self.logger.warning(
+                f"Live stock refresh used {queries.count} queries (budget {LIVE_STOCK_QUERY_BUDGET})"
+            )
+        return pages
+
+    async def create_stock_embed(self, products: list, page: int = 1, pages: int = 1) -> discord.Embed:
+        # Counts come with the product rows (get_all_products), which
+        # stock writes invalidate, so nothing is queried per product
         embed = discord.Embed(
-            title="🏪 Store Stock Status",
+            title=BOARD_TITLE if pages == 1 else f"{BOARD_TITLE} ({page}/{pages})",
             color=discord.Color.blue(),
             timestamp=datetime.utcnow()
         )
 
         if products:
             for product in sorted(products, key=lambda x: x['code']):
-                # Force invalidate cache dan ambil data fresh
-                self.product_manager.invalidate_cache(product['code'])
-                stock_count = await self.product_manager.get_stock_count(product['code'])
-                
-                # Tambah logging untuk debugging
-                self.logger.info(f"Live Stock Update - Product: {product['code']}, Stock Count: {stock_count}")
+                stock_count = product.get('stock_count', 0)
+                reserved_count = product.get('reserved_count', 0)
                 
                 value = (
                     f"💎 Code: `{product['code']}`\n"
                     f"📦 Stock: `{stock_count}`\n"
-                    f"💰 Price: `{product['price']:,} WL`\n"
                 )
+                if reserved_count:
+                    value += f"⏳ Reserved: `{reserved_count}`\n"
+                value += f"💰 Price: `{product['price']:,} WL`\n"
                 if product.get('description'):
-                    value += f"📝 Info: {product['description']}\n"
+                    # Keeps a full page well inside Discord's 6000 character embed cap
+                    description = product['description']
+                    if len(description) > LIVE_STOCK_DESCRIPTION_LIMIT:
+                        description = description[:LIVE_STOCK_DESCRIPTION_LIMIT - 1] + "…"
+                    value += f"📝 Info: {description}\n"
                 
                 embed.add_field(
-                    name=f"🔸 {product['name']} 🔸",
+                    name=f"🔸 {product['name'][:LIVE_STOCK_NAME_LIMIT]} 🔸",
                     value=value,
                     inline=False
                 )
@@ -75,6 +117,31 @@ class LiveStockService:
         embed.set_footer(text=f"Last Update: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC")
         return embed
 
+    async def load_board_ids(self) -> Optional[Dict]:
+        """``{'channel_id', 'message_ids'}`` of the board, as last saved"""
+        value = await db.fetchval("SELECT value FROM bot_settings WHERE key = ?", (LIVE_STOCK_SETTING_KEY,))
+        if not value:
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            self.logger.warning(f"Ignoring malformed {LIVE_STOCK_SETTING_KEY} setting: {value}")
+            return None
+
+    async def save_board_ids(self, channel_id: int, message_ids: List[int]):
+        await db.execute("""
+            INSERT INTO bot_settings (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (LIVE_STOCK_SETTING_KEY, json.dumps({'channel_id': channel_id, 'message_ids': message_ids})))
+
+    @staticmethod
+    def board_hash(embed: discord.Embed) -> str:
+        """Hash of what the board shows, ignoring its update time"""
+        data = embed.to_dict()
+        data.pop('timestamp', None)
+        data.pop('footer', None)
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
     async def cleanup(self):
         """Cleanup resources"""
         self._cache.clear()
\ No newline at end of file
@@ -5,9 +5,9 @@ import asyncio
 import json
 from datetime import datetime
 
-from .live_service import LiveStockService
+from .live_service import LiveStockService, BOARD_TITLE
 from .live_views import StockView
-from .constants import UPDATE_INTERVAL
+from .constants import UPDATE_INTERVAL, LIVE_STOCK_DEBOUNCE, LIVE_STOCK_HISTORY_SCAN
 
 # Load config
 with open('config.json') as config_file:
@@ -17,11 +17,19 @@ with open('config.json') as config_file:
 class LiveStock(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.message = None
+        # Board messages in page order; None until loaded by their saved ids
+        self.messages = None
         self.service = LiveStockService(bot)
         self.stock_view = StockView(bot)
         self.logger = logging.getLogger("LiveStock")
         self.ready = asyncio.Event()
+        # Hash of each page as last sent; unchanged pages are not edited
+        self._page_hashes = []
+        # Message ids as stored in bot_settings
+        self._saved_ids = None
+        self._refresh_lock = asyncio.Lock()
+        self._debounce_task = None
+        self._dirty = False
         
         bot.add_view(self.stock_view)
 
@@ -38,53 +46,140 @@ class LiveStock(commands.Cog):
         """Called when cog is being unloaded"""
         if hasattr(self, 'live_stock'):
             self.live_stock.cancel()
+        if self._debounce_task:
+            self._debounce_task.cancel()
         self.logger.info("LiveStock cog unloaded")
 
-    async def get_or_create_message(self):
-        """Get existing message or create new one"""
-        channel = self.bot.get_channel(LIVE_STOCK_CHANNEL_ID)
-        if not channel:
-            self.logger.error(f"Could not find channel with ID {LIVE_STOCK_CHANNEL_ID}")
-            return None
+    async def find_board_messages(self, channel) -> list:
+        """Board messages the bot already posted in the channel, oldest first"""
+        messages = []
+        async for msg in channel.history(limit=LIVE_STOCK_HISTORY_SCAN):
+            if msg.author == self.bot.user and msg.embeds and (msg.embeds[0].title or '').startswith(BOARD_TITLE):
+                messages.append(msg)
+        messages.reverse()
+        return messages
 
-        try:
-            # Get last message from bot
-            async for msg in channel.history(limit=1):
-                if msg.author == self.bot.user:
-                    return msg
-                    
-            # If no message found, create new one
-            products = await self.service.product_manager.get_all_products()
-            embed = await self.service.create_stock_embed(products)
-            return await channel.send(embed=embed, view=self.stock_view)
-            
-        except Exception as e:
-            self.logger.error(f"Error in get_or_create_message: {e}")
-            return None
+    async def load_board_messages(self, channel) -> list:
+        """Fetch the board by its saved message ids.
 
-    @tasks.loop(seconds=UPDATE_INTERVAL)
-    async def live_stock(self):
-        """Update live stock message"""
-        try:
-            if not self.message:
-                self.message = await self.get_or_create_message()
-                if not self.message:
-                    return
+        Only when none of them can be fetched (first run, channel changed,
+        messages deleted) is the channel history searched instead.
+        """
+        saved = await self.service.load_board_ids()
+        if saved and saved.get('channel_id') == channel.id:
+            self._saved_ids = saved.get('message_ids', [])
+            messages = []
+            for message_id in self._saved_ids:
+                try:
+                    messages.append(await channel.fetch_message(message_id))
+                except discord.NotFound:
+                    self.logger.warning(f"Saved live stock message {message_id} no longer exists")
+            if messages:
+                return messages
+
+        self.logger.info("No saved live stock board found, searching channel history")
+        return await self.find_board_messages(channel)
 
-            products = await self.service.product_manager.get_all_products()
-            embed = await self.service.create_stock_embed(products)
+    async def _save_board_ids(self, channel):
+        message_ids = [message.id for message in self.messages]
+        if message_ids != self._saved_ids:
+            await self.service.save_board_ids(channel.id, message_ids)
+            self._saved_ids = message_ids
 
+    async def _delete_board(self):
+        for message in self.messages or []:
             try:
-                await self.message.edit(embed=embed, view=self.stock_view)
-                self.logger.debug(f"Updated message {self.message.id}")
+                await message.delete()
             except discord.NotFound:
-                self.message = await self.get_or_create_message()
-                self.logger.info("Created new message as old one was not found")
-            
-        except Exception as e:
-            self.logger.error(f"Error in live_stock update: {e}")
-            # Reset message if error occurs
-            self.message = None
+                pass
+        self.messages = []
+        self._page_hashes = []
+
+    async def _sync_pages(self, channel, pages: list) -> int:
+        """Bring the board messages in line with ``pages``; returns the edits made"""
+        edits = 0
+        for index, embed in enumerate(pages):
+            # Buttons live on the last page only
+            view = self.stock_view if index == len(pages) - 1 else None
+            page_hash = f"{self.service.board_hash(embed)}:{view is not None}"
+
+            if index >= len(self.messages):
+                self.messages.append(await channel.send(embed=embed, view=view))
+                self._page_hashes.append(page_hash)
+                edits += 1
+                continue
+            if self._page_hashes[index] == page_hash:
+                continue
+
+            await self.messages[index].edit(embed=embed, view=view)
+            self._page_hashes[index] = page_hash
+            edits += 1
+
+        # The catalog shrank; drop the pages it no longer fills
+        for message in self.messages[len(pages):]:
+            try:
+                await message.delete()
+            except discord.NotFound:
+                pass
+        del self.messages[len(pages):]
+        del self._page_hashes[len(pages):]
+        return edits
+
+    async def refresh_board(self) -> int:
+        """Render the board and edit only the pages whose content changed"""
+        async with self._refresh_lock:
+            try:
+                channel = self.bot.get_channel(LIVE_STOCK_CHANNEL_ID)
+                if not channel:
+                    self.logger.error(f"Could not find channel with ID {LIVE_STOCK_CHANNEL_ID}")
+                    return 0
+
+                if self.messages is None:
+                    self.messages = await self.load_board_messages(channel)
+                    self._page_hashes = [None] * len(self.messages)
+
+                pages = await self.service.build_board()
+                try:
+                    edits = await self._sync_pages(channel, pages)
+                except discord.NotFound:
+                    # A page was deleted; repost the whole board so pages stay in order
+                    self.logger.info("Board message not found, reposting the live stock board")
+                    await self._delete_board()
+                    edits = await self._sync_pages(channel, pages)
+                await self._save_board_ids(channel)
+
+                if edits:
+                    self.logger.debug(f"Live stock board: {edits}/{len(pages)} pages updated")
+                return edits
+
+            except Exception as e:
+                # Keep the known messages; pages that failed to edit keep
+                # their old hash and are retried on the next pass
+                self.logger.error(f"Error in live_stock update: {e}")
+                return 0
+
+    async def _debounced_refresh(self):
+        await self.bot.wait_until_ready()
+        # Collect a burst (bulk import, cart checkout) into one edit; a change
+        # arriving while the board renders triggers one more pass
+        while True:
+            await asyncio.sleep(LIVE_STOCK_DEBOUNCE)
+            self._dirty = False
+            await self.refresh_board()
+            if not self._dirty:
+                break
+
+    @commands.Cog.listener()
+    async def on_stock_changed(self, product_codes: tuple):
+        """Published by ProductManagerService.invalidate_listings on every stock write"""
+        self._dirty = True
+        if self._debounce_task is None or self._debounce_task.done():
+            self._debounce_task = asyncio.create_task(self._debounced_refresh())
+
+    @tasks.loop(seconds=UPDATE_INTERVAL)
+    async def live_stock(self):
+        """Safety net for changes made outside the bot (API, manual SQL)"""
+        await self.refresh_board()
 
     @live_stock.before_loop
     async def before_live_stock(self):
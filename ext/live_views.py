@@ -9,7 +9,7 @@ from datetime import datetime
 from .balance_manager import BalanceManagerService
 from .product_manager import ProductManagerService
 from .trx import TransactionManager
-from .live_modals import BuyModal, SetGrowIDModal
+from .live_modals import BuyModal, CartModal, SetGrowIDModal
 from .constants import COOLDOWN_SECONDS
 
 class StockView(ui.View):
@@ -190,6 +190,35 @@ class StockView(ui.View):
                 ephemeral=True
             )
 
+    @discord.ui.button(
+        label="Cart",
+        emoji="🧺",
+        style=discord.ButtonStyle.success,
+        custom_id="cart:1"
+    )
+    async def button_cart_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if not await self._check_cooldown(interaction) or not await self._check_interaction_lock(interaction):
+            return
+
+        try:
+            growid = await self.balance_manager.get_growid(interaction.user.id)
+            if not growid:
+                await interaction.response.send_message(
+                    "❌ Please set your GrowID first!", 
+                    ephemeral=True
+                )
+                return
+
+            await interaction.response.send_modal(CartModal(self.bot))
+
+        except Exception as e:
+            self.logger.error(f"Error in cart callback: {e}")
+            await self._safe_interaction_response(
+                interaction,
+                content="❌ An error occurred",
+                ephemeral=True
+            )
+
     @discord.ui.button(
         label="Set GrowID",
         emoji="🔑",
@@ -0,0 +1,199 @@
+import logging
+import asyncio
+import io
+import json
+from typing import Dict, List
+from datetime import datetime, timedelta
+
+import discord
+from discord.ext import commands, tasks
+
+from .constants import (
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_CONCURRENCY,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_BACKOFF_BASE,
+    OUTBOX_BACKOFF_MAX,
+    OUTBOX_PURCHASE_DM,
+    OUTBOX_PURCHASE_LOG
+)
+from .trx import TransactionManager
+from database import db
+
+class PermanentDeliveryError(Exception):
+    """Delivery can never succeed; the outbox row is failed without retrying"""
+    pass
+
+class OutboxDispatcher:
+    """Delivers rows queued in the ``outbox`` table.
+
+    Rows are written in the same transaction as the purchase they belong
+    to, so nothing is lost if the bot stops before delivery. Due rows are
+    delivered concurrently; failures are retried with exponential backoff
+    up to ``OUTBOX_MAX_ATTEMPTS``. Delivery is at-least-once: a crash
+    between sending and marking a row can repeat that one message.
+    """
+
+    _instance = None
+
+    def __new__(cls, bot):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.initialized = False
+        return cls._instance
+
+    def __init__(self, bot):
+        if not self.initialized:
+            self.bot = bot
+            self.logger = logging.getLogger("OutboxDispatcher")
+            self.trx_manager = TransactionManager(bot)
+            self._semaphore = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+            self._dispatch_lock = asyncio.Lock()
+            self.handlers = {
+                OUTBOX_PURCHASE_DM: self._deliver_purchase_dm,
+                OUTBOX_PURCHASE_LOG: self._deliver_purchase_log
+            }
+            self.initialized = True
+
+    async def _get_user(self, user_id: int) -> discord.User:
+        user = self.bot.get_user(user_id)
+        if user is None:
+            try:
+                user = await self.bot.fetch_user(user_id)
+            except discord.NotFound:
+                raise PermanentDeliveryError(f"User {user_id} not found")
+        return user
+
+    async def _deliver_purchase_dm(self, payload: Dict):
+        user = await self._get_user(payload['user_id'])
+        content = self.trx_manager.format_purchase_result(
+            payload['user_name'], payload['items'], payload['product_name'], payload.get('purchased_at')
+        )
+        file = discord.File(
+            io.StringIO(content),
+            filename=f"result_{payload['user_name']}_order{payload['order_id']}.txt"
+        )
+        try:
+            await user.send("Here is your purchase result:", file=file)
+        except discord.Forbidden:
+            raise PermanentDeliveryError(f"Cannot send DM to user {payload['user_id']}")
+
+    async def _deliver_purchase_log(self, payload: Dict):
+        channel = self.bot.get_channel(self.bot.log_purchase_channel_id)
+        if not channel:
+            raise RuntimeError(f"Could not find buy-logs channel with ID {self.bot.log_purchase_channel_id}")
+        await channel.send(self.trx_manager.format_purchase_log(
+            payload['order_id'], payload['user_name'], payload['product_code'],
+            payload['total'], payload['price']
+        ))
+
+    async def _deliver(self, row) -> Dict:
+        handler = self.handlers.get(row['kind'])
+        async with self._semaphore:
+            try:
+                if handler is None:
+                    raise PermanentDeliveryError(f"No handler for outbox kind {row['kind']}")
+                await handler(json.loads(row['payload']))
+                return {'id': row['id'], 'status': 'delivered'}
+            except PermanentDeliveryError as e:
+                self.logger.warning(f"Outbox #{row['id']} ({row['kind']}) failed permanently: {e}")
+                return {'id': row['id'], 'status': 'failed', 'error': str(e)}
+            except Exception as e:
+                attempts = row['attempts'] + 1
+                if attempts >= OUTBOX_MAX_ATTEMPTS:
+                    self.logger.error(f"Outbox #{row['id']} ({row['kind']}) gave up after {attempts} attempts: {e}")
+                    return {'id': row['id'], 'status': 'failed', 'error': str(e)}
+                delay = min(OUTBOX_BACKOFF_BASE * 2 ** row['attempts'], OUTBOX_BACKOFF_MAX)
+                self.logger.warning(f"Outbox #{row['id']} ({row['kind']}) attempt {attempts} failed, retrying in {delay}s: {e}")
+                return {
+                    'id': row['id'],
+                    'status': 'pending',
+                    'error': str(e),
+                    'next_attempt_at': (datetime.utcnow() + timedelta(seconds=delay)).strftime('%Y-%m-%d %H:%M:%S')
+                }
+
+    @staticmethod
+    def _record_results(cursor, results: List[Dict]):
+        for result in results:
+            if result['status'] == 'pending':
+                cursor.execute("""
+                    UPDATE outbox
+                    SET attempts = attempts + 1, last_error = ?, next_attempt_at = ?,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """, (result['error'], result['next_attempt_at'], result['id']))
+            else:
+                cursor.execute("""
+                    UPDATE outbox
+                    SET status = ?, attempts = attempts + 1, last_error = ?,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """, (result['status'], result.get('error'), result['id']))
+
+    async def dispatch_due(self, batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+        """Deliver every due row; returns the number delivered"""
+        delivered = 0
+        async with self._dispatch_lock:
+            while True:
+                rows = await db.fetchall("""
+                    SELECT * FROM outbox
+                    WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                    ORDER BY next_attempt_at, id
+                    LIMIT ?
+                """, (batch_size,))
+                if not rows:
+                    break
+
+                results = await asyncio.gather(*(self._deliver(row) for row in rows))
+                # One commit for the whole batch
+                await db.transaction(self._record_results, results)
+                delivered += sum(1 for result in results if result['status'] == 'delivered')
+
+                if len(rows) < batch_size:
+                    break
+        return delivered
+
+    async def get_stats(self) -> Dict:
+        rows = await db.fetchall("SELECT status, COUNT(*) as count FROM outbox GROUP BY status")
+        return {row['status']: row['count'] for row in rows}
+
+class OutboxCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.dispatcher = OutboxDispatcher(bot)
+        self.logger = logging.getLogger("OutboxCog")
+
+    async def cog_load(self):
+        self.outbox_poller.start()
+
+    def cog_unload(self):
+        self.outbox_poller.cancel()
+
+    async def _dispatch(self):
+        try:
+            await self.dispatcher.dispatch_due()
+        except Exception as e:
+            self.logger.error(f"Error dispatching outbox: {e}")
+
+    @commands.Cog.listener()
+    async def on_outbox_ready(self):
+        """Deliver right after a purchase commits"""
+        await self._dispatch()
+
+    @tasks.loop(seconds=OUTBOX_POLL_INTERVAL)
+    async def outbox_poller(self):
+        """Pick up retries and anything queued while the bot was offline"""
+        await self._dispatch()
+
+    @outbox_poller.before_loop
+    async def before_outbox_poller(self):
+        await self.bot.wait_until_ready()
+
+async def setup(bot):
+    try:
+        await bot.add_cog(OutboxCog(bot))
+        logging.info('Outbox cog loaded successfully')
+    except Exception as e:
+        logging.error(f"Error loading Outbox cog: {e}")
+        raise
@@ -1,14 +1,74 @@
 import logging
 import asyncio
+import math
+import multiprocessing
+import pickle
+import sqlite3
 import time
-from typing import Dict, List, Optional
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Sized
 from datetime import datetime
 
 import discord
 from discord.ext import commands
 
-from .constants import STATUS_AVAILABLE, TransactionError
-from database import get_connection
+from .constants import (
+    STATUS_AVAILABLE,
+    ALLOCATION_QUEUE_SIZE,
+    ALLOCATION_LOW_WATER,
+    STOCK_IMPORT_CHUNK,
+    STOCK_IMPORT_WINDOW,
+    STOCK_VALIDATE_CHUNK,
+    STOCK_VALIDATE_PARALLEL_MIN,
+    STOCK_VALIDATE_WORKERS,
+    STOCK_BLOOM_ERROR_RATE,
+    STOCK_BLOOM_MIN_CAPACITY,
+    STOCK_BLOOM_BUILD_BATCH,
+    IMPORT_ADDED,
+    IMPORT_EMPTY,
+    IMPORT_DUPLICATE,
+    IMPORT_EXISTS,
+    IMPORT_INVALID,
+    TransactionError
+)
+from .stock_validators import LineValidator, StockLineError, StockValidatorRegistry, validate_chunk
+from database import db, cache, stock_content_hash
+
+class ContentBloomFilter:
+    """Bloom filter over the ``content_hash`` digests of stock and stock_archive.
+
+    A miss means the content is definitely not in either, so the duplicate
+    lookup can be skipped; a hit still has to be confirmed by the unique
+    index. Bit positions are derived from the digest itself (double
+    hashing), nothing is rehashed.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = STOCK_BLOOM_ERROR_RATE):
+        self.capacity = max(capacity, 1)
+        self.size = max(64, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest: bytes):
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, digest: bytes):
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, digest: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+    @property
+    def saturated(self) -> bool:
+        return self.count > self.capacity
 
 class ProductManagerService:
     _instance = None
@@ -26,6 +86,19 @@ class ProductManagerService:
             self._cache = {}
             self._cache_timeout = 60
             self._locks = {}
+            # Per-product prefetched FIFO stock ids; see take_stock_ids()
+            self._allocation_queues = {}
+            self._allocation_generation = {}
+            self._allocation_in_flight = {}
+            self._refill_tasks = {}
+            # Bloom prefilter for duplicate stock content; see build_content_filter()
+            self._content_filter = None
+            self._content_filter_ready = False
+            self._content_filter_task = None
+            # Per-product stock line validators and the pool that runs them
+            self.validators = StockValidatorRegistry()
+            self.validators.load_config(getattr(bot, 'config', {}).get('stock_import', {}).get('validators', {}))
+            self._validation_pool = None
             self.initialized = True
 
     async def _get_lock(self, key: str) -> asyncio.Lock:
@@ -33,6 +106,177 @@ class ProductManagerService:
             self._locks[key] = asyncio.Lock()
         return self._locks[key]
 
+    async def _refill_allocation_queue(self, product_code: str):
+        generation = self._allocation_generation.get(product_code, 0)
+        in_flight = self._allocation_in_flight.setdefault(product_code, set())
+        # Literal 'available' so the partial FIFO index applies
+        rows = await db.fetchall("""
+            SELECT id FROM stock
+            WHERE product_code = ? AND status = 'available'
+            ORDER BY added_at ASC, id ASC
+            LIMIT ?
+        """, (product_code, ALLOCATION_QUEUE_SIZE + len(in_flight)))
+
+        # A write invalidated the queue while we were reading
+        if self._allocation_generation.get(product_code, 0) != generation:
+            return
+        self._allocation_queues[product_code] = deque(
+            (row['id'] for row in rows if row['id'] not in in_flight),
+            maxlen=ALLOCATION_QUEUE_SIZE
+        )
+
+    def _schedule_refill(self, product_code: str):
+        task = self._refill_tasks.get(product_code)
+        if task is None or task.done():
+            self._refill_tasks[product_code] = asyncio.create_task(self._refill_allocation_queue(product_code))
+
+    async def take_stock_ids(self, product_code: str, quantity: int) -> List[int]:
+        """Pop up to ``quantity`` of the oldest available stock ids.
+
+        Ids come from a prefetched per-product deque, so a sale is a
+        primary-key update instead of a FIFO index scan. The ids stay
+        reserved in memory until ``finish_stock_ids``; fewer than
+        ``quantity`` may be returned and ``claim_stock`` covers the rest.
+        """
+        queue = self._allocation_queues.get(product_code)
+        if queue is None or len(queue) < quantity:
+            await self._refill_allocation_queue(product_code)
+            queue = self._allocation_queues.get(product_code, deque())
+
+        stock_ids = [queue.popleft() for _ in range(min(quantity, len(queue)))]
+        self._allocation_in_flight.setdefault(product_code, set()).update(stock_ids)
+
+        if len(queue) < ALLOCATION_LOW_WATER:
+            self._schedule_refill(product_code)
+        return stock_ids
+
+    def finish_stock_ids(self, product_code: str, stock_ids: Sequence[int], claimed: Sequence[Dict] = ()):
+        """Release ids from take_stock_ids once their transaction has ended.
+
+        ``claimed`` is what the transaction sold; empty means it rolled
+        back, and the ids go back to the head of the queue.
+        """
+        self._allocation_in_flight.get(product_code, set()).difference_update(stock_ids)
+        if not stock_ids:
+            return
+        if not claimed:
+            queue = self._allocation_queues.get(product_code)
+            if queue is not None:
+                queue.extendleft(reversed(stock_ids))
+        elif not set(stock_ids) <= {item['id'] for item in claimed}:
+            # Some prefetched ids were gone already - the queue is stale
+            self.invalidate_allocation(product_code)
+
+    async def build_content_filter(self) -> int:
+        """(Re)build the Bloom filter of every stock content hash.
+
+        Archived rows are included since their content may not be imported
+        again. The new filter is installed before it is filled, so hashes
+        inserted while the build pages through the tables land in it too;
+        it is only consulted once the build has finished. Returns the
+        hashes loaded.
+        """
+        # Archived rows keep their stock ids, so the ids of both tables
+        # come from one sequence and its maximum bounds the row count
+        rows = await db.fetchval("""
+            SELECT MAX(COALESCE((SELECT MAX(rowid) FROM stock), 0),
+                       COALESCE((SELECT MAX(rowid) FROM stock_archive), 0))
+        """, default=0)
+        bloom = ContentBloomFilter(max(rows * 2, STOCK_BLOOM_MIN_CAPACITY))
+        self._content_filter = bloom
+        self._content_filter_ready = False
+
+        loaded = 0
+        for table in ('stock', 'stock_archive'):
+            last_id = 0
+            while True:
+                batch = await db.fetchall(
+                    f"SELECT id, content_hash FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, STOCK_BLOOM_BUILD_BATCH)
+                )
+                for row in batch:
+                    # NULL for extra archived copies of a hash held elsewhere
+                    if row['content_hash'] is not None:
+                        bloom.add(row['content_hash'])
+                        loaded += 1
+                if len(batch) < STOCK_BLOOM_BUILD_BATCH:
+                    break
+                last_id = batch[-1]['id']
+
+        if self._content_filter is bloom:
+            self._content_filter_ready = True
+        self.logger.info(f"Stock content filter built with {loaded} hashes ({len(bloom.bits) // 1024}KB)")
+        return loaded
+
+    def schedule_content_filter_build(self):
+        task = self._content_filter_task
+        if task is None or task.done():
+            self._content_filter_task = asyncio.create_task(self.build_content_filter())
+
+    def _content_maybe_exists(self, digest: bytes) -> bool:
+        """False only when the content is certainly not in stock"""
+        return not self._content_filter_ready or digest in self._content_filter
+
+    def _remember_content(self, digests: Iterable[bytes]):
+        bloom = self._content_filter
+        if bloom is None:
+            return
+        for digest in digests:
+            bloom.add(digest)
+        if self._content_filter_ready and bloom.saturated:
+            # Past capacity the false positive rate climbs; resize in the background
+            self.schedule_content_filter_build()
+
+    def invalidate_allocation(self, product_code: str = None):
+        """Drop prefetched stock ids after a stock write"""
+        codes = [product_code] if product_code else list(self._allocation_queues)
+        for code in codes:
+            self._allocation_generation[code] = self._allocation_generation.get(code, 0) + 1
+            self._allocation_queues.pop(code, None)
+
+    @staticmethod
+    def claim_stock(cursor, product_code: str, quantity: int, stock_ids: Sequence[int] = (),
+                    buyer_id: str = None, seller_id: str = None) -> List[Dict]:
+        """Mark ``quantity`` available rows sold inside a writer transaction.
+
+        Prefetched ``stock_ids`` are claimed by primary key; any that were
+        sold meanwhile are made up from the FIFO index. Raises
+        TransactionError on a shortfall, which rolls the caller back.
+        """
+        claimed = []
+        if stock_ids:
+            cursor.execute(f"""
+                UPDATE stock
+                SET status = 'sold', buyer_id = COALESCE(?, buyer_id),
+                    seller_id = COALESCE(?, seller_id), updated_at = CURRENT_TIMESTAMP
+                WHERE id IN ({','.join('?' * len(stock_ids))})
+                AND product_code = ? AND status = 'available'
+                RETURNING id, content
+            """, [buyer_id, seller_id, *stock_ids, product_code])
+            claimed = [dict(row) for row in cursor.fetchall()]
+
+        shortfall = quantity - len(claimed)
+        if shortfall > 0:
+            # The outer status check keeps the claim exclusive even against
+            # writers outside this process
+            cursor.execute("""
+                UPDATE stock
+                SET status = 'sold', buyer_id = COALESCE(?, buyer_id),
+                    seller_id = COALESCE(?, seller_id), updated_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM stock
+                    WHERE product_code = ? AND status = 'available'
+                    ORDER BY added_at ASC, id ASC
+                    LIMIT ?
+                ) AND status = 'available'
+                RETURNING id, content
+            """, (buyer_id, seller_id, product_code, shortfall))
+            claimed.extend(dict(row) for row in cursor.fetchall())
+
+        if len(claimed) < quantity:
+            raise TransactionError(f"Insufficient stock for {product_code}")
+        return sorted(claimed, key=lambda item: item['id'])
+
     def _get_cached(self, key: str):
         if key in self._cache:
             data = self._cache[key]
@@ -47,31 +291,42 @@ class ProductManagerService:
             'timestamp': time.time()
         }
 
+    async def invalidate_listings(self, *product_codes: str):
+        """Drop the cached product list and stock listings in the shared L2 cache.
+
+        Every stock or product write ends here, so this also publishes the
+        ``stock_changed`` event (with the affected codes, empty when
+        unknown) that the live board listens to.
+        """
+        self._cache.pop("all_products", None)
+        try:
+            await cache.delete_prefix("stock:")
+        except Exception as e:
+            self.logger.warning(f"Error invalidating cached stock listings: {e}")
+        self.bot.dispatch('stock_changed', product_codes)
+
     async def create_product(self, code: str, name: str, price: int, description: str = None) -> Dict:
         # Validate input
         if not code or not name or price <= 0:
             raise ValueError("Invalid product details")
             
         async with await self._get_lock(f"product_{code}"):
-            conn = None
             try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
-                # Check if product code already exists
-                cursor.execute("SELECT code FROM products WHERE code = ?", (code,))
-                if cursor.fetchone():
-                    raise ValueError(f"Product code {code} already exists")
-                
-                cursor.execute(
-                    """
-                    INSERT INTO products (code, name, price, description, created_at)
-                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-                    """,
-                    (code, name, price, description)
-                )
-                
-                conn.commit()
+                def _create(cursor):
+                    # Check if product code already exists
+                    cursor.execute("SELECT code FROM products WHERE code = ?", (code,))
+                    if cursor.fetchone():
+                        raise ValueError(f"Product code {code} already exists")
+                
+                    cursor.execute(
+                        """
+                        INSERT INTO products (code, name, price, description, created_at)
+                        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                        """,
+                        (code, name, price, description)
+                    )
+
+                await db.transaction(_create)
                 
                 result = {
                     'code': code,
@@ -84,26 +339,18 @@ class ProductManagerService:
                 # Update cache
                 self._set_cached(f"product_{code}", result)
                 self._cache.pop("all_products", None)  # Invalidate all products cache
+                await self.invalidate_listings(code)
                 
                 self.logger.info(f"Created new product: {code} - {name} at {price} WLs")
                 return result
 
             except Exception as e:
                 self.logger.error(f"Error creating product: {e}")
-                if conn:
-                    conn.rollback()
                 raise
-            finally:
-                if conn:
-                    conn.close()
 
     async def edit_product(self, code: str, field: str, value: any) -> bool:
         async with await self._get_lock(f"product_{code}"):
-            conn = None
             try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
                 # Validate field
                 valid_fields = ['name', 'price', 'description']
                 if field not in valid_fields:
@@ -113,67 +360,58 @@ class ProductManagerService:
                 if field == 'price' and (not isinstance(value, int) or value <= 0):
                     raise ValueError("Price must be a positive number")
                 
-                cursor.execute(
+                updated = await db.execute(
                     f"UPDATE products SET {field} = ?, updated_at = CURRENT_TIMESTAMP WHERE code = ?",
                     (value, code)
                 )
                 
-                if cursor.rowcount == 0:
+                if updated == 0:
                     raise ValueError(f"Product {code} not found")
-                    
-                conn.commit()
                 
                 # Invalidate cache
                 self.invalidate_cache(code)
+                self._cache.pop("all_products", None)
+                await self.invalidate_listings(code)
                 
                 self.logger.info(f"Updated product {code}: {field} = {value}")
                 return True
 
             except Exception as e:
                 self.logger.error(f"Error editing product: {e}")
-                if conn:
-                    conn.rollback()
                 raise
-            finally:
-                if conn:
-                    conn.close()
 
     async def delete_product(self, code: str) -> bool:
         async with await self._get_lock(f"product_{code}"):
-            conn = None
             try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
-                # Check if product has stock
-                cursor.execute(
-                    "SELECT COUNT(*) as count FROM stock WHERE product_code = ? AND status = ?",
-                    (code, STATUS_AVAILABLE)
-                )
-                if cursor.fetchone()['count'] > 0:
-                    raise ValueError("Cannot delete product with existing stock")
+                def _delete(cursor):
+                    # Check if product has stock
+                    cursor.execute(
+                        "SELECT count FROM product_stock_counts WHERE product_code = ? AND status = 'available'",
+                        (code,)
+                    )
+                    row = cursor.fetchone()
+                    if row and row['count'] > 0:
+                        raise ValueError("Cannot delete product with existing stock")
                 
-                cursor.execute("DELETE FROM products WHERE code = ?", (code,))
+                    cursor.execute("DELETE FROM products WHERE code = ?", (code,))
                 
-                if cursor.rowcount == 0:
-                    raise ValueError(f"Product {code} not found")
-                    
-                conn.commit()
+                    if cursor.rowcount == 0:
+                        raise ValueError(f"Product {code} not found")
+
+                await db.transaction(_delete)
                 
                 # Invalidate cache
                 self.invalidate_cache(code)
+                self._cache.pop("all_products", None)
+                self.invalidate_allocation(code)
+                await self.invalidate_listings(code)
                 
                 self.logger.info(f"Deleted product: {code}")
                 return True
 
             except Exception as e:
                 self.logger.error(f"Error deleting product: {e}")
-                if conn:
-                    conn.rollback()
                 raise
-            finally:
-                if conn:
-                    conn.close()
 
     async def get_product(self, code: str) -> Optional[Dict]:
         cached = self._get_cached(f"product_{code}")
@@ -181,15 +419,10 @@ class ProductManagerService:
             return cached
 
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute(
+            result = await db.fetchone(
                 "SELECT * FROM products WHERE code = ?",
                 (code,)
             )
-            
-            result = cursor.fetchone()
             if result:
                 product = dict(result)
                 self._set_cached(f"product_{code}", product)
@@ -199,9 +432,6 @@ class ProductManagerService:
         except Exception as e:
             self.logger.error(f"Error getting product: {e}")
             return None
-        finally:
-            if conn:
-                conn.close()
 
     async def get_all_products(self) -> List[Dict]:
         cached = self._get_cached("all_products")
@@ -209,135 +439,314 @@ class ProductManagerService:
             return cached
 
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT p.*, 
-                       (SELECT COUNT(*) FROM stock WHERE product_code = p.code AND status = ?) as stock_count
+            # One query for the whole catalog, counts included; the live
+            # board renders from this without further lookups
+            rows = await db.fetchall("""
+                SELECT p.*, COALESCE(a.count, 0) as stock_count, COALESCE(r.count, 0) as reserved_count
                 FROM products p 
+                LEFT JOIN product_stock_counts a
+                       ON a.product_code = p.code AND a.status = 'available'
+                LEFT JOIN product_stock_counts r
+                       ON r.product_code = p.code AND r.status = 'pending'
                 ORDER BY p.code
-            """, (STATUS_AVAILABLE,))
+            """)
             
-            products = [dict(row) for row in cursor.fetchall()]
+            products = [dict(row) for row in rows]
             self._set_cached("all_products", products)
             return products
 
         except Exception as e:
             self.logger.error(f"Error getting all products: {e}")
             return []
-        finally:
-            if conn:
-                conn.close()
 
     async def add_stock_item(self, product_code: str, content: str, added_by: str) -> bool:
-        if not content.strip():
+        content = content.strip()
+        if not content:
             raise ValueError("Stock content cannot be empty")
             
         async with await self._get_lock(f"stock_{product_code}"):
-            conn = None
             try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
-                # Verify product exists
-                cursor.execute("SELECT code FROM products WHERE code = ?", (product_code,))
-                if not cursor.fetchone():
-                    raise ValueError(f"Product {product_code} not found")
-                
-                # Check if content already exists
-                cursor.execute("SELECT id FROM stock WHERE content = ? AND status = ?", 
-                             (content.strip(), STATUS_AVAILABLE))
-                if cursor.fetchone():
-                    self.logger.warning(f"Stock content already exists and available: {content}")
+                try:
+                    content = self.validators.get(product_code)(content)
+                except StockLineError as e:
+                    # Same outcome as an IMPORT_INVALID line in add_stock_bulk
+                    self.logger.warning(f"Rejected stock line for {product_code}: {e}")
+                    return False
+                digest = stock_content_hash(content)
+                lookup = self._content_maybe_exists(digest)
+
+                def _add(cursor):
+                    # Verify product exists
+                    cursor.execute("SELECT code FROM products WHERE code = ?", (product_code,))
+                    if not cursor.fetchone():
+                        raise ValueError(f"Product {product_code} not found")
+                
+                    # Check if content already exists or was sold/deleted and
+                    # archived, unless the filter rules it out
+                    if lookup:
+                        cursor.execute("""
+                            SELECT 1 FROM stock WHERE content_hash = ?
+                            UNION ALL
+                            SELECT 1 FROM stock_archive WHERE content_hash = ?
+                            LIMIT 1
+                        """, (digest, digest))
+                        if cursor.fetchone():
+                            return False
+                
+                    cursor.execute(
+                        """
+                        INSERT INTO stock (product_code, content, content_hash, added_by, status, added_at)
+                        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                        """,
+                        (product_code, content, digest, added_by, STATUS_AVAILABLE)
+                    )
+                    return True
+
+                try:
+                    added = await db.transaction(_add)
+                except sqlite3.IntegrityError:
+                    # Inserted elsewhere after the filter check
+                    added = False
+                if not added:
+                    self.logger.warning(f"Stock content already exists: {content}")
                     return False
-                
-                cursor.execute(
-                    """
-                    INSERT INTO stock (product_code, content, added_by, status, added_at)
-                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-                    """,
-                    (product_code, content.strip(), added_by, STATUS_AVAILABLE)
-                )
-                
-                conn.commit()
                 
                 # Force invalidate cache
+                self._remember_content([digest])
                 self._cache.pop(f"stock_count_{product_code}", None)
                 self._cache.pop("all_products", None)
+                self.invalidate_allocation(product_code)
+                await self.invalidate_listings(product_code)
                 
                 self.logger.info(f"Added stock item to {product_code} by {added_by}")
                 return True
 
             except Exception as e:
                 self.logger.error(f"Error adding stock item: {e}")
-                if conn:
-                    conn.rollback()
                 return False
+
+    def _get_validation_pool(self) -> ProcessPoolExecutor:
+        if self._validation_pool is None:
+            # Spawned, not forked: the bot already runs the writer, reader,
+            # cache and archiver threads, and a fork would copy their locks
+            self._validation_pool = ProcessPoolExecutor(
+                max_workers=STOCK_VALIDATE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._validation_pool
+
+    async def validate_lines(self, validator: LineValidator, lines: List[str]) -> List[tuple]:
+        """Run ``validator`` over stripped lines; one ``(content, reason)`` each.
+
+        Large inputs are split into STOCK_VALIDATE_CHUNK pieces checked in
+        parallel on a process pool, so validation of a big file does not
+        hold one core (and the event loop) for its whole length.
+        """
+        if len(lines) < STOCK_VALIDATE_PARALLEL_MIN:
+            return validate_chunk(validator, lines)
+
+        try:
+            pickle.dumps(validator)
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            # e.g. a lambda registered as validator; it cannot reach a worker
+            self.logger.warning(f"Stock validator {validator.name} cannot run in a worker process, "
+                                f"validating in a thread: {e}")
+            return await asyncio.to_thread(validate_chunk, validator, lines)
+
+        loop = asyncio.get_running_loop()
+        chunks = [lines[start:start + STOCK_VALIDATE_CHUNK] for start in range(0, len(lines), STOCK_VALIDATE_CHUNK)]
+        try:
+            pool = self._get_validation_pool()
+            parts = await asyncio.gather(*(
+                loop.run_in_executor(pool, validate_chunk, validator, chunk) for chunk in chunks
+            ))
+        except BrokenProcessPool as e:
+            self.logger.warning(f"Stock validation pool broke, validating in a thread: {e}")
+            self._validation_pool = None
+            return await asyncio.to_thread(validate_chunk, validator, lines)
+        except Exception as e:
+            # A bug in the validator itself, not a pool problem
+            self.logger.error(f"Stock validator {validator.name} failed: {e}")
+            raise
+        return [result for part in parts for result in part]
+
+    async def add_stock_bulk(self, product_code: str, lines: Iterable[str], added_by: str,
+                             chunk_size: int = STOCK_IMPORT_CHUNK,
+                             progress: Optional[Callable[[int, Optional[int]], Awaitable]] = None,
+                             keep_results: bool = True,
+                             validator: Optional[LineValidator] = None,
+                             on_rejected: Optional[Callable[[List[Dict]], None]] = None) -> Dict:
+        """Import stock lines in bounded batches.
+
+        ``lines`` may be a list or any iterable, e.g. a generator reading a
+        file from disk; it is pulled STOCK_IMPORT_WINDOW lines at a time off
+        the event loop so memory stays flat whatever its length. Each window
+        is stripped, run through the product's validator (the registry's,
+        unless ``validator`` is given) and deduplicated in memory. Accepted
+        lines are hashed, checked against the stock table (only for hashes
+        the Bloom filter cannot rule out) and inserted with ``executemany``,
+        one transaction per ``chunk_size`` lines. A line that repeats one
+        from an earlier window is reported as IMPORT_EXISTS since that copy
+        is already committed.
+
+        Returns the count per IMPORT_* status and, with ``keep_results``, a
+        per-line ``results`` list of ``{'line', 'content', 'status'}`` (plus
+        ``reason`` for IMPORT_INVALID). ``on_rejected`` is called with the
+        non-added results of every window and ``progress(done, total)`` is
+        awaited after it; ``total`` is None when ``lines`` has no length.
+        """
+        def _insert_chunk(cursor, rows: List[tuple], lookup: List[bytes]):
+            # Any status counts, and so do rows the Archiver has moved out
+            existing = set()
+            if lookup:
+                placeholders = ','.join('?' * len(lookup))
+                cursor.execute(f"""
+                    SELECT content_hash FROM stock WHERE content_hash IN ({placeholders})
+                    UNION ALL
+                    SELECT content_hash FROM stock_archive WHERE content_hash IN ({placeholders})
+                """, lookup + lookup)
+                existing = {row['content_hash'] for row in cursor.fetchall()}
+            cursor.executemany(
+                """
+                INSERT INTO stock (product_code, content, content_hash, added_by, status, added_at)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                """,
+                [(product_code, content, digest, added_by, STATUS_AVAILABLE)
+                 for content, digest in rows if digest not in existing]
+            )
+            return existing
+
+        validator = validator or self.validators.get(product_code)
+        total = len(lines) if isinstance(lines, Sized) else None
+        iterator = iter(lines)
+        summary = {status: 0 for status in (IMPORT_ADDED, IMPORT_EXISTS, IMPORT_DUPLICATE, IMPORT_INVALID, IMPORT_EMPTY)}
+        results = [] if keep_results else None
+        done = 0
+        inserted = False
+
+        async with await self._get_lock(f"stock_{product_code}"):
+            if not await db.fetchval("SELECT 1 FROM products WHERE code = ?", (product_code,)):
+                raise ValueError(f"Product {product_code} not found")
+
+            try:
+                while True:
+                    window = await asyncio.to_thread(list, islice(iterator, STOCK_IMPORT_WINDOW))
+                    if not window:
+                        break
+
+                    window_results = [
+                        {'line': number, 'content': line.strip(), 'status': None}
+                        for number, line in enumerate(window, done + 1)
+                    ]
+                    candidates = []
+                    for result in window_results:
+                        if result['content']:
+                            candidates.append(result)
+                        else:
+                            result['status'] = IMPORT_EMPTY
+
+                    checked = await self.validate_lines(validator, [item['content'] for item in candidates])
+                    pending = []
+                    seen = set()
+                    for item, (content, reason) in zip(candidates, checked):
+                        if content is None:
+                            item['status'] = IMPORT_INVALID
+                            item['reason'] = reason
+                        elif content in seen:
+                            item['content'] = content
+                            item['status'] = IMPORT_DUPLICATE
+                        else:
+                            item['content'] = content
+                            seen.add(content)
+                            pending.append(item)
+
+                    for start in range(0, len(pending), chunk_size):
+                        chunk = pending[start:start + chunk_size]
+                        rows = [(item['content'], stock_content_hash(item['content'])) for item in chunk]
+                        # The Bloom filter rules out most lines without a lookup
+                        lookup = [digest for _, digest in rows if self._content_maybe_exists(digest)]
+                        try:
+                            existing = await db.transaction(_insert_chunk, rows, lookup)
+                        except sqlite3.IntegrityError:
+                            # Inserted elsewhere after the filter check; look everything up
+                            existing = await db.transaction(_insert_chunk, rows, [digest for _, digest in rows])
+                        inserted = inserted or len(existing) < len(chunk)
+                        for item, (_, digest) in zip(chunk, rows):
+                            item['status'] = IMPORT_EXISTS if digest in existing else IMPORT_ADDED
+                        self._remember_content(digest for _, digest in rows if digest not in existing)
+
+                    for result in window_results:
+                        summary[result['status']] += 1
+                    if keep_results:
+                        results.extend(window_results)
+                    if on_rejected:
+                        on_rejected([result for result in window_results if result['status'] != IMPORT_ADDED])
+                    done += len(window)
+                    if progress:
+                        await progress(done, total)
             finally:
-                if conn:
-                    conn.close()
+                if inserted:
+                    self._cache.pop(f"stock_count_{product_code}", None)
+                    self._cache.pop("all_products", None)
+                    self.invalidate_allocation(product_code)
+                    await self.invalidate_listings(product_code)
+
+        summary['total'] = done
+        if keep_results:
+            summary['results'] = results
+
+        self.logger.info(
+            f"Imported stock for {product_code} by {added_by}: {summary[IMPORT_ADDED]} added, "
+            f"{summary[IMPORT_EXISTS]} existing, {summary[IMPORT_DUPLICATE]} duplicate, "
+            f"{summary[IMPORT_INVALID]} invalid lines"
+        )
+        return summary
 
     async def get_available_stock(self, product_code: str, quantity: int = 1) -> List[Dict]:
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
+            # Literal 'available' so the partial FIFO index applies
+            rows = await db.fetchall("""
                 SELECT id, content, added_at, added_by
                 FROM stock
-                WHERE product_code = ? AND status = ?
-                ORDER BY added_at ASC
+                WHERE product_code = ? AND status = 'available'
+                ORDER BY added_at ASC, id ASC
                 LIMIT ?
-            """, (product_code, STATUS_AVAILABLE, quantity))
+            """, (product_code, quantity))
             
             return [{
                 'id': row['id'],
                 'content': row['content'],
                 'added_at': row['added_at'],
                 'added_by': row['added_by']
-            } for row in cursor.fetchall()]
+            } for row in rows]
 
         except Exception as e:
             self.logger.error(f"Error getting available stock: {e}")
             raise
-        finally:
-            if conn:
-                conn.close()
 
-    async def get_stock_count(self, product_code: str) -> int:
-        cache_key = f"stock_count_{product_code}"
+    async def get_stock_count(self, product_code: str, status: str = STATUS_AVAILABLE) -> int:
+        cache_key = f"stock_count_{product_code}" if status == STATUS_AVAILABLE else f"stock_count_{product_code}_{status}"
         cached = self._get_cached(cache_key)
         if cached is not None:
             return cached
 
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT COUNT(*) as count 
-                FROM stock 
+            result = await db.fetchval("""
+                SELECT count 
+                FROM product_stock_counts 
                 WHERE product_code = ? AND status = ?
-            """, (product_code, STATUS_AVAILABLE))
+            """, (product_code, status), default=0)
             
-            result = cursor.fetchone()['count']
             self._set_cached(cache_key, result)
             return result
 
         except Exception as e:
             self.logger.error(f"Error getting stock count: {e}")
             return 0
-        finally:
-            if conn:
-                conn.close()
 
     async def update_stock_status(self, stock_id: int, status: str, buyer_id: str = None) -> bool:
         async with await self._get_lock(f"stock_{stock_id}"):
-            conn = None
             try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
                 update_query = """
                     UPDATE stock 
                     SET status = ?, updated_at = CURRENT_TIMESTAMP
@@ -348,55 +757,56 @@ class ProductManagerService:
                     update_query += ", buyer_id = ?"
                     params.append(buyer_id)
 
-                update_query += " WHERE id = ?"
+                update_query += " WHERE id = ? RETURNING product_code"
                 params.append(stock_id)
 
-                cursor.execute(update_query, params)
-                
-                if cursor.rowcount == 0:
-                    raise TransactionError(f"Stock item {stock_id} not found")
-                
-                conn.commit()
+                def _update(cursor):
+                    cursor.execute(update_query, params)
+                    result = cursor.fetchone()
+                    if not result:
+                        raise TransactionError(f"Stock item {stock_id} not found")
+                    return result['product_code']
+
+                product_code = await db.transaction(_update)
                 
                 # Invalidate related caches
-                cursor.execute("SELECT product_code FROM stock WHERE id = ?", (stock_id,))
-                result = cursor.fetchone()
-                if result:
-                    self._cache.pop(f"stock_count_{result['product_code']}", None)
-                    self._cache.pop("all_products", None)
+                self._cache.pop(f"stock_count_{product_code}", None)
+                self._cache.pop("all_products", None)
+                self.invalidate_allocation(product_code)
+                await self.invalidate_listings(product_code)
                 
                 self.logger.info(f"Updated stock {stock_id} status to {status}" + (f" for {buyer_id}" if buyer_id else ""))
                 return True
 
             except Exception as e:
                 self.logger.error(f"Error updating stock status: {e}")
-                if conn:
-                    conn.rollback()
                 return False
-            finally:
-                if conn:
-                    conn.close()
 
-    async def get_stock_history(self, product_code: str, limit: int = 10) -> List[Dict]:
+    async def get_stock_history(self, product_code: str, limit: int = 10,
+                                include_archive: bool = False) -> List[Dict]:
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
+            rows = await db.fetchall("""
                 SELECT * FROM stock 
                 WHERE product_code = ?
                 ORDER BY updated_at DESC
                 LIMIT ?
             """, (product_code, limit))
+            history = [dict(row) for row in rows]
+
+            if include_archive and len(history) < limit:
+                archived = await db.fetchall("""
+                    SELECT * FROM stock_archive
+                    WHERE product_code = ?
+                    ORDER BY updated_at DESC
+                    LIMIT ?
+                """, (product_code, limit - len(history)))
+                history.extend(dict(row) for row in archived)
             
-            return [dict(row) for row in cursor.fetchall()]
+            return history
 
         except Exception as e:
             self.logger.error(f"Error getting stock history: {e}")
             return []
-        finally:
-            if conn:
-                conn.close()
 
     async def get_world_info(self) -> Optional[Dict]:
         cached = self._get_cached("world_info")
@@ -404,11 +814,7 @@ class ProductManagerService:
             return cached
 
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT * FROM world_info WHERE id = 1")
-            result = cursor.fetchone()
+            result = await db.fetchone("SELECT * FROM world_info WHERE id = 1")
             
             if result:
                 info = dict(result)
@@ -419,27 +825,18 @@ class ProductManagerService:
         except Exception as e:
             self.logger.error(f"Error getting world info: {e}")
             return None
-        finally:
-            if conn:
-                conn.close()
 
     async def update_world_info(self, world: str, owner: str, bot: str) -> bool:
         if not world or not owner or not bot:
             raise ValueError("World info fields cannot be empty")
             
         async with await self._get_lock("world_info"):
-            conn = None
             try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
-                cursor.execute("""
+                await db.execute("""
                     INSERT OR REPLACE INTO world_info (id, world, owner, bot, updated_at)
                     VALUES (1, ?, ?, ?, CURRENT_TIMESTAMP)
                 """, (world, owner, bot))
                 
-                conn.commit()
-                
                 # Invalidate cache
                 self._cache.pop("world_info", None)
                 
@@ -448,12 +845,7 @@ class ProductManagerService:
 
             except Exception as e:
                 self.logger.error(f"Error updating world info: {e}")
-                if conn:
-                    conn.rollback()
                 return False
-            finally:
-                if conn:
-                    conn.close()
                     
     async def reduce_stock(self, product_code: str, quantity: int, admin_id: str, reason: str = None) -> bool:
         """
@@ -463,72 +855,51 @@ class ProductManagerService:
             raise ValueError("Quantity must be positive")
                 
         async with await self._get_lock(f"stock_{product_code}"):
-            conn = None
             try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
-                # Check available stock first
-                cursor.execute("""
-                    SELECT COUNT(*) as count 
-                    FROM stock 
-                    WHERE product_code = ? AND status = ?
-                """, (product_code, STATUS_AVAILABLE))
-                
-                available = cursor.fetchone()['count']
-                if available < quantity:
-                    raise ValueError(f"Insufficient stock. Only {available} available.")
-                
-                # Get stock items to be reduced
-                cursor.execute("""
-                    SELECT id 
-                    FROM stock 
-                    WHERE product_code = ? AND status = ?
-                    ORDER BY added_at ASC
-                    LIMIT ?
-                """, (product_code, STATUS_AVAILABLE, quantity))
-                
-                stock_items = cursor.fetchall()
-                if len(stock_items) < quantity:
-                    raise ValueError(f"Could not get {quantity} items. Only found {len(stock_items)}.")
-                
-                # Update stock status to sold
-                stock_ids = [item['id'] for item in stock_items]
-                cursor.execute(f"""
-                    UPDATE stock 
-                    SET status = 'sold',
-                        updated_at = CURRENT_TIMESTAMP,
-                        seller_id = ?
-                    WHERE id IN ({','.join('?' * len(stock_ids))})
-                """, [admin_id] + stock_ids)
-                
-                # Log admin action
-                cursor.execute("""
-                    INSERT INTO admin_logs (admin_id, action, target, details)
-                    VALUES (?, 'REDUCE_STOCK', ?, ?)
-                """, (
-                    admin_id,
-                    product_code,
-                    f"Reduced {quantity} stock(s). Reason: {reason if reason else 'Not specified'}"
-                ))
-                
-                conn.commit()
+                def _reduce(cursor):
+                    # Check available stock first
+                    cursor.execute("""
+                        SELECT count 
+                        FROM product_stock_counts 
+                        WHERE product_code = ? AND status = 'available'
+                    """, (product_code,))
+                
+                    row = cursor.fetchone()
+                    available = row['count'] if row else 0
+                    if available < quantity:
+                        raise ValueError(f"Insufficient stock. Only {available} available.")
+                
+                    claimed = self.claim_stock(cursor, product_code, quantity, stock_ids, seller_id=admin_id)
+                
+                    # Log admin action
+                    cursor.execute("""
+                        INSERT INTO admin_logs (admin_id, action, target, details)
+                        VALUES (?, 'REDUCE_STOCK', ?, ?)
+                    """, (
+                        admin_id,
+                        product_code,
+                        f"Reduced {quantity} stock(s). Reason: {reason if reason else 'Not specified'}"
+                    ))
+                    return claimed
+
+                stock_ids = await self.take_stock_ids(product_code, quantity)
+                claimed = []
+                try:
+                    claimed = await db.transaction(_reduce)
+                finally:
+                    self.finish_stock_ids(product_code, stock_ids, claimed)
                 
                 # Invalidate cache
                 self._cache.pop(f"stock_count_{product_code}", None)
                 self._cache.pop("all_products", None)
+                await self.invalidate_listings(product_code)
                 
                 self.logger.info(f"Admin {admin_id} reduced {quantity} stock(s) from {product_code}")
                 return True
     
             except Exception as e:
                 self.logger.error(f"Error reducing stock: {e}")
-                if conn:
-                    conn.rollback()
                 raise
-            finally:
-                if conn:
-                    conn.close()
                     
     def invalidate_cache(self, product_code: str = None):
         """Invalidate cache for specific product or all products"""
@@ -543,6 +914,17 @@ class ProductManagerService:
         """Cleanup resources"""
         self._cache.clear()
         self._locks.clear()
+        for task in self._refill_tasks.values():
+            task.cancel()
+        self._refill_tasks.clear()
+        if self._content_filter_task:
+            self._content_filter_task.cancel()
+        self._content_filter = None
+        self._content_filter_ready = False
+        if self._validation_pool is not None:
+            self._validation_pool.shutdown(wait=False, cancel_futures=True)
+            self._validation_pool = None
+        self.invalidate_allocation()
 
 class ProductManagerCog(commands.Cog):
     def __init__(self, bot):
@@ -553,6 +935,7 @@ class ProductManagerCog(commands.Cog):
     async def cog_load(self):
         """Called when the cog is loaded"""
         self.logger.info("ProductManagerCog loading...")
+        self.product_service.schedule_content_filter_build()
 
     async def cog_unload(self):
         """Called when the cog is unloaded"""
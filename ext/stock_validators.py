@@ -0,0 +1,130 @@
+"""Per-product checks and normalisation for imported stock lines.
+
+``validate_chunk`` runs in the worker processes of the stock import's
+ProcessPoolExecutor, so validators must be picklable: patterns, builtin
+validators or other module-level functions.
+"""
+import logging
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from .constants import MAX_STOCK_LINE_LENGTH
+
+class StockLineError(ValueError):
+    """A stock line was rejected; the message is the reason shown to admins"""
+    pass
+
+_ACCOUNT_RE = re.compile(r'([^\s:]+)\s*:\s*(\S+)')
+_WORLD_RE = re.compile(r'[A-Z0-9]{1,24}')
+
+def validate_account(line: str) -> str:
+    """``user:pass``; whitespace around the colon is dropped"""
+    match = _ACCOUNT_RE.fullmatch(line)
+    if not match:
+        raise StockLineError("expected user:pass")
+    return f"{match.group(1)}:{match.group(2)}"
+
+def validate_world(line: str) -> str:
+    """Growtopia world name: A-Z and 0-9, at most 24 characters, upper-cased"""
+    world = line.upper()
+    if not _WORLD_RE.fullmatch(world):
+        raise StockLineError("world names are 1-24 letters or digits")
+    return world
+
+BUILTIN_VALIDATORS = {
+    'account': validate_account,
+    'world': validate_world
+}
+
+class LineValidator:
+    """A regex and/or callable check plus a length limit.
+
+    ``func`` receives the stripped line and returns the normalised content
+    or raises StockLineError; ``pattern`` must match the whole line.
+    """
+
+    def __init__(self, pattern: Optional[str] = None, func: Optional[Callable[[str], str]] = None,
+                 max_length: int = MAX_STOCK_LINE_LENGTH, name: Optional[str] = None):
+        self.pattern = re.compile(pattern) if pattern else None
+        self.func = func
+        self.max_length = max_length
+        self.name = name or (func.__name__ if func else pattern) or 'length'
+
+    def __call__(self, line: str) -> str:
+        if '\ufffd' in line:
+            # What the stock file reader decodes invalid UTF-8 bytes to
+            raise StockLineError("not valid UTF-8")
+        if len(line) > self.max_length:
+            raise StockLineError(f"longer than {self.max_length} characters")
+        if self.pattern and not self.pattern.fullmatch(line):
+            raise StockLineError(f"does not match {self.pattern.pattern}")
+        return self.func(line) if self.func else line
+
+def validate_chunk(validator: LineValidator, lines: Sequence[str]) -> List[Tuple[Optional[str], Optional[str]]]:
+    """Validate stripped, non-empty lines; one ``(content, reason)`` per line.
+
+    ``content`` is None when the line was rejected and ``reason`` says why.
+    Module-level so it can be sent to a worker process.
+    """
+    results = []
+    for line in lines:
+        try:
+            results.append((validator(line), None))
+        except StockLineError as e:
+            results.append((None, str(e)))
+    return results
+
+class StockValidatorRegistry:
+    """Maps product codes to the LineValidator used when importing stock.
+
+    Products without an entry still get the default length limit. Entries
+    come from ``register`` or from ``stock_import.validators`` in
+    config.json, where a value is a builtin name (``account``, ``world``),
+    or ``{"pattern": ..., "builtin": ..., "max_length": ...}``.
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if not self.initialized:
+            self.logger = logging.getLogger("StockValidatorRegistry")
+            self._validators = {}
+            self.default = LineValidator()
+            self.initialized = True
+
+    def register(self, product_code: str, validator: Union[LineValidator, Callable[[str], str], str]):
+        if isinstance(validator, LineValidator):
+            self._validators[product_code] = validator
+        elif callable(validator):
+            self._validators[product_code] = LineValidator(func=validator)
+        else:
+            self._validators[product_code] = LineValidator(pattern=validator)
+
+    def unregister(self, product_code: str):
+        self._validators.pop(product_code, None)
+
+    def get(self, product_code: str) -> LineValidator:
+        return self._validators.get(product_code, self.default)
+
+    def load_config(self, validators: Dict):
+        for product_code, spec in validators.items():
+            try:
+                if isinstance(spec, str):
+                    spec = {'builtin': spec}
+                func = None
+                if spec.get('builtin'):
+                    func = BUILTIN_VALIDATORS[spec['builtin']]
+                self.register(product_code, LineValidator(
+                    pattern=spec.get('pattern'),
+                    func=func,
+                    max_length=int(spec.get('max_length', MAX_STOCK_LINE_LENGTH)),
+                    name=spec.get('builtin')
+                ))
+            except (KeyError, re.error, TypeError, ValueError) as e:
+                self.logger.error(f"Invalid stock validator for {product_code}: {e}")
@@ -3,13 +3,22 @@ import asyncio
 import time
 import io
 from typing import Dict, List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
-from .constants import STATUS_AVAILABLE, STATUS_SOLD, TransactionError
-from database import get_connection
+from .product_manager import ProductManagerService
+from .constants import (
+    STATUS_AVAILABLE,
+    RESERVATION_TTL,
+    RESERVATION_REAP_INTERVAL,
+    RESERVATION_REAP_BATCH,
+    OUTBOX_PURCHASE_DM,
+    OUTBOX_PURCHASE_LOG,
+    TransactionError
+)
+from database import db, enqueue_outbox
 
 class TransactionManager:
     _instance = None
@@ -24,6 +33,7 @@ class TransactionManager:
         if not self.initialized:
             self.bot = bot
             self.logger = logging.getLogger("TransactionManager")
+            self.product_manager = ProductManagerService(bot)
             self._cache = {}
             self._cache_timeout = 30
             self._locks = {}
@@ -34,21 +44,71 @@ class TransactionManager:
             self._locks[key] = asyncio.Lock()
         return self._locks[key]
 
+    @staticmethod
+    def format_purchase_result(user_name: str, items: list, product_name: str,
+                               date: Optional[str] = None) -> str:
+        content = f"Purchase Result for {user_name}\n"
+        content += f"Date: {date or datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC\n"
+        content += f"Product: {product_name}\n"
+        content += "-" * 50 + "\n\n"
+        
+        # Add all purchased items
+        for idx, item in enumerate(items, 1):
+            label = f" [{item['product_name']}]" if item.get('product_name') else ""
+            content += f"Item {idx}{label}:\n{item['content']}\n\n"
+        return content
+
+    @staticmethod
+    def format_purchase_log(order_id: int, user_name: str, product_code: str, total: int, price: float) -> str:
+        content = "Purchase History\n"
+        content += f"Order ID: # {order_id}\n"
+        content += f"➜ Buyer: @{user_name}\n"
+        content += f"➜ Product ID: {product_code}\n"
+        content += f"➜ Total: {total}\n"
+        content += f"➜ Price: {price} 💎"
+        return content
+
+    @staticmethod
+    def _enqueue_purchase_effects(cursor, buyer: Dict, order_id: int, product_code: str,
+                                  product_name: str, items: list, total_price: int):
+        """Queue the receipt DM and the buy-log post in the purchase transaction"""
+        purchased_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        enqueue_outbox(cursor, OUTBOX_PURCHASE_DM, f"purchase:{order_id}:dm", {
+            'user_id': buyer['id'],
+            'user_name': buyer['name'],
+            'order_id': order_id,
+            'product_name': product_name,
+            'items': [
+                {'content': item['content'], 'product_name': item.get('product_name')}
+                for item in items
+            ],
+            'purchased_at': purchased_at
+        })
+        enqueue_outbox(cursor, OUTBOX_PURCHASE_LOG, f"purchase:{order_id}:log", {
+            'user_name': buyer['name'],
+            'order_id': order_id,
+            'product_code': product_code,
+            'total': len(items),
+            'price': total_price
+        })
+
+    @staticmethod
+    def _record_order_items(cursor, order_id: int, items: list):
+        """Link an order to the exact stock rows it sold"""
+        cursor.executemany(
+            "INSERT INTO order_items (transaction_id, stock_id) VALUES (?, ?)",
+            [(order_id, item['id']) for item in items]
+        )
+
+    def _notify_outbox(self):
+        # Wake the dispatcher now instead of at its next poll
+        self.bot.dispatch('outbox_ready')
+
     async def send_purchase_result(self, user: discord.User, items: list, product_name: str) -> bool:
         try:
-            # Create txt file content
-            content = f"Purchase Result for {user.name}\n"
-            content += f"Date: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC\n"
-            content += f"Product: {product_name}\n"
-            content += "-" * 50 + "\n\n"
-            
-            # Add all purchased items
-            for idx, item in enumerate(items, 1):
-                content += f"Item {idx}:\n{item['content']}\n\n"
-            
             # Create txt file
             file = discord.File(
-                io.StringIO(content),
+                io.StringIO(self.format_purchase_result(user.name, items, product_name)),
                 filename=f"result_{user.name}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.txt"
             )
             
@@ -67,64 +127,57 @@ class TransactionManager:
             self.logger.error(f"Error sending purchase result to {user.name} ({user.id}): {e}")
             return False
 
-    async def process_purchase(self, growid: str, product_code: str, quantity: int = 1) -> Optional[Dict]:
-        async with await self._get_lock(f"purchase_{growid}_{product_code}"):
-            conn = None
-            try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
+    async def process_purchase(self, growid: str, product_code: str, quantity: int = 1,
+                               buyer: Optional[discord.abc.User] = None,
+                               idempotency_key: Optional[str] = None) -> Optional[Dict]:
+        """Buy ``quantity`` items of a product in one immediate transaction.
+
+        The debit and the stock claim are both conditional statements, so
+        concurrent buyers never need a Python-side lock: each one either
+        gets its rows or the whole purchase is rolled back. When ``buyer``
+        is given, the receipt DM and buy-log post are queued in the outbox
+        as part of the same transaction. A repeated ``idempotency_key``
+        returns the first result instead of buying again.
+        """
+        if quantity <= 0:
+            raise TransactionError("Invalid quantity")
+
+        buyer_info = {'id': buyer.id, 'name': buyer.name} if buyer else None
+
+        try:
+            def _purchase(cursor):
                 # Get product details
                 cursor.execute(
                     "SELECT price, name FROM products WHERE code = ?",
-                    (product_code,)  # Removed ()
+                    (product_code,)
                 )
                 product = cursor.fetchone()
                 if not product:
                     raise TransactionError(f"Product {product_code} not found")
-                
+
                 total_price = product['price'] * quantity
-                
-                # Get available stock
+
+                # Conditional debit - only succeeds if the balance covers it
                 cursor.execute("""
-                    SELECT id, content 
-                    FROM stock 
-                    WHERE product_code = ? AND status = ?
-                    ORDER BY added_at ASC
-                    LIMIT ?
-                """, (product_code, STATUS_AVAILABLE, quantity))
-                
-                stock_items = cursor.fetchall()
-                if len(stock_items) < quantity:
-                    raise TransactionError(f"Insufficient stock for {product_code}")
-                
-                # Get user balance - case-sensitive
-                cursor.execute(
-                    "SELECT balance_wl FROM users WHERE growid = ? COLLATE binary",
-                    (growid,)
-                )
+                    UPDATE users SET balance_wl = balance_wl - ?
+                    WHERE growid = ? COLLATE binary AND balance_wl >= ?
+                    RETURNING balance_wl
+                """, (total_price, growid, total_price))
                 user = cursor.fetchone()
                 if not user:
-                    raise TransactionError(f"User {growid} not found")
-                
-                if user['balance_wl'] < total_price:
+                    cursor.execute("SELECT 1 FROM users WHERE growid = ? COLLATE binary", (growid,))
+                    if not cursor.fetchone():
+                        raise TransactionError(f"User {growid} not found")
                     raise TransactionError("Insufficient balance")
-                
-                # Update stock status
-                stock_ids = [item['id'] for item in stock_items]
-                cursor.execute(f"""
-                    UPDATE stock 
-                    SET status = ?, buyer_id = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE id IN ({','.join('?' * len(stock_ids))})
-                """, [STATUS_SOLD, growid] + stock_ids)
-                
-                # Update user balance
-                new_balance = user['balance_wl'] - total_price
-                cursor.execute(
-                    "UPDATE users SET balance_wl = ? WHERE growid = ? COLLATE binary",
-                    (new_balance, growid)
+
+                new_balance = user['balance_wl']
+                old_balance = new_balance + total_price
+
+                # Raising on a shortfall rolls back the debit as well
+                stock_items = self.product_manager.claim_stock(
+                    cursor, product_code, quantity, stock_ids, buyer_id=growid
                 )
-                
+
                 # Record transaction and get order_id
                 cursor.execute(
                     """
@@ -137,33 +190,418 @@ class TransactionManager:
                         growid,
                         'PURCHASE',
                         f"Purchased {quantity} {product_code}",
-                        str(user['balance_wl']) + " WL",
-                        str(new_balance) + " WL",
+                        f"{old_balance} WL",
+                        f"{new_balance} WL",
                         quantity,
                         total_price
                     )
                 )
-                
                 order_id = cursor.fetchone()['id']
-                conn.commit()
-                
+                self._record_order_items(cursor, order_id, stock_items)
+
+                if buyer_info:
+                    self._enqueue_purchase_effects(
+                        cursor, buyer_info, order_id, product_code,
+                        product['name'], stock_items, total_price
+                    )
+
                 return {
                     'success': True,
-                    'order_id': order_id,  # Added order_id
-                    'items': [dict(item) for item in stock_items],
+                    'order_id': order_id,
+                    'items': stock_items,
                     'total_price': total_price,
                     'new_balance': new_balance,
                     'product_name': product['name']
                 }
 
-            except Exception as e:
-                self.logger.error(f"Error processing purchase: {e}")
-                if conn:
-                    conn.rollback()
-                raise
+            stock_ids = await self.product_manager.take_stock_ids(product_code, quantity)
+            result = None
+            try:
+                result = await db.transaction(_purchase, idempotency_key=idempotency_key)
             finally:
-                if conn:
-                    conn.close()
+                self.product_manager.finish_stock_ids(
+                    product_code, stock_ids,
+                    result['items'] if result and not result.get('replayed') else ()
+                )
+            if buyer_info:
+                self._notify_outbox()
+            await self._invalidate_listings(product_code)
+            return result
+
+        except Exception as e:
+            self.logger.error(f"Error processing purchase: {e}")
+            raise
+
+    async def process_order(self, growid: str, cart: Dict[str, int],
+                            buyer: Optional[discord.abc.User] = None,
+                            idempotency_key: Optional[str] = None) -> Dict:
+        """Buy several products at once: one debit, one order, one receipt.
+
+        ``cart`` maps product code to quantity. Every line is claimed in the
+        same writer transaction, so either the whole cart is sold or nothing
+        is. The order is a single PURCHASE transaction with one
+        ``order_lines`` row per product.
+        """
+        if not cart:
+            raise TransactionError("Cart is empty")
+        if any(quantity <= 0 for quantity in cart.values()):
+            raise TransactionError("Invalid quantity")
+
+        buyer_info = {'id': buyer.id, 'name': buyer.name} if buyer else None
+
+        def _order(cursor):
+            codes = list(cart)
+            cursor.execute(
+                f"SELECT code, name, price FROM products WHERE code IN ({','.join('?' * len(codes))})",
+                codes
+            )
+            products = {row['code']: row for row in cursor.fetchall()}
+            missing = [code for code in codes if code not in products]
+            if missing:
+                raise TransactionError(f"Product {', '.join(missing)} not found")
+
+            total_price = sum(products[code]['price'] * quantity for code, quantity in cart.items())
+
+            cursor.execute("""
+                UPDATE users SET balance_wl = balance_wl - ?
+                WHERE growid = ? COLLATE binary AND balance_wl >= ?
+                RETURNING balance_wl
+            """, (total_price, growid, total_price))
+            user = cursor.fetchone()
+            if not user:
+                cursor.execute("SELECT 1 FROM users WHERE growid = ? COLLATE binary", (growid,))
+                if not cursor.fetchone():
+                    raise TransactionError(f"User {growid} not found")
+                raise TransactionError("Insufficient balance")
+            new_balance = user['balance_wl']
+
+            lines = []
+            all_items = []
+            for code, quantity in cart.items():
+                product = products[code]
+                stock_items = self.product_manager.claim_stock(
+                    cursor, code, quantity, stock_ids[code], buyer_id=growid
+                )
+                for item in stock_items:
+                    item['product_name'] = product['name']
+                all_items.extend(stock_items)
+                lines.append({
+                    'product_code': code,
+                    'product_name': product['name'],
+                    'quantity': quantity,
+                    'unit_price': product['price'],
+                    'total_price': product['price'] * quantity,
+                    'items': stock_items
+                })
+
+            items_count = sum(cart.values())
+            cursor.execute(
+                """
+                INSERT INTO transactions 
+                (growid, type, details, old_balance, new_balance, items_count, total_price)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                RETURNING id
+                """,
+                (
+                    growid,
+                    'PURCHASE',
+                    "Purchased " + ", ".join(f"{quantity} {code}" for code, quantity in cart.items()),
+                    f"{new_balance + total_price} WL",
+                    f"{new_balance} WL",
+                    items_count,
+                    total_price
+                )
+            )
+            order_id = cursor.fetchone()['id']
+            self._record_order_items(cursor, order_id, all_items)
+
+            cursor.executemany("""
+                INSERT INTO order_lines
+                (transaction_id, product_code, product_name, quantity, unit_price, total_price)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [
+                (order_id, line['product_code'], line['product_name'],
+                 line['quantity'], line['unit_price'], line['total_price'])
+                for line in lines
+            ])
+
+            if buyer_info:
+                self._enqueue_purchase_effects(
+                    cursor, buyer_info, order_id,
+                    ", ".join(f"{code} x{quantity}" for code, quantity in cart.items()),
+                    ", ".join(line['product_name'] for line in lines),
+                    all_items, total_price
+                )
+
+            return {
+                'success': True,
+                'order_id': order_id,
+                'lines': lines,
+                'items': all_items,
+                'total_price': total_price,
+                'new_balance': new_balance
+            }
+
+        try:
+            stock_ids = {}
+            result = None
+            try:
+                for code, quantity in cart.items():
+                    stock_ids[code] = await self.product_manager.take_stock_ids(code, quantity)
+                result = await db.transaction(_order, idempotency_key=idempotency_key)
+            finally:
+                claimed = {}
+                if result and not result.get('replayed'):
+                    claimed = {line['product_code']: line['items'] for line in result['lines']}
+                for code, ids in stock_ids.items():
+                    self.product_manager.finish_stock_ids(code, ids, claimed.get(code, ()))
+            if buyer_info:
+                self._notify_outbox()
+            await self._invalidate_listings(*cart)
+            self.logger.info(
+                f"Order #{result['order_id']} for {growid}: {len(cart)} products, "
+                f"{len(result['items'])} items, {result['total_price']} WL"
+            )
+            return result
+        except Exception as e:
+            self.logger.error(f"Error processing order: {e}")
+            raise
+
+    async def _invalidate_listings(self, *product_codes: str):
+        await self.product_manager.invalidate_listings(*product_codes)
+
+    async def reserve_stock(self, growid: str, product_code: str, quantity: int = 1,
+                            ttl: int = RESERVATION_TTL, idempotency_key: Optional[str] = None) -> Dict:
+        """Hold ``quantity`` items for a buyer until they confirm or the hold expires.
+
+        Reserved rows move to ``pending`` so other buyers skip them; the
+        balance is only checked here and debited on confirm.
+        """
+        if quantity <= 0:
+            raise TransactionError("Invalid quantity")
+
+        expires_at = (datetime.utcnow() + timedelta(seconds=ttl)).strftime('%Y-%m-%d %H:%M:%S')
+
+        def _reserve(cursor):
+            cursor.execute("SELECT price, name FROM products WHERE code = ?", (product_code,))
+            product = cursor.fetchone()
+            if not product:
+                raise TransactionError(f"Product {product_code} not found")
+
+            total_price = product['price'] * quantity
+            cursor.execute("SELECT balance_wl FROM users WHERE growid = ? COLLATE binary", (growid,))
+            user = cursor.fetchone()
+            if not user:
+                raise TransactionError(f"User {growid} not found")
+            if user['balance_wl'] < total_price:
+                raise TransactionError("Insufficient balance")
+
+            cursor.execute("""
+                INSERT INTO stock_reservations (growid, product_code, quantity, unit_price, expires_at)
+                VALUES (?, ?, ?, ?, ?)
+                RETURNING id
+            """, (growid, product_code, quantity, product['price'], expires_at))
+            reservation_id = cursor.fetchone()['id']
+
+            cursor.execute("""
+                UPDATE stock
+                SET status = 'pending', reservation_id = ?
+                WHERE id IN (
+                    SELECT id FROM stock
+                    WHERE product_code = ? AND status = 'available'
+                    ORDER BY added_at ASC, id ASC
+                    LIMIT ?
+                ) AND status = 'available'
+                RETURNING id
+            """, (reservation_id, product_code, quantity))
+            if len(cursor.fetchall()) < quantity:
+                raise TransactionError(f"Insufficient stock for {product_code}")
+
+            return {
+                'reservation_id': reservation_id,
+                'product_code': product_code,
+                'product_name': product['name'],
+                'quantity': quantity,
+                'total_price': total_price,
+                'expires_at': expires_at
+            }
+
+        try:
+            reservation = await db.transaction(_reserve, idempotency_key=idempotency_key)
+            # The reserved rows were at the head of the allocation queue
+            self.product_manager.invalidate_allocation(product_code)
+            await self._invalidate_listings(product_code)
+            self.logger.info(
+                f"Reserved {quantity} {product_code} for {growid} "
+                f"(reservation #{reservation['reservation_id']}, expires {expires_at})"
+            )
+            return reservation
+        except Exception as e:
+            self.logger.error(f"Error reserving stock: {e}")
+            raise
+
+    async def confirm_reservation(self, reservation_id: int, growid: str,
+                                  buyer: Optional[discord.abc.User] = None) -> Dict:
+        """Pay for a reservation and sell its pending rows; same result shape as process_purchase"""
+        buyer_info = {'id': buyer.id, 'name': buyer.name} if buyer else None
+
+        def _confirm(cursor):
+            cursor.execute("""
+                SELECT r.*, p.name as product_name
+                FROM stock_reservations r
+                JOIN products p ON p.code = r.product_code
+                WHERE r.id = ? AND r.growid = ? COLLATE binary
+                AND r.status = 'active' AND r.expires_at > CURRENT_TIMESTAMP
+            """, (reservation_id, growid))
+            reservation = cursor.fetchone()
+            if not reservation:
+                raise TransactionError("Reservation expired or not found")
+
+            quantity = reservation['quantity']
+            total_price = reservation['unit_price'] * quantity
+
+            cursor.execute("""
+                UPDATE users SET balance_wl = balance_wl - ?
+                WHERE growid = ? COLLATE binary AND balance_wl >= ?
+                RETURNING balance_wl
+            """, (total_price, growid, total_price))
+            user = cursor.fetchone()
+            if not user:
+                raise TransactionError("Insufficient balance")
+            new_balance = user['balance_wl']
+
+            cursor.execute("""
+                UPDATE stock
+                SET status = 'sold', buyer_id = ?, reservation_id = NULL
+                WHERE reservation_id = ? AND status = 'pending'
+                RETURNING id, content
+            """, (growid, reservation_id))
+            stock_items = sorted((dict(row) for row in cursor.fetchall()), key=lambda item: item['id'])
+            if len(stock_items) != quantity:
+                raise TransactionError("Reserved stock is no longer available")
+
+            cursor.execute(
+                "UPDATE stock_reservations SET status = 'confirmed', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (reservation_id,)
+            )
+
+            cursor.execute(
+                """
+                INSERT INTO transactions 
+                (growid, type, details, old_balance, new_balance, items_count, total_price)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                RETURNING id
+                """,
+                (
+                    growid,
+                    'PURCHASE',
+                    f"Purchased {quantity} {reservation['product_code']}",
+                    f"{new_balance + total_price} WL",
+                    f"{new_balance} WL",
+                    quantity,
+                    total_price
+                )
+            )
+            order_id = cursor.fetchone()['id']
+            self._record_order_items(cursor, order_id, stock_items)
+
+            if buyer_info:
+                self._enqueue_purchase_effects(
+                    cursor, buyer_info, order_id, reservation['product_code'],
+                    reservation['product_name'], stock_items, total_price
+                )
+
+            return {
+                'success': True,
+                'order_id': order_id,
+                'items': stock_items,
+                'total_price': total_price,
+                'new_balance': new_balance,
+                'product_name': reservation['product_name']
+            }
+
+        try:
+            # Keyed on the reservation so a double click or a retried
+            # interaction gets the original receipt back
+            result = await db.transaction(
+                _confirm, idempotency_key=f"reservation:{reservation_id}:confirm"
+            )
+            if buyer_info:
+                self._notify_outbox()
+            await self._invalidate_listings()
+            self.logger.info(f"Confirmed reservation #{reservation_id} for {growid} (order #{result['order_id']})")
+            return result
+        except Exception as e:
+            self.logger.error(f"Error confirming reservation #{reservation_id}: {e}")
+            raise
+
+    async def release_reservation(self, reservation_id: int, growid: Optional[str] = None) -> int:
+        """Give a reservation's items back to the shelf; returns the number released"""
+        def _release(cursor):
+            query = "UPDATE stock_reservations SET status = 'released', updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'active'"
+            params = [reservation_id]
+            if growid:
+                query += " AND growid = ? COLLATE binary"
+                params.append(growid)
+            cursor.execute(query + " RETURNING product_code", params)
+            reservation = cursor.fetchone()
+            if not reservation:
+                return None, 0
+
+            cursor.execute("""
+                UPDATE stock SET status = 'available', reservation_id = NULL
+                WHERE reservation_id = ? AND status = 'pending'
+            """, (reservation_id,))
+            return reservation['product_code'], cursor.rowcount
+
+        try:
+            product_code, released = await db.transaction(_release)
+            if released:
+                # Released rows are older than anything left in the queue
+                self.product_manager.invalidate_allocation(product_code)
+                await self._invalidate_listings(product_code)
+                self.logger.info(f"Released reservation #{reservation_id} ({released} items)")
+            return released
+        except Exception as e:
+            self.logger.error(f"Error releasing reservation #{reservation_id}: {e}")
+            return 0
+
+    async def release_expired_reservations(self, batch_size: int = RESERVATION_REAP_BATCH) -> int:
+        """Return stock of every expired reservation to 'available' in bulk"""
+        def _reap(cursor):
+            cursor.execute("""
+                SELECT id FROM stock_reservations
+                WHERE status = 'active' AND expires_at <= CURRENT_TIMESTAMP
+                LIMIT ?
+            """, (batch_size,))
+            ids = [row['id'] for row in cursor.fetchall()]
+            if not ids:
+                return 0, 0
+
+            marks = ','.join('?' * len(ids))
+            cursor.execute(f"""
+                UPDATE stock SET status = 'available', reservation_id = NULL
+                WHERE reservation_id IN ({marks}) AND status = 'pending'
+            """, ids)
+            items = cursor.rowcount
+            cursor.execute(f"""
+                UPDATE stock_reservations SET status = 'expired', updated_at = CURRENT_TIMESTAMP
+                WHERE id IN ({marks})
+            """, ids)
+            return len(ids), items
+
+        total = 0
+        while True:
+            reservations, items = await db.transaction(_reap)
+            total += items
+            if reservations:
+                self.logger.info(f"Expired {reservations} reservations, {items} items back in stock")
+            if reservations < batch_size:
+                break
+        if total:
+            self.product_manager.invalidate_allocation()
+            await self._invalidate_listings()
+        return total
 
     async def log_purchase_to_channel(self, order_id: int, user: discord.User, product_code: str, total: int, price: float) -> bool:
         """Log purchase to buy-logs channel"""
@@ -174,13 +612,7 @@ class TransactionManager:
                 self.logger.error(f"Could not find buy-logs channel with ID {self.bot.log_purchase_channel_id}")
                 return False
                 
-            # Create message content
-            content = "Purchase History\n"
-            content += f"Order ID: # {order_id}\n"
-            content += f"➜ Buyer: @{user.name}\n"
-            content += f"➜ Product ID: {product_code}\n"
-            content += f"➜ Total: {total}\n"
-            content += f"➜ Price: {price} 💎"
+            content = self.format_purchase_log(order_id, user.name, product_code, total, price)
 
             await channel.send(content)
             self.logger.info(f"Purchase log sent for order #{order_id}")
@@ -192,132 +624,199 @@ class TransactionManager:
 
     # [Rest of existing methods remain unchanged]
     async def get_user_purchases(self, growid: str, limit: int = 10) -> List[Dict]:
+        """Purchased items of a user, newest first, one row per item"""
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT t.*, s.content, p.name as product_name
-                FROM transactions t
-                JOIN stock s ON s.buyer_id = t.growid
-                JOIN products p ON p.code = s.product_code
-                WHERE t.growid = ? AND t.type = 'PURCHASE'
+            # order_items makes this an exact per-order lookup; items whose
+            # stock row was archived are read from stock_archive
+            query = """
+                SELECT t.*, oi.stock_id,
+                       COALESCE(s.content, sa.content) as content,
+                       p.name as product_name
+                FROM {table} t
+                JOIN order_items oi ON oi.transaction_id = t.id
+                LEFT JOIN stock s ON s.id = oi.stock_id
+                LEFT JOIN stock_archive sa ON sa.id = oi.stock_id AND s.id IS NULL
+                LEFT JOIN products p ON p.code = COALESCE(s.product_code, sa.product_code)
+                WHERE t.growid = ? COLLATE binary AND t.type = 'PURCHASE'
                 ORDER BY t.created_at DESC
                 LIMIT ?
-            """, (growid, limit))
-            
-            return [dict(row) for row in cursor.fetchall()]
+            """
+            rows = await db.fetchall(query.format(table='transactions'), (growid, limit))
+            purchases = [dict(row) for row in rows]
+
+            # Archived orders are all older than the hot ones, so only read
+            # the archive for whatever the hot table could not fill
+            if len(purchases) < limit:
+                rows = await db.fetchall(
+                    query.format(table='transactions_archive'),
+                    (growid, limit - len(purchases))
+                )
+                purchases.extend(dict(row) for row in rows)
+
+            return purchases
 
         except Exception as e:
             self.logger.error(f"Error getting user purchases: {e}")
             return []
-        finally:
-            if conn:
-                conn.close()
 
     async def cancel_transaction(self, transaction_id: int, admin_id: str) -> bool:
-        async with await self._get_lock(f"cancel_transaction_{transaction_id}"):
-            conn = None
-            try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
+        """Refund a purchase: its exact stock rows go back on sale and the buyer is credited.
+
+        Runs once per transaction under the ``cancel:{id}`` idempotency key;
+        a repeat returns True without crediting again. Once the key has
+        expired, the purchase's ``refunded_at`` still rejects a second
+        refund. Orders whose items were already moved to stock_archive are
+        rejected, since their stock can no longer be put back on sale.
+        """
+        try:
+            def _cancel(cursor):
                 # Get transaction details
-                cursor.execute("""
-                    SELECT t.*, s.id as stock_id
-                    FROM transactions t
-                    JOIN stock s ON s.buyer_id = t.growid
-                    WHERE t.id = ? AND t.type = 'PURCHASE'
-                """, (transaction_id,))
-                
+                cursor.execute(
+                    "SELECT * FROM transactions WHERE id = ? AND type = 'PURCHASE'",
+                    (transaction_id,)
+                )
                 trx = cursor.fetchone()
                 if not trx:
                     raise ValueError(f"Transaction {transaction_id} not found")
-                
-                # Restore stock status
+                if trx['refunded_at']:
+                    raise ValueError(f"Transaction {transaction_id} was already refunded at {trx['refunded_at']}")
+
                 cursor.execute(
-                    "UPDATE stock SET status = ?, buyer_id = NULL WHERE id = ?",
-                    (STATUS_AVAILABLE, trx['stock_id'])
+                    "SELECT stock_id FROM order_items WHERE transaction_id = ?",
+                    (transaction_id,)
                 )
-                
+                stock_ids = [row['stock_id'] for row in cursor.fetchall()]
+                if not stock_ids:
+                    raise ValueError(
+                        f"Transaction {transaction_id} has no linked items; "
+                        "run `python database.py backfill-order-items` first"
+                    )
+                placeholders = ','.join('?' * len(stock_ids))
+
+                cursor.execute(f"SELECT COUNT(*) FROM stock_archive WHERE id IN ({placeholders})", stock_ids)
+                if cursor.fetchone()[0]:
+                    raise ValueError(f"Transaction {transaction_id} has archived items and can no longer be refunded")
+
+                # Restore exactly the rows this order sold
+                cursor.execute(f"""
+                    UPDATE stock SET status = ?, buyer_id = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE id IN ({placeholders}) AND status = 'sold' AND buyer_id = ? COLLATE binary
+                    RETURNING product_code
+                """, [STATUS_AVAILABLE, *stock_ids, trx['growid']])
+                restored = cursor.fetchall()
+                if len(restored) != len(stock_ids):
+                    # Raising rolls back the rows restored above
+                    raise ValueError(
+                        f"Transaction {transaction_id}: only {len(restored)} of {len(stock_ids)} items "
+                        "are still sold to the buyer (already refunded?)"
+                    )
+                product_codes = sorted({row['product_code'] for row in restored})
+
                 # Restore user balance
                 cursor.execute(
-                    "UPDATE users SET balance_wl = balance_wl + ? WHERE growid = ?",
+                    "UPDATE users SET balance_wl = balance_wl + ? WHERE growid = ? COLLATE binary RETURNING balance_wl",
                     (trx['total_price'], trx['growid'])
                 )
-                
+                user = cursor.fetchone()
+                if not user:
+                    raise ValueError(f"User {trx['growid']} not found")
+
+                cursor.execute(
+                    "UPDATE transactions SET refunded_at = CURRENT_TIMESTAMP WHERE id = ?",
+                    (transaction_id,)
+                )
+
                 # Record refund transaction
                 cursor.execute(
                     """
                     INSERT INTO transactions 
-                    (growid, type, details, old_balance, new_balance, related_transaction_id, admin_id)
+                    (growid, type, details, old_balance, new_balance, items_count, total_price)
                     VALUES (?, ?, ?, ?, ?, ?, ?)
                     """,
                     (
                         trx['growid'],
                         'REFUND',
                         f"Refund for transaction #{transaction_id}",
-                        f"{trx['new_balance']} WL",
-                        f"{trx['new_balance'] + trx['total_price']} WL",
-                        transaction_id,
-                        admin_id
+                        f"{user['balance_wl'] - trx['total_price']} WL",
+                        f"{user['balance_wl']} WL",
+                        len(stock_ids),
+                        trx['total_price']
                     )
                 )
-                
-                conn.commit()
-                self.logger.info(f"Transaction {transaction_id} cancelled by admin {admin_id}")
+                cursor.execute(
+                    "INSERT INTO admin_logs (admin_id, action, target, details) VALUES (?, 'REFUND', ?, ?)",
+                    (admin_id, str(transaction_id), f"Refunded {len(stock_ids)} item(s) to {trx['growid']}")
+                )
+                return {'product_codes': product_codes}
+
+            result = await db.transaction(_cancel, idempotency_key=f"cancel:{transaction_id}")
+            if result.get('replayed'):
+                self.logger.info(f"Transaction {transaction_id} was already refunded")
                 return True
 
-            except Exception as e:
-                self.logger.error(f"Error cancelling transaction: {e}")
-                if conn:
-                    conn.rollback()
-                raise
-            finally:
-                if conn:
-                    conn.close()
+            for code in result['product_codes']:
+                self.product_manager.invalidate_allocation(code)
+            await self._invalidate_listings(*result['product_codes'])
+            self.logger.info(f"Transaction {transaction_id} cancelled by admin {admin_id}")
+            return True
+
+        except Exception as e:
+            self.logger.error(f"Error cancelling transaction: {e}")
+            raise
 
-    async def get_transaction_history(self, growid: str, limit: int = 10) -> List[Dict]:
+    async def get_transaction_history(self, growid: str, limit: int = 10,
+                                      include_archive: bool = False) -> List[Dict]:
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
+            rows = await db.fetchall("""
                 SELECT * FROM transactions 
                 WHERE growid = ? COLLATE binary
                 ORDER BY created_at DESC
                 LIMIT ?
             """, (growid, limit))
+            history = [dict(row) for row in rows]
+
+            # Archived rows are all older than the hot ones, so only read
+            # the archive for whatever the hot table could not fill
+            if include_archive and len(history) < limit:
+                archived = await db.fetchall("""
+                    SELECT * FROM transactions_archive
+                    WHERE growid = ? COLLATE binary
+                    ORDER BY created_at DESC
+                    LIMIT ?
+                """, (growid, limit - len(history)))
+                history.extend(dict(row) for row in archived)
             
-            return [dict(row) for row in cursor.fetchall()]
+            return history
 
         except Exception as e:
             self.logger.error(f"Error getting transaction history: {e}")
             return []
-        finally:
-            if conn:
-                conn.close()
 
-    async def get_stock_history(self, product_code: str, limit: int = 10) -> List[Dict]:
+    async def get_stock_history(self, product_code: str, limit: int = 10,
+                                include_archive: bool = False) -> List[Dict]:
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
+            rows = await db.fetchall("""
                 SELECT * FROM stock 
                 WHERE product_code = ?
                 ORDER BY updated_at DESC
                 LIMIT ?
             """, (product_code, limit))
+            history = [dict(row) for row in rows]
+
+            if include_archive and len(history) < limit:
+                archived = await db.fetchall("""
+                    SELECT * FROM stock_archive
+                    WHERE product_code = ?
+                    ORDER BY updated_at DESC
+                    LIMIT ?
+                """, (product_code, limit - len(history)))
+                history.extend(dict(row) for row in archived)
             
-            return [dict(row) for row in cursor.fetchall()]
+            return history
 
         except Exception as e:
             self.logger.error(f"Error getting stock history: {e}")
             return []
-        finally:
-            if conn:
-                conn.close()
 
     async def cleanup(self):
         """Cleanup resources"""
@@ -330,6 +829,25 @@ class TransactionCog(commands.Cog):
         self.trx_manager = TransactionManager(bot)
         self.logger = logging.getLogger("TransactionCog")
 
+    async def cog_load(self):
+        self.reservation_reaper.start()
+
+    def cog_unload(self):
+        self.reservation_reaper.cancel()
+
+    @tasks.loop(seconds=RESERVATION_REAP_INTERVAL)
+    async def reservation_reaper(self):
+        """Put stock from expired reservations back on sale"""
+        try:
+            # Listings are invalidated (and stock_changed published) by the release
+            await self.trx_manager.release_expired_reservations()
+        except Exception as e:
+            self.logger.error(f"Error in reservation reaper: {e}")
+
+    @reservation_reaper.before_loop
+    async def before_reservation_reaper(self):
+        await self.bot.wait_until_ready()
+
     @commands.Cog.listener()
     async def on_ready(self):
         self.logger.info(f"TransactionCog is ready at {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC")
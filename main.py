@@ -14,7 +14,7 @@ import traceback
 
 # Import local modules
 from api.server import create_api_server
-from database import setup_database, get_connection
+from database import migrate, build_pending_indexes, IntegrityVerifier, Archiver, pool, db, writer, cache
 from utils.command_handler import AdvancedCommandHandler
 from utils.button_handler import ButtonHandler
 from api.config import config, API_VERSION
@@ -164,12 +164,16 @@ class MyBot(commands.Bot):
             # Create aiohttp session
             self.session = aiohttp.ClientSession()
             logger.debug("aiohttp session created")
+
+            # Build indexes deferred by migrations without delaying startup
+            self.loop.create_task(self._build_pending_indexes())
             
             # Load extensions
             extensions = [
                 'cogs.admin',
                 'ext.live_stock',
                 'ext.trx',
+                'ext.outbox',
                 'ext.donate',
                 'ext.balance_manager',
                 'ext.product_manager'
@@ -198,6 +202,14 @@ class MyBot(commands.Bot):
             {traceback.format_exc()}
             """)
 
+    async def _build_pending_indexes(self):
+        try:
+            built = await build_pending_indexes()
+            if built:
+                logger.info(f"Built {built} deferred database index(es)")
+        except Exception as e:
+            logger.error(f"Error building deferred indexes: {e}")
+
     async def close(self):
         """Cleanup on shutdown"""
         logger.debug("Performing cleanup...")
@@ -365,6 +377,8 @@ class MyBot(commands.Bot):
 
 def main():
     """Main entry point"""
+    verifier = None
+    archiver = None
     try:
         logger.info(f"""
         Starting application:
@@ -376,9 +390,31 @@ def main():
         # Load config
         bot_config = Config.load()
         
-        # Setup database
-        logger.debug("Setting up database...")
-        setup_database()
+        # Migrate database (a single pragma read when already current)
+        logger.debug("Checking database schema...")
+        migrate()
+
+        # Integrity checks run in a background thread, never on startup
+        db_config = bot_config.get('database', {})
+        verifier = IntegrityVerifier(
+            writer=writer,
+            quick_interval=float(db_config.get('integrity_quick_interval_hours', 6)) * 3600,
+            full_check_hour=db_config.get('integrity_full_check_hour', 4)
+        )
+        verifier.start()
+
+        # Expired L2 cache rows are removed in small background chunks
+        cache.start_sweeper()
+
+        # Old sold stock and transactions move to the archive tables
+        archiver = Archiver(
+            writer,
+            stock_days=float(db_config.get('archive_stock_days', 30)),
+            transaction_days=float(db_config.get('archive_transaction_days', 90)),
+            outbox_days=float(db_config.get('outbox_retention_days', 7)),
+            idempotency_days=float(db_config.get('idempotency_retention_days', 7))
+        )
+        archiver.start()
         
         # Create bot instance
         logger.debug("Creating bot instance...")
@@ -405,10 +441,15 @@ def main():
         # Cleanup
         try:
             logger.debug("Performing cleanup...")
-            conn = get_connection()
-            if conn:
-                conn.close()
-                logger.debug("Database connection closed")
+            if verifier:
+                verifier.stop()
+            cache.stop_sweeper()
+            if archiver:
+                archiver.stop()
+            db.close()
+            logger.debug(f"Database executor closed: {db.get_stats()}")
+            pool.close()
+            logger.debug(f"Database pool closed: {pool.get_stats()}")
         except Exception as e:
             logger.error(f"""
             Database cleanup error:
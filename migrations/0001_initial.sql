@@ -0,0 +1,182 @@
+-- Initial schema (what setup_database() used to create on every boot).
+-- Every statement is idempotent so databases created before versioning
+-- was introduced (user_version = 0) can be stamped safely.
+
+-- Users (parent table)
+CREATE TABLE IF NOT EXISTS users (
+    growid TEXT PRIMARY KEY,
+    balance_wl INTEGER DEFAULT 0,
+    balance_dl INTEGER DEFAULT 0,
+    balance_bgl INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Discord account -> GrowID mapping
+CREATE TABLE IF NOT EXISTS user_growid (
+    discord_id TEXT PRIMARY KEY,
+    growid TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (growid) REFERENCES users(growid) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS products (
+    code TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS stock (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_code TEXT NOT NULL,
+    content TEXT NOT NULL UNIQUE,
+    status TEXT DEFAULT 'available' CHECK (status IN ('available', 'sold', 'deleted')),
+    added_by TEXT NOT NULL,
+    buyer_id TEXT,
+    seller_id TEXT,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (product_code) REFERENCES products(code) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    growid TEXT NOT NULL,
+    type TEXT NOT NULL,
+    details TEXT NOT NULL,
+    old_balance TEXT,
+    new_balance TEXT,
+    items_count INTEGER DEFAULT 0,
+    total_price INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (growid) REFERENCES users(growid) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS world_info (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    world TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    bot TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS bot_settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS blacklist (
+    growid TEXT PRIMARY KEY,
+    added_by TEXT NOT NULL,
+    reason TEXT,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (growid) REFERENCES users(growid) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS admin_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    admin_id TEXT NOT NULL,
+    action TEXT NOT NULL,
+    target TEXT,
+    details TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS role_permissions (
+    role_id TEXT PRIMARY KEY,
+    permissions TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS user_activity (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    discord_id TEXT NOT NULL,
+    activity_type TEXT NOT NULL,
+    details TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (discord_id) REFERENCES user_growid(discord_id)
+);
+
+CREATE TABLE IF NOT EXISTS cache_table (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Index builds deferred by the migration engine (see "-- @online")
+CREATE TABLE IF NOT EXISTS pending_indexes (
+    name TEXT PRIMARY KEY,
+    sql TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Timestamp triggers
+CREATE TRIGGER IF NOT EXISTS update_users_timestamp
+AFTER UPDATE ON users
+BEGIN
+    UPDATE users SET updated_at = CURRENT_TIMESTAMP
+    WHERE growid = NEW.growid;
+END;
+
+CREATE TRIGGER IF NOT EXISTS update_products_timestamp
+AFTER UPDATE ON products
+BEGIN
+    UPDATE products SET updated_at = CURRENT_TIMESTAMP
+    WHERE code = NEW.code;
+END;
+
+CREATE TRIGGER IF NOT EXISTS update_stock_timestamp
+AFTER UPDATE ON stock
+BEGIN
+    UPDATE stock SET updated_at = CURRENT_TIMESTAMP
+    WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS update_bot_settings_timestamp
+AFTER UPDATE ON bot_settings
+BEGIN
+    UPDATE bot_settings SET updated_at = CURRENT_TIMESTAMP
+    WHERE key = NEW.key;
+END;
+
+CREATE TRIGGER IF NOT EXISTS update_role_permissions_timestamp
+AFTER UPDATE ON role_permissions
+BEGIN
+    UPDATE role_permissions SET updated_at = CURRENT_TIMESTAMP
+    WHERE role_id = NEW.role_id;
+END;
+
+-- Indexes
+CREATE INDEX IF NOT EXISTS idx_user_growid_discord ON user_growid(discord_id);
+CREATE INDEX IF NOT EXISTS idx_user_growid_growid ON user_growid(growid);
+-- @online
+CREATE INDEX IF NOT EXISTS idx_stock_product_code ON stock(product_code);
+-- @online
+CREATE INDEX IF NOT EXISTS idx_stock_status ON stock(status);
+-- @online
+CREATE INDEX IF NOT EXISTS idx_stock_content ON stock(content);
+-- @online
+CREATE INDEX IF NOT EXISTS idx_transactions_growid ON transactions(growid);
+-- @online
+CREATE INDEX IF NOT EXISTS idx_transactions_created ON transactions(created_at);
+CREATE INDEX IF NOT EXISTS idx_blacklist_growid ON blacklist(growid);
+CREATE INDEX IF NOT EXISTS idx_admin_logs_admin ON admin_logs(admin_id);
+CREATE INDEX IF NOT EXISTS idx_admin_logs_created ON admin_logs(created_at);
+CREATE INDEX IF NOT EXISTS idx_user_activity_discord ON user_activity(discord_id);
+CREATE INDEX IF NOT EXISTS idx_user_activity_type ON user_activity(activity_type);
+CREATE INDEX IF NOT EXISTS idx_role_permissions_role ON role_permissions(role_id);
+CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache_table(expires_at);
+
+-- Seed data
+INSERT OR IGNORE INTO world_info (id, world, owner, bot)
+VALUES (1, 'YOURWORLD', 'OWNER', 'BOT');
+
+INSERT OR IGNORE INTO role_permissions (role_id, permissions)
+VALUES ('admin', 'all');
@@ -0,0 +1,22 @@
+-- Indexes for the FIFO stock pick and per-user history.
+-- Queries must compare status with the literal 'available' (not a bound
+-- parameter) for SQLite to be able to use the partial index.
+
+-- @online
+CREATE INDEX IF NOT EXISTS idx_stock_available_fifo
+ON stock(product_code, added_at, id)
+WHERE status = 'available';
+
+-- @online
+CREATE INDEX IF NOT EXISTS idx_transactions_growid_created
+ON transactions(growid, created_at);
+
+-- Superseded: status alone is not selective, content already has the
+-- UNIQUE constraint's index, and growid is a prefix of the new index
+DROP INDEX IF EXISTS idx_stock_status;
+DROP INDEX IF EXISTS idx_stock_content;
+DROP INDEX IF EXISTS idx_transactions_growid;
+
+-- If 0001 deferred them, their queued builds would bring them back
+DELETE FROM pending_indexes
+WHERE name IN ('idx_stock_status', 'idx_stock_content', 'idx_transactions_growid');
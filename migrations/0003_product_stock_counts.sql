@@ -0,0 +1,50 @@
+-- Per-product, per-status stock counters kept exact by triggers, so
+-- stock counts are a primary-key lookup instead of a COUNT(*) over stock.
+-- Repair with: python database.py rebuild-counts
+
+CREATE TABLE IF NOT EXISTS product_stock_counts (
+    product_code TEXT NOT NULL,
+    status TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (product_code, status)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS stock_counts_insert
+AFTER INSERT ON stock
+BEGIN
+    INSERT INTO product_stock_counts (product_code, status, count)
+    VALUES (NEW.product_code, NEW.status, 1)
+    ON CONFLICT (product_code, status) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stock_counts_update
+AFTER UPDATE OF status, product_code ON stock
+WHEN OLD.status IS NOT NEW.status OR OLD.product_code IS NOT NEW.product_code
+BEGIN
+    UPDATE product_stock_counts SET count = count - 1
+    WHERE product_code = OLD.product_code AND status = OLD.status;
+
+    INSERT INTO product_stock_counts (product_code, status, count)
+    VALUES (NEW.product_code, NEW.status, 1)
+    ON CONFLICT (product_code, status) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stock_counts_delete
+AFTER DELETE ON stock
+BEGIN
+    UPDATE product_stock_counts SET count = count - 1
+    WHERE product_code = OLD.product_code AND status = OLD.status;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stock_counts_product_delete
+AFTER DELETE ON products
+BEGIN
+    DELETE FROM product_stock_counts WHERE product_code = OLD.code;
+END;
+
+-- Backfill from existing stock
+DELETE FROM product_stock_counts;
+INSERT INTO product_stock_counts (product_code, status, count)
+SELECT product_code, status, COUNT(*)
+FROM stock
+GROUP BY product_code, status;
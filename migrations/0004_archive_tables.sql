@@ -0,0 +1,42 @@
+-- Cold storage for sold/deleted stock and old transactions.
+-- Rows are moved here in batches by the Archiver; ids are kept so the
+-- move is idempotent and history lookups can fall through by id.
+
+CREATE TABLE IF NOT EXISTS stock_archive (
+    id INTEGER PRIMARY KEY,
+    product_code TEXT NOT NULL,
+    content TEXT NOT NULL,
+    status TEXT NOT NULL,
+    added_by TEXT NOT NULL,
+    buyer_id TEXT,
+    seller_id TEXT,
+    added_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS transactions_archive (
+    id INTEGER PRIMARY KEY,
+    growid TEXT NOT NULL,
+    type TEXT NOT NULL,
+    details TEXT NOT NULL,
+    old_balance TEXT,
+    new_balance TEXT,
+    items_count INTEGER DEFAULT 0,
+    total_price INTEGER DEFAULT 0,
+    created_at TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_archive_product_updated
+ON stock_archive(product_code, updated_at);
+
+CREATE INDEX IF NOT EXISTS idx_transactions_archive_growid_created
+ON transactions_archive(growid, created_at);
+
+-- Finds archivable stock without touching available rows; the archiver
+-- must repeat this exact status predicate for the index to apply
+-- @online
+CREATE INDEX IF NOT EXISTS idx_stock_archivable
+ON stock(updated_at, id)
+WHERE status IN ('sold', 'deleted');
@@ -0,0 +1,101 @@
+-- Time-limited reservations. Reserved stock is moved to status 'pending'
+-- and tagged with its reservation; confirming sells it, releasing or
+-- expiry puts it back to 'available'.
+
+CREATE TABLE IF NOT EXISTS stock_reservations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    growid TEXT NOT NULL,
+    product_code TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    unit_price INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'active'
+        CHECK (status IN ('active', 'confirmed', 'released', 'expired')),
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_reservations_active_expiry
+ON stock_reservations(expires_at)
+WHERE status = 'active';
+
+-- The status CHECK on stock predates 'pending', and SQLite cannot alter a
+-- CHECK constraint, so the table is rebuilt. Copying rows does not fire
+-- the stock triggers, so product_stock_counts stays exact.
+CREATE TABLE stock_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_code TEXT NOT NULL,
+    content TEXT NOT NULL UNIQUE,
+    status TEXT DEFAULT 'available' CHECK (status IN ('available', 'pending', 'sold', 'deleted')),
+    added_by TEXT NOT NULL,
+    buyer_id TEXT,
+    seller_id TEXT,
+    reservation_id INTEGER,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (product_code) REFERENCES products(code) ON DELETE CASCADE
+);
+
+INSERT INTO stock_new (id, product_code, content, status, added_by, buyer_id, seller_id, added_at, updated_at)
+SELECT id, product_code, content, status, added_by, buyer_id, seller_id, added_at, updated_at
+FROM stock;
+
+-- Keep AUTOINCREMENT from reusing ids of rows already moved to stock_archive
+UPDATE sqlite_sequence
+SET seq = MAX(seq, COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'stock'), 0))
+WHERE name = 'stock_new';
+
+DROP TABLE stock;
+ALTER TABLE stock_new RENAME TO stock;
+
+CREATE TRIGGER update_stock_timestamp
+AFTER UPDATE ON stock
+BEGIN
+    UPDATE stock SET updated_at = CURRENT_TIMESTAMP
+    WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER stock_counts_insert
+AFTER INSERT ON stock
+BEGIN
+    INSERT INTO product_stock_counts (product_code, status, count)
+    VALUES (NEW.product_code, NEW.status, 1)
+    ON CONFLICT (product_code, status) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER stock_counts_update
+AFTER UPDATE OF status, product_code ON stock
+WHEN OLD.status IS NOT NEW.status OR OLD.product_code IS NOT NEW.product_code
+BEGIN
+    UPDATE product_stock_counts SET count = count - 1
+    WHERE product_code = OLD.product_code AND status = OLD.status;
+
+    INSERT INTO product_stock_counts (product_code, status, count)
+    VALUES (NEW.product_code, NEW.status, 1)
+    ON CONFLICT (product_code, status) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER stock_counts_delete
+AFTER DELETE ON stock
+BEGIN
+    UPDATE product_stock_counts SET count = count - 1
+    WHERE product_code = OLD.product_code AND status = OLD.status;
+END;
+
+CREATE INDEX idx_stock_product_code ON stock(product_code);
+
+CREATE INDEX idx_stock_available_fifo
+ON stock(product_code, added_at, id)
+WHERE status = 'available';
+
+CREATE INDEX idx_stock_archivable
+ON stock(updated_at, id)
+WHERE status IN ('sold', 'deleted');
+
+CREATE INDEX idx_stock_reservation
+ON stock(reservation_id)
+WHERE reservation_id IS NOT NULL;
+
+-- Deferred builds of the dropped table's indexes are recreated above
+DELETE FROM pending_indexes
+WHERE name IN ('idx_stock_product_code', 'idx_stock_available_fifo', 'idx_stock_archivable');
@@ -0,0 +1,26 @@
+-- Transactional outbox for side effects of a write (DMs, log posts).
+-- Rows are inserted in the same transaction as the change they describe
+-- and delivered afterwards by the bot's OutboxDispatcher. dedup_key makes
+-- enqueueing idempotent; finished rows are purged by the Archiver.
+
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    dedup_key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'delivered', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- The dispatcher polls with this exact status predicate
+CREATE INDEX IF NOT EXISTS idx_outbox_due
+ON outbox(next_attempt_at, id)
+WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS idx_outbox_finished
+ON outbox(updated_at, id)
+WHERE status IN ('delivered', 'failed');
@@ -0,0 +1,14 @@
+-- Results of idempotent writes, keyed by a namespaced request id such as
+-- "purchase:<interaction id>" or "donation:<message id>". The key is
+-- stored in the same transaction as the write, so a replay returns the
+-- stored result instead of running the write again. Old keys are purged
+-- by the Archiver using the created_at index.
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    result TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created
+ON idempotency_keys(created_at);
@@ -0,0 +1,14 @@
+-- Exact link between a PURCHASE transaction and the stock rows it sold.
+-- The primary key serves "items of an order", the second index serves
+-- "orders that sold this item" (a refunded item can be sold again).
+-- Sales made before this table existed are linked by the
+-- `database.py backfill-order-items` tool.
+
+CREATE TABLE IF NOT EXISTS order_items (
+    transaction_id INTEGER NOT NULL,
+    stock_id INTEGER NOT NULL,
+    PRIMARY KEY (transaction_id, stock_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_order_items_stock
+ON order_items(stock_id, transaction_id);
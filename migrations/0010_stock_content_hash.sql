@@ -0,0 +1,92 @@
+-- Duplicate detection on a fixed-width hash instead of the content text.
+-- content_hash is the 16-byte BLAKE2b digest of the stripped content,
+-- computed by the stock_content_hash() function every database.py
+-- connection registers. Its unique index replaces the UNIQUE constraint
+-- on content (and any leftover idx_stock_content), so an insert maintains
+-- one small index instead of two over long credential strings. SQLite
+-- cannot drop a column constraint, so the table is rebuilt as in 0005.
+
+DROP INDEX IF EXISTS idx_stock_content;
+
+CREATE TABLE stock_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_code TEXT NOT NULL,
+    content TEXT NOT NULL,
+    content_hash BLOB NOT NULL,
+    status TEXT DEFAULT 'available' CHECK (status IN ('available', 'pending', 'sold', 'deleted')),
+    added_by TEXT NOT NULL,
+    buyer_id TEXT,
+    seller_id TEXT,
+    reservation_id INTEGER,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (product_code) REFERENCES products(code) ON DELETE CASCADE
+);
+
+INSERT INTO stock_new (id, product_code, content, content_hash, status, added_by, buyer_id, seller_id,
+                       reservation_id, added_at, updated_at)
+SELECT id, product_code, content, stock_content_hash(content), status, added_by, buyer_id, seller_id,
+       reservation_id, added_at, updated_at
+FROM stock;
+
+-- Keep AUTOINCREMENT from reusing ids of rows already moved to stock_archive
+UPDATE sqlite_sequence
+SET seq = MAX(seq, COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'stock'), 0))
+WHERE name = 'stock_new';
+
+DROP TABLE stock;
+ALTER TABLE stock_new RENAME TO stock;
+
+CREATE UNIQUE INDEX idx_stock_content_hash ON stock(content_hash);
+
+CREATE TRIGGER update_stock_timestamp
+AFTER UPDATE ON stock
+BEGIN
+    UPDATE stock SET updated_at = CURRENT_TIMESTAMP
+    WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER stock_counts_insert
+AFTER INSERT ON stock
+BEGIN
+    INSERT INTO product_stock_counts (product_code, status, count)
+    VALUES (NEW.product_code, NEW.status, 1)
+    ON CONFLICT (product_code, status) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER stock_counts_update
+AFTER UPDATE OF status, product_code ON stock
+WHEN OLD.status IS NOT NEW.status OR OLD.product_code IS NOT NEW.product_code
+BEGIN
+    UPDATE product_stock_counts SET count = count - 1
+    WHERE product_code = OLD.product_code AND status = OLD.status;
+
+    INSERT INTO product_stock_counts (product_code, status, count)
+    VALUES (NEW.product_code, NEW.status, 1)
+    ON CONFLICT (product_code, status) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER stock_counts_delete
+AFTER DELETE ON stock
+BEGIN
+    UPDATE product_stock_counts SET count = count - 1
+    WHERE product_code = OLD.product_code AND status = OLD.status;
+END;
+
+CREATE INDEX idx_stock_product_code ON stock(product_code);
+
+CREATE INDEX idx_stock_available_fifo
+ON stock(product_code, added_at, id)
+WHERE status = 'available';
+
+CREATE INDEX idx_stock_archivable
+ON stock(updated_at, id)
+WHERE status IN ('sold', 'deleted');
+
+CREATE INDEX idx_stock_reservation
+ON stock(reservation_id)
+WHERE reservation_id IS NOT NULL;
+
+-- Deferred builds of the dropped table's indexes are recreated above
+DELETE FROM pending_indexes
+WHERE name IN ('idx_stock_product_code', 'idx_stock_available_fifo', 'idx_stock_archivable');
@@ -0,0 +1,5 @@
+-- Same cleanup as the end of 0002, for databases that ran 0002 before it
+-- cleared the queued builds of the indexes it drops.
+
+DELETE FROM pending_indexes
+WHERE name IN ('idx_stock_status', 'idx_stock_content', 'idx_transactions_growid');
@@ -0,0 +1,28 @@
+-- Archived stock keeps blocking re-imports of its content. Sold and
+-- deleted rows leave the hot stock table (and idx_stock_content_hash)
+-- when the Archiver moves them, so stock_archive gets the same 16-byte
+-- hash with its own unique index, and a trigger rejects inserts into
+-- stock whose hash is already archived, as the UNIQUE content constraint
+-- did before archiving.
+--
+-- Only one row per hash may carry it: older archives can hold content
+-- that was archived, re-imported and archived again, or that is back in
+-- the hot table. Those extra copies keep a NULL hash, which the unique
+-- index allows; the copy that holds the hash still blocks the content.
+
+ALTER TABLE stock_archive ADD COLUMN content_hash BLOB;
+
+UPDATE stock_archive SET content_hash = stock_content_hash(content)
+WHERE id IN (SELECT MIN(id) FROM stock_archive GROUP BY content)
+  AND NOT EXISTS (
+      SELECT 1 FROM stock s WHERE s.content_hash = stock_content_hash(stock_archive.content)
+  );
+
+CREATE UNIQUE INDEX idx_stock_archive_content_hash ON stock_archive(content_hash);
+
+CREATE TRIGGER stock_archived_content_guard
+BEFORE INSERT ON stock
+WHEN EXISTS (SELECT 1 FROM stock_archive WHERE content_hash = NEW.content_hash)
+BEGIN
+    SELECT RAISE(ABORT, 'UNIQUE constraint failed: stock_archive.content_hash');
+END;
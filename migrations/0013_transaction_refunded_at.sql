@@ -0,0 +1,18 @@
+-- Refund state on the purchase itself. cancel_transaction checks and sets
+-- refunded_at in the same write as the credit, so a purchase can only be
+-- refunded once however long ago the first refund was; the idempotency
+-- key alone expires after IDEMPOTENCY_RETENTION_DAYS.
+
+ALTER TABLE transactions ADD COLUMN refunded_at TIMESTAMP;
+ALTER TABLE transactions_archive ADD COLUMN refunded_at TIMESTAMP;
+
+-- Earlier refunds are only recorded as REFUND rows naming the purchase
+UPDATE transactions SET refunded_at = (
+    SELECT MIN(r.created_at) FROM transactions r
+    WHERE r.growid = transactions.growid AND r.type = 'REFUND'
+      AND r.details = 'Refund for transaction #' || transactions.id
+)
+WHERE type = 'PURCHASE' AND id IN (
+    SELECT CAST(substr(details, 25) AS INTEGER) FROM transactions
+    WHERE type = 'REFUND' AND details LIKE 'Refund for transaction #%'
+);
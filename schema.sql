@@ -1,39 +0,0 @@
--- Table for products
-CREATE TABLE IF NOT EXISTS products (
-    code TEXT PRIMARY KEY,
-    name TEXT NOT NULL,
-    price INTEGER NOT NULL,
-    description TEXT
-);
-
--- Table for stock
-CREATE TABLE IF NOT EXISTS stock (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    product_code TEXT NOT NULL,
-    content TEXT NOT NULL,
-    status TEXT NOT NULL DEFAULT 'AVAILABLE',
-    buyer_id TEXT,
-    seller_id TEXT,
-    added_by TEXT,
-    added_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    used_at DATETIME,
-    FOREIGN KEY (product_code) REFERENCES products(code)
-);
-
--- Table for transactions
-CREATE TABLE IF NOT EXISTS transactions (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    growid TEXT NOT NULL,
-    type TEXT NOT NULL,
-    details TEXT,
-    old_balance TEXT,
-    new_balance TEXT,
-    items_count INTEGER,
-    total_price INTEGER,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-);
-
--- Indices
-CREATE INDEX IF NOT EXISTS idx_stock_product_code ON stock(product_code);
-CREATE INDEX IF NOT EXISTS idx_stock_status ON stock(status);
-CREATE INDEX IF NOT EXISTS idx_transactions_growid ON transactions(growid);
\ No newline at end of file
@@ -0,0 +1,84 @@
+"""Donation webhook path: GrowID lookup, balance credit and replay safety.
+
+Runs the real Donate cog against a migrated scratch database:
+
+    python -m pytest tests
+"""
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("discord")
+
+from database import configure, migrate, db, pool
+from ext.donate import Donate
+
+class FakeBot:
+    """No donation_log_channel_id, so the cog skips its log messages"""
+
+    def dispatch(self, event: str, *args):
+        pass
+
+    def get_channel(self, channel_id):
+        return None
+
+def webhook_message(message_id: int, growid: str, deposit: str):
+    return SimpleNamespace(
+        id=message_id,
+        webhook_id=1,
+        content=f"GrowID: {growid}\nDeposit: {deposit}"
+    )
+
+@pytest.fixture
+def shop_db(tmp_path):
+    path = str(tmp_path / "shop.db")
+    migrate(path)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("INSERT INTO users (growid, balance_wl) VALUES ('Buyer1', 0)")
+        conn.execute("INSERT INTO user_growid (discord_id, growid) VALUES ('1001', 'Buyer1')")
+    conn.close()
+    configure(path)
+    yield path
+    db.close()
+    pool.close()
+
+def _balance_and_deposits(path: str, growid: str):
+    conn = sqlite3.connect(path)
+    try:
+        balance = conn.execute("SELECT balance_wl FROM users WHERE growid = ?", (growid,)).fetchone()[0]
+        deposits = conn.execute(
+            "SELECT COUNT(*) FROM transactions WHERE growid = ? AND type = 'DEPOSIT'", (growid,)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    return balance, deposits
+
+def test_donation_credits_registered_growid(shop_db):
+    cog = Donate(FakeBot())
+    assert asyncio.run(cog._get_discord_id("Buyer1")) == "1001"
+
+    asyncio.run(cog.on_message(webhook_message(500, "Buyer1", "5 Diamond Lock, 20 World Lock")))
+
+    assert _balance_and_deposits(shop_db, "Buyer1") == (520, 1)
+
+def test_replayed_donation_is_credited_once(shop_db):
+    cog = Donate(FakeBot())
+    message = webhook_message(501, "Buyer1", "1 Blue Gem Lock")
+
+    async def _deliver_twice():
+        await cog.on_message(message)
+        await cog.on_message(message)
+
+    asyncio.run(_deliver_twice())
+
+    assert _balance_and_deposits(shop_db, "Buyer1") == (10000, 1)
+
+def test_unregistered_growid_is_ignored(shop_db):
+    cog = Donate(FakeBot())
+
+    asyncio.run(cog.on_message(webhook_message(502, "Nobody", "10 World Lock")))
+
+    assert _balance_and_deposits(shop_db, "Buyer1") == (0, 0)
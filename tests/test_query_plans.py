@@ -0,0 +1,30 @@
+"""Hot query plans on a freshly migrated database.
+
+The same check as ``python database.py check-plans``: every query in
+HOT_QUERIES must be served by its indexes, without scanning a table it
+is not allowed to scan or sorting in a temp b-tree.
+"""
+import sqlite3
+
+import pytest
+
+from database import HOT_QUERIES, check_query_plans, migrate, _configure_connection
+
+@pytest.fixture
+def conn(tmp_path):
+    path = str(tmp_path / "shop.db")
+    migrate(path)
+    conn = _configure_connection(sqlite3.connect(path))
+    yield conn
+    conn.close()
+
+def test_hot_queries_use_their_indexes(conn):
+    assert check_query_plans(conn) == {}
+
+def test_missing_index_is_reported(conn):
+    conn.execute("DROP INDEX idx_stock_available_fifo")
+
+    problems = check_query_plans(conn)
+
+    assert 'stock_fifo_pick' in problems
+    assert set(problems) <= set(HOT_QUERIES)